@@ -7,12 +7,33 @@ for the SAML-based application in the SSO proof of concept.
 
 import os
 import json
+import time
 from flask import Flask, request, redirect, session, jsonify, url_for
 from flask_cors import CORS
 from onelogin.saml2.auth import OneLogin_Saml2_Auth
 from onelogin.saml2.utils import OneLogin_Saml2_Utils
+from onelogin.saml2.logout_request import OneLogin_Saml2_Logout_Request
+from onelogin.saml2.logout_response import OneLogin_Saml2_Logout_Response
+from onelogin.saml2.xml_utils import OneLogin_Saml2_XML
 from functools import wraps
+from sessions import init_session_store, regenerate_session
+from roles import load_role_hierarchy
+from role_mapping import load_role_mapper
+from policy import create_policy_engine, DECISION_BUCKETS, UNCOVERED
+from user_view import UserViewCache, ANONYMOUS_VERSION, view_version, parse_fields, etag_for
+from instrumentation import create_metrics, init_instrumentation
 from urllib.parse import urlparse
+from saml_settings import SAMLSettingsCache
+from authn_request import AuthnRequestTemplates
+from idp_registry import create_idp_registry, find_issuer
+from saml_parser import decode_saml_response, parse_saml_message
+from audit import create_audit_sink
+from replay_cache import create_replay_caches
+from session_registry import create_session_registry
+from rate_limit import init_rate_limiting
+from validation_pool import create_validation_pool, ValidationRejected
+from warmup import create_warmup, init_readiness
+import xmlsec
 
 # Initialize Flask application
 app = Flask(__name__)
@@ -27,23 +48,177 @@ app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HT
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection while allowing IdP redirects
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # Session timeout: 1 hour
 
+# Keep session data server-side - the cookie only carries an opaque session ID
+# SESSION_BACKEND=memory|sqlite|cookie selects the store (see sessions.py)
+init_session_store(app)
+
+# Per-stage timing histograms exposed on /metrics in Prometheus format (see instrumentation.py)
+# SERVER_TIMING_ENABLED=true also reports them in a Server-Timing response header
+metrics = create_metrics('saml_backend')
+init_instrumentation(app, metrics)
+
 # Enable CORS for frontend application
 # In production, origins should be restricted to actual frontend domains
 CORS(app, supports_credentials=True, origins=['http://localhost:3001'])
 
-def init_saml_auth(req):
+# Token buckets per client IP and per session (callbacks per IP only) in front of the endpoints
+# that reach Keycloak; exhausted buckets are answered 429 before the session is loaded (see rate_limit.py)
+# RATE_LIMIT_BACKEND=memory|sqlite, RATE_LIMIT_ENABLED=false turns it off
+rate_limiter = init_rate_limiting(app, ('/saml/login', '/saml/callback'), ip_only_paths=('/saml/callback',))
+
+def rate_limit_metrics():
+    """Report rate limiter counters on /metrics."""
+    if rate_limiter is None:
+        return []
+    stats = rate_limiter.stats()
+    samples = [
+        ('rate_limit_buckets', 'gauge', 'Token buckets held by the rate limiter', stats.pop('size')),
+        ('rate_limit_evicted_total', 'counter', 'Token buckets evicted before they were full', stats.pop('evicted')),
+    ]
+    for name, value in stats.items():
+        samples.append((f'rate_limit_{name}_total', 'counter', f'Login requests {name.replace("_", " by ")}', value))
+    return samples
+
+metrics.register_collector(rate_limit_metrics)
+
+# SAML settings are parsed and validated once and shared across requests
+# The settings files are re-checked at most once per interval and hot-reloaded on change
+# SAML_SETTINGS_PATH points at another settings directory (default: ./saml next to this file)
+saml_settings = SAMLSettingsCache(
+    os.environ.get('SAML_SETTINGS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saml')),
+    check_interval=float(os.environ.get('SAML_SETTINGS_CHECK_INTERVAL', 1.0))
+)
+
+# /saml/login renders AuthnRequests from a template built once per settings version,
+# verified against python3-saml's output (see authn_request.py)
+authn_templates = AuthnRequestTemplates(saml_settings)
+
+# Federated IdPs besides the one in settings.json, loaded from SAML metadata files or URLs into
+# an index by entityID; responses are routed to their IdP by Issuer (see idp_registry.py)
+# SAML_IDP_METADATA lists the sources, refreshed every SAML_IDP_METADATA_REFRESH_INTERVAL seconds
+idp_registry = create_idp_registry(saml_settings, authn_templates)
+
+def idp_registry_metrics():
+    """Report IdP registry counters on /metrics."""
+    stats = idp_registry.stats()
+    samples = [
+        ('saml_idps', 'gauge', 'Federated IdPs loaded from metadata', stats.pop('idps')),
+        ('saml_idp_metadata_sources', 'gauge', 'IdP metadata sources', stats.pop('sources')),
+    ]
+    for name, value in stats.items():
+        samples.append((f'saml_idp_metadata_{name}_total', 'counter', f'IdP metadata {name.replace("_", " ")}', value))
+    return samples
+
+metrics.register_collector(idp_registry_metrics)
+
+# Opt-in audit/debug sink - bounded queue drained by a background thread (see audit.py)
+audit_sink = create_audit_sink()
+
+def audit_metrics():
+    """Report audit sink counters on /metrics."""
+    stats = audit_sink.stats()
+    samples = [('audit_queue_depth', 'gauge', 'Audit entries waiting to be written', stats.pop('queue_depth'))]
+    for name, value in stats.items():
+        samples.append((f'audit_{name}_total', 'counter', f'Audit entries {name.replace("_", " ")}', value))
+    return samples
+
+metrics.register_collector(audit_metrics)
+
+# One-time ID tracking: consumed assertion IDs (until NotOnOrAfter) and AuthnRequest IDs
+# awaiting a response (for SAML_REQUEST_TTL seconds). SAML_REPLAY_BACKEND=memory|sqlite (see replay_cache.py)
+seen_assertions, outstanding_requests = create_replay_caches()
+SAML_REQUEST_TTL = int(os.environ.get('SAML_REQUEST_TTL', 600))
+# How long to remember an assertion whose NotOnOrAfter is unknown (only validated in strict mode)
+SAML_ASSERTION_TTL = int(os.environ.get('SAML_ASSERTION_TTL', 600))
+
+def replay_metrics():
+    """Report replay cache counters on /metrics."""
+    samples = []
+    for cache_name, cache in (('assertion', seen_assertions), ('authn_request', outstanding_requests)):
+        stats = cache.stats()
+        samples.append((f'{cache_name}_ids', 'gauge', f'{cache_name} IDs held by the replay cache',
+                        stats.pop('size')))
+        for name, value in stats.items():
+            samples.append((f'{cache_name}_ids_{name}_total', 'counter',
+                            f'{cache_name} IDs {name}', value))
+    return samples
+
+metrics.register_collector(replay_metrics)
+
+# Response validation (XML canonicalization, signature checks) runs on a small, bounded pool so a
+# login burst can't occupy every request thread; when it is saturated the callback answers 503
+# SAML_VALIDATION_WORKERS / _QUEUE_SIZE / _DEADLINE / _RETRY_AFTER size it (see validation_pool.py)
+validation_wait = metrics.histogram('saml_validation_wait_seconds',
+                                    'Time SAML responses waited for a validation worker by outcome', 'outcome')
+validation_pool = create_validation_pool(on_wait=validation_wait.observe)
+
+def validation_pool_metrics():
+    """Report validation pool counters on /metrics."""
+    stats = validation_pool.stats()
+    samples = [
+        ('saml_validation_queue_depth', 'gauge', 'SAML responses waiting for a validation worker',
+         stats.pop('queue_depth')),
+        ('saml_validation_running', 'gauge', 'SAML responses being validated', stats.pop('running')),
+    ]
+    for name, value in stats.items():
+        samples.append((f'saml_validation_{name}_total', 'counter', f'SAML validations {name}', value))
+    return samples
+
+metrics.register_collector(validation_pool_metrics)
+
+def check_replay(entity_id, assertion_id, in_response_to, not_on_or_after):
+    """
+    Reject replayed assertions and, in strict mode, unsolicited responses.
+    
+    The assertion ID is recorded until the assertion expires; the
+    AuthnRequest it answers is consumed, so each login request can be
+    answered only once, and only by the IdP it was sent to.
+    
+    Args:
+        entity_id: entityID of the IdP the response was validated for
+        assertion_id: ID of the (validated) assertion
+        in_response_to: InResponseTo of the response, None if unsolicited
+        not_on_or_after: Unix timestamp the assertion expires at, if known
+        
+    Returns:
+        str: Error message, or None if the response may be accepted
+    """
+    strict = saml_settings.get().is_strict()
+    if assertion_id:
+        expires_at = not_on_or_after or time.time() + SAML_ASSERTION_TTL
+        if not seen_assertions.add(assertion_id, expires_at):
+            return 'SAML assertion has already been used'
+    elif strict:
+        return 'SAML assertion has no ID'
+    
+    if in_response_to:
+        if not outstanding_requests.pop(f'{entity_id} {in_response_to}') and strict:
+            return 'SAML response does not answer an outstanding AuthnRequest'
+    elif strict:
+        return 'Unsolicited SAML responses are not accepted'
+    return None
+
+def init_saml_auth(req, idp=None):
     """
     Initialize SAML authentication object with configuration.
     
+    Binds the request data to the cached, prebuilt settings object instead
+    of re-reading settings.json on every request.
+    
     Args:
         req: Prepared request object containing SAML parameters
+        idp: IdPEntry to talk to, None for the IdP in settings.json
         
     Returns:
         OneLogin_Saml2_Auth: Configured SAML auth object
     """
-    auth = OneLogin_Saml2_Auth(req, custom_base_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saml'))
+    auth = OneLogin_Saml2_Auth(req, old_settings=idp.settings if idp is not None else saml_settings.get())
     return auth
 
+def session_idp():
+    """Return the IdP the current session logged in with (the default IdP if it is no longer trusted)."""
+    return idp_registry.get(session.get('samlIdP')) or idp_registry.default()
+
 def prepare_flask_request(request):
     """
     Prepare Flask request for SAML processing.
@@ -81,6 +256,9 @@ def require_auth(f):
     """
     Decorator to enforce authentication on protected endpoints.
     
+    A backstop for enforce_policy: views that need a user keep working
+    safely if a policy edit stops covering them.
+    
     Returns 401 Unauthorized if user is not authenticated.
     """
     @wraps(f)
@@ -90,69 +268,170 @@ def require_auth(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def check_role_hierarchy(user_roles, required_role):
+# Role hierarchy compiled once at startup into a transitive closure
+# ROLE_HIERARCHY / ROLE_HIERARCHY_FILE override the default admin > editor > viewer (see roles.py)
+role_hierarchy = load_role_hierarchy()
+# IdP role/group attributes are mapped to the hierarchy's roles at login; everything else is
+# dropped before it reaches the session (see role_mapping.py, ROLE_MAPPING_FILE)
+role_mapper = load_role_mapper(role_hierarchy, 'saml')
+
+def get_role_mask():
     """
-    Check if user has required role considering role hierarchy.
+    Get the user's effective-role bitmask cached in the session.
     
-    Implements hierarchical RBAC where higher roles inherit permissions
-    of lower roles (admin > editor > viewer).
+    The mask is resolved at login; it is recomputed here only if it is
+    missing or was built from a different role hierarchy.
     
-    Args:
-        user_roles: List of roles assigned to the user
-        required_role: The role required to access the resource
-        
     Returns:
-        bool: True if user has required role or a higher role
+        int: Bitmask of the user's effective roles (including inherited ones)
     """
-    # Define role hierarchy - higher roles inherit permissions of lower roles
-    role_hierarchy = {
-        'admin': ['editor', 'viewer'],  # Admin can do everything editor and viewer can
-        'editor': ['viewer'],            # Editor can do everything viewer can
-        'viewer': []                     # Viewer has no inherited permissions
-    }
-    
-    # Direct role check
-    if required_role in user_roles:
-        return True
-    
-    # Check hierarchical roles
-    for user_role in user_roles:
-        if user_role in role_hierarchy and required_role in role_hierarchy[user_role]:
-            return True
+    if session.get('role_version') != role_hierarchy.version:
+        session['role_mask'] = role_hierarchy.effective_mask(session.get('roles', []))
+        session['role_version'] = role_hierarchy.version
+    return session['role_mask']
+
+# Sessions are indexed by SAML NameID and SessionIndex so an IdP-initiated logout can revoke
+# all of them; revoked sessions are cleared on their next request (see session_registry.py)
+# SESSION_REGISTRY_BACKEND=memory|sqlite selects the store
+session_registry = create_session_registry(app)
+
+def session_registry_metrics():
+    """Report session registry counters on /metrics."""
+    stats = session_registry.stats()
+    samples = [('revoked_sessions', 'gauge', 'Revoked sessions not yet expired', stats.pop('revoked_sessions'))]
+    if 'sessions' in stats:
+        samples.append(('registered_sessions', 'gauge', 'Sessions held in the registry', stats.pop('sessions')))
+    for name, value in stats.items():
+        samples.append((f'session_registry_{name}_total', 'counter', f'Sessions {name}', value))
+    return samples
+
+metrics.register_collector(session_registry_metrics)
+
+@app.before_request
+def drop_revoked_session():
+    """
+    Clear the session if it was revoked by an IdP-initiated logout or its login has expired.
     
-    return False
+    The expiry is absolute: activity doesn't extend it, so a session never
+    outlives its registration and any revocation of it.
+    """
+    registry_id = session.get('registry_id')
+    if registry_id is None:
+        return
+    if time.time() >= session.get('registry_expires_at', 0) or session_registry.is_revoked(registry_id):
+        session.clear()
 
-def require_role(role):
+def revoke_saml_sessions(logout_request_xml, entity_id):
     """
-    Decorator factory to enforce role-based access control.
+    Revoke every local session a LogoutRequest addresses.
     
-    Creates a decorator that checks if the authenticated user has the
-    required role (or a higher role in the hierarchy) before allowing
-    access to the endpoint.
+    Only the listed SessionIndexes are revoked; without any, all sessions
+    of the NameID are. Sessions are indexed per IdP, so one IdP cannot log
+    out users of another.
     
     Args:
-        role: The minimum role required to access the endpoint
+        logout_request_xml: LogoutRequest XML (string or bytes)
+        entity_id: entityID of the IdP the LogoutRequest was validated for
         
     Returns:
-        decorator: Function decorator that enforces the role requirement
-    """
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            # First check authentication
-            if not session.get('authenticated', False):
-                return jsonify({'error': 'Authentication required'}), 401
-            
-            user_roles = session.get('roles', [])
-            
-            # Check if user has the required role (including hierarchy)
-            if not check_role_hierarchy(user_roles, role):
-                return jsonify({'error': f'Role {role} required. User has roles: {user_roles}'}), 403
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
+        int: Number of sessions revoked
+    """
+    session_indexes = OneLogin_Saml2_Logout_Request.get_session_indexes(logout_request_xml)
+    if session_indexes:
+        keys = [f'saml_session:{entity_id} {index}' for index in session_indexes]
+    else:
+        keys = [f'nameid:{entity_id} {OneLogin_Saml2_Logout_Request.get_nameid(logout_request_xml)}']
+    return sum(session_registry.revoke(key) for key in keys)
 
+# Route-level authorization from policy.json (roles -> permissions -> route patterns),
+# compiled into a per-endpoint decision table and hot-reloaded on change (see policy.py)
+# POLICY_FILE points at another policy file
+policy_engine = create_policy_engine(app, role_hierarchy)
+policy_decisions = metrics.histogram('policy_decision_seconds', 'Authorization decision latency by outcome',
+                                     'outcome', buckets=DECISION_BUCKETS)
+
+@app.before_request
+def enforce_policy():
+    """
+    Authorize the request against the policy's decision table.
+    
+    Covered routes require authentication and, unless the rule only asks
+    for that, a role that grants the rule's permission - a dict lookup and
+    a bitwise AND. Public routes and routes outside the guarded prefixes
+    pass through; uncovered /api/ routes are denied.
+    """
+    start = time.perf_counter()
+    rule = policy_engine.lookup(request.endpoint, request.method)
+    outcome = 'unguarded'
+    if rule is UNCOVERED:
+        outcome = 'uncovered'
+    elif rule is not None and rule.public:
+        outcome = 'public'
+    elif rule is not None:
+        if not session.get('authenticated', False):
+            outcome = 'unauthenticated'
+        elif rule.mask is not None and not get_role_mask() & rule.mask:
+            outcome = 'deny'
+        else:
+            outcome = 'allow'
+    policy_decisions.observe(outcome, time.perf_counter() - start)
+    
+    if outcome == 'uncovered':
+        return jsonify({'error': 'Route is not covered by the authorization policy'}), 403
+    if outcome == 'unauthenticated':
+        return jsonify({'error': 'Authentication required'}), 401
+    if outcome == 'deny':
+        user_roles = session.get('roles', [])
+        return jsonify({'error': f'Permission {rule.permission} required. User has roles: {user_roles}'}), 403
+
+
+# /api/user documents are serialized once per session version and cached process-wide;
+# responses carry an ETag so polling frontends get 304 Not Modified (see user_view.py)
+user_views = UserViewCache(max_entries=int(os.environ.get('USER_VIEW_CACHE_SIZE', 4096)))
+
+def user_view_metrics():
+    """Report user view cache counters on /metrics."""
+    stats = user_views.stats()
+    samples = [('user_view_cache_entries', 'gauge', 'Serialized user views cached', stats.pop('entries'))]
+    for name, value in stats.items():
+        samples.append((f'user_view_{name}_total', 'counter', f'User view requests ({name.replace("_", " ")})', value))
+    return samples
+
+metrics.register_collector(user_view_metrics)
+
+def build_user_view():
+    """
+    Assemble the /api/user document from the session.
+    
+    Returns:
+        dict: User information, or authenticated: false
+    """
+    if not session.get('authenticated', False):
+        return {'authenticated': False}
+    return {
+        'authenticated': True,
+        'username': session.get('username', ''),
+        'email': session.get('email', ''),
+        'roles': session.get('roles', []),
+        'attributes': session.get('samlUserdata', {})
+    }
+
+def current_view_version():
+    """
+    Get the version of the session's user view.
+    
+    The version is fingerprinted at login; sessions created before that
+    are fingerprinted lazily on their first /api/user call.
+    
+    Returns:
+        str: View version, also the base of the ETag
+    """
+    if not session.get('authenticated', False):
+        return ANONYMOUS_VERSION
+    version = session.get('user_view_version')
+    if version is None:
+        version = session['user_view_version'] = view_version(build_user_view())
+    return version
 
 @app.route('/api/user')
 def get_user():
@@ -160,20 +439,26 @@ def get_user():
     Get current user information from session.
     
     Returns user details if authenticated, otherwise returns
-    authenticated: false.
+    authenticated: false. ?fields=username,roles limits the response to
+    the listed fields. Repeat calls with the ETag in If-None-Match get
+    304 Not Modified until the session's user changes.
     
     Returns:
         JSON response with user information or authentication status
     """
-    if session.get('authenticated', False):
-        return jsonify({
-            'authenticated': True,
-            'username': session.get('username', ''),
-            'email': session.get('email', ''),
-            'roles': session.get('roles', []),
-            'attributes': session.get('samlUserdata', {})
-        })
-    return jsonify({'authenticated': False})
+    fields = parse_fields(request.args.get('fields'))
+    version = current_view_version()
+    etag = etag_for(version, fields)
+    if request.if_none_match.contains(etag):
+        user_views.count_not_modified()
+        response = app.response_class(status=304)
+    else:
+        body = user_views.render(version, fields, build_user_view)
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Cached by the browser, but revalidated on every poll
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/protected')
 @require_auth
@@ -182,7 +467,7 @@ def protected_resource():
     Example protected endpoint requiring authentication.
     
     Demonstrates basic authentication requirement without
-    specific role requirements.
+    specific role requirements (see policy.json).
     """
     return jsonify({
         'message': 'This is a protected resource',
@@ -190,12 +475,13 @@ def protected_resource():
     })
 
 @app.route('/api/admin')
-@require_role('admin')
+@require_auth
 def admin_resource():
     """
     Admin-only endpoint demonstrating role-based access control.
     
-    Only users with 'admin' role can access this endpoint.
+    Requires the admin:access permission, which policy.json grants
+    to the 'admin' role only.
     """
     return jsonify({
         'message': 'This is an admin-only resource',
@@ -203,12 +489,13 @@ def admin_resource():
     })
 
 @app.route('/api/editor')
-@require_role('editor')
+@require_auth
 def editor_resource():
     """
     Editor endpoint demonstrating hierarchical RBAC.
     
-    Accessible by users with 'editor' role or higher (admin).
+    Requires the content:edit permission (policy.json), granted to the
+    'editor' role and so also to roles above it (admin).
     """
     return jsonify({
         'message': 'This is an editor-only resource',
@@ -222,10 +509,24 @@ def saml_login():
     Initiate SAML authentication flow.
     
     Redirects user to Identity Provider (IdP) for authentication.
+    The optional idp query parameter selects a federated IdP by entityID.
     """
+    idp = idp_registry.get(request.args.get('idp'))
+    if idp is None:
+        return jsonify({'error': 'Unknown IdP'}), 400
     req = prepare_flask_request(request)
-    auth = init_saml_auth(req)
-    return redirect(auth.login())
+    template = idp.template
+    with metrics.timer('authn_request'):
+        if template is not None:
+            # Only the ID and IssueInstant are filled in per request
+            request_id, login_url = template.login(req)
+        else:
+            auth = init_saml_auth(req, idp)
+            login_url = auth.login()
+            request_id = auth.get_last_request_id()
+    # Remember the AuthnRequest so its response's InResponseTo can be checked
+    outstanding_requests.add(f'{idp.entity_id} {request_id}', time.time() + SAML_REQUEST_TTL)
+    return redirect(login_url)
 
 @app.route('/saml/callback', methods=['POST'])
 def saml_callback():
@@ -236,93 +537,101 @@ def saml_callback():
     establishes user session, and redirects to frontend application.
     
     This endpoint handles the special case of duplicate attribute names
-    (common with role attributes) by manually parsing the SAML response.
+    (common with role attributes) by parsing the SAML response with the
+    single-pass parser in saml_parser.py.
     """
-    req = prepare_flask_request(request)
-    auth = init_saml_auth(req)
-    
     attributes = None
     nameid = None
+    session_index = None
+    assertion_id = in_response_to = not_on_or_after = None
     errors = []
     
+    # Decode the response once; both the fallback parser and the debug dump reuse it
+    saml_response = request.form.get('SAMLResponse')
+    try:
+        decoded = decode_saml_response(saml_response) if saml_response else None
+    except Exception as e:
+        return jsonify({'error': f'Invalid SAMLResponse: {e}'}), 400
+    
+    # Validate against the certificates of the IdP named in the Issuer - one dict lookup
+    idp = idp_registry.get(find_issuer(decoded) if decoded is not None else None)
+    if idp is None:
+        return jsonify({'error': 'SAML response was not issued by a trusted IdP'}), 400
+    req = prepare_flask_request(request)
+    auth = init_saml_auth(req, idp)
+    
     try:
-        auth.process_response()
+        with metrics.timer('saml_process_response'):
+            validation_pool.run(auth.process_response)
         errors = auth.get_errors()
         if not errors:
+            # python3-saml has already parsed (and, if encrypted, decrypted) the assertion;
+            # saml_parser.py is only needed when it rejects repeated attribute names
             attributes = auth.get_attributes()
             nameid = auth.get_nameid()
+            session_index = auth.get_session_index()
+            assertion_id = auth.get_last_assertion_id()
+            in_response_to = auth.get_last_response_in_response_to()
+            not_on_or_after = auth.get_last_assertion_not_on_or_after()
     except Exception as e:
         # Handle duplicate attribute error (common with multiple role values)
         # This occurs when IdP sends multiple values for the same attribute name
-        if "duplicated Name" in str(e):
-            # Parse SAML response manually to handle duplicate attributes
-            import xml.etree.ElementTree as ET
-            import base64
-            
-            saml_response = request.form.get('SAMLResponse')
-            decoded = base64.b64decode(saml_response)
-            root = ET.fromstring(decoded)
-            
-            # Extract attributes manually from XML
-            attributes = {}
-            # Define SAML 2.0 XML namespaces
-            namespaces = {
-                'saml': 'urn:oasis:names:tc:SAML:2.0:assertion',
-                'samlp': 'urn:oasis:names:tc:SAML:2.0:protocol'
-            }
-            
-            # Parse all SAML attributes from the assertion
-            for attr in root.findall('.//saml:Attribute', namespaces):
-                name = attr.get('Name')
-                values = []
-                for value in attr.findall('saml:AttributeValue', namespaces):
-                    if value.text:
-                        values.append(value.text)
-                if name and values:
-                    if name not in attributes:
-                        attributes[name] = values
-                    else:
-                        # Handle multiple attributes with same name (e.g., multiple roles)
-                        # This is the case that causes the "duplicated Name" error
-                        if isinstance(attributes[name], list):
-                            attributes[name].extend(values)
-                        else:
-                            attributes[name] = [attributes[name]] + values
-            
-            # Get NameID
-            nameid_elem = root.find('.//saml:NameID', namespaces)
-            nameid = nameid_elem.text if nameid_elem is not None else ''
+        if "duplicated Name" in str(e) and decoded is not None:
+            # Single streaming pass over the response; repeated attribute
+            # names are merged into one value list by the parser
+            parsed = parse_saml_message(decoded)
+            attributes = parsed['attributes']
+            nameid = parsed['nameid'] or ''
+            session_index = parsed['session_index']
+            assertion_id = parsed['assertion_id']
+            in_response_to = parsed['in_response_to']
+            if parsed['not_on_or_after']:
+                not_on_or_after = OneLogin_Saml2_Utils.parse_SAML_to_time(parsed['not_on_or_after'])
             
             # Process the attributes as if auth.process_response() succeeded
             errors = []
+        elif isinstance(e, ValidationRejected):
+            # Nothing has been consumed yet - the same response can be posted again
+            print(f"SAML response not validated: {e}")
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
         else:
             return jsonify({'error': str(e)}), 400
     
     if not errors and attributes is not None:
-        # Extract roles from SAML attributes
-        # Different IdPs use different attribute names for roles
-        roles = []
-        # Common role attribute names used by various IdPs
-        role_attrs = ['userRoles', 'Role', 'roles', 'memberOf', 'groups', 'role']
-        for attr_name in role_attrs:
-            if attr_name in attributes:
-                attr_value = attributes[attr_name]
-                if isinstance(attr_value, list):
-                    roles.extend(attr_value)
-                else:
-                    roles.append(attr_value)
+        # Each assertion is accepted once; strict mode also requires a matching AuthnRequest
+        replay_error = check_replay(idp.entity_id, assertion_id, in_response_to, not_on_or_after)
+        if replay_error:
+            print(f"SAML response rejected: {replay_error}")
+            return jsonify({'error': replay_error}), 400
         
-        # Remove duplicates and ensure we have a clean list
-        roles = list(set(roles))
+        # Map the role attributes (different IdPs use different names) to the application's roles;
+        # a federated IdP may only assign the roles role_mapping.json's idp_roles allows it
+        with metrics.timer('role_mapping'):
+            roles = role_mapper.map(attributes, issuer=idp.entity_id if idp.federated else None)
+        username = attributes.get('username', [''])[0] if attributes.get('username') else ''
+        if idp.federated:
+            # Qualified by the IdP, so one IdP can't log in as another's (or the default IdP's) users
+            username = f'{idp.entity_id}|{username}'
         
+        # New session ID at login, so an ID planted before authentication is never authenticated
+        regenerate_session(session)
         # Establish authenticated session with user data
         session['authenticated'] = True
-        session['username'] = attributes.get('username', [''])[0] if attributes.get('username') else ''
+        session['username'] = username
         session['email'] = attributes.get('email', [''])[0] if attributes.get('email') else ''
         session['roles'] = roles
+        # Resolve effective permissions once at login so each policy decision is a single bitwise check
+        session['role_mask'] = role_hierarchy.effective_mask(roles)
+        session['role_version'] = role_hierarchy.version
         # Store SAML-specific data for logout
+        session['samlIdP'] = idp.entity_id
         session['samlNameId'] = nameid
-        session['samlSessionIndex'] = auth.get_session_index() if hasattr(auth, 'get_session_index') else None
+        session['samlSessionIndex'] = session_index
+        # Index the session so an IdP-initiated logout can revoke it
+        session['registry_id'], session['registry_expires_at'] = session_registry.register(
+            (f'nameid:{idp.entity_id} {nameid}',
+             f'saml_session:{idp.entity_id} {session_index}' if session_index else None)
+        )
         
         # Store sanitized user attributes for frontend use
         session['samlUserdata'] = {
@@ -330,24 +639,16 @@ def saml_callback():
             'email': session['email'],
             'roles': roles
         }
+        # Fingerprint the /api/user view once; polls are answered from the cache or with 304
+        session['user_view_version'] = view_version(build_user_view())
         
         # Log authentication success for monitoring
         print(f"SAML Auth Success - User: {session['username']}, Roles: {roles}")
-        print(f"All SAML Attributes: {attributes}")
         
-        # Debug mode: Save SAML response for troubleshooting
-        # Remove this block in production
-        import base64
-        saml_response = request.form.get('SAMLResponse')
-        if saml_response:
-            try:
-                decoded = base64.b64decode(saml_response)
-                # Save decoded SAML response for analysis
-                with open('/tmp/saml_response_debug.xml', 'wb') as f:
-                    f.write(decoded)
-                print("SAML Response saved to /tmp/saml_response_debug.xml")
-            except Exception as e:
-                print(f"Error saving SAML response: {e}")
+        # Debug mode: hand the decoded response and attributes to the audit sink
+        # Written by a background thread; a no-op unless SAML_AUDIT_ENABLED=true
+        audit_sink.submit('saml_login', username=session['username'], nameid=nameid,
+                          roles=roles, attributes=attributes, response=decoded)
         
         # Redirect to frontend
         return redirect('http://localhost:3001/')
@@ -363,8 +664,13 @@ def saml_logout():
     Sends logout request to IdP with session information to ensure
     proper logout from both SP and IdP.
     """
+    idp = session_idp()
+    if not idp.settings.get_idp_slo_url():
+        # Federated IdP without Single Logout - end the local session only
+        session.clear()
+        return redirect('http://localhost:3001/')
     req = prepare_flask_request(request)
-    auth = init_saml_auth(req)
+    auth = init_saml_auth(req, idp)
     
     # Retrieve SAML session information needed for logout
     name_id = session_index = name_id_format = name_id_nq = name_id_spnq = None
@@ -398,7 +704,8 @@ def saml_sls():
     Handles both logout requests and responses.
     """
     req = prepare_flask_request(request)
-    auth = init_saml_auth(req)
+    idp = session_idp()
+    auth = init_saml_auth(req, idp)
     
     # Check if this is a SAML logout request/response
     if 'SAMLRequest' not in request.args and 'SAMLResponse' not in request.args:
@@ -408,9 +715,14 @@ def saml_sls():
     
     try:
         # Process SAML logout response and clear session
-        url = auth.process_slo(delete_session_cb=lambda: session.clear())
+        with metrics.timer('saml_process_slo'):
+            url = auth.process_slo(delete_session_cb=lambda: session.clear())
         errors = auth.get_errors()
         if not errors:
+            if 'SAMLRequest' in request.args:
+                # IdP-initiated logout - also revoke the user's sessions in other browsers
+                logout_request = OneLogin_Saml2_Logout_Request(idp.settings, request.args['SAMLRequest'])
+                revoke_saml_sessions(logout_request.get_xml(), idp.entity_id)
             # Successful logout - redirect to frontend
             return redirect('http://localhost:3001/')
         else:
@@ -422,8 +734,129 @@ def saml_sls():
         session.clear()
         return redirect('http://localhost:3001/')
 
+@app.route('/saml/backchannel-logout', methods=['POST'])
+def saml_backchannel_logout():
+    """
+    Handle a back-channel (server-to-server) LogoutRequest from the IdP.
+    
+    Accepts the SOAP binding (LogoutRequest in a SOAP envelope) and the
+    HTTP-POST binding (SAMLRequest form field). The call carries no browser
+    session, so the request must be signed by the IdP; all sessions it
+    addresses are revoked through the session registry.
+    """
+    soap = 'SAMLRequest' not in request.form
+    try:
+        xml = request.get_data() if soap else decode_saml_response(request.form['SAMLRequest'])
+        root = OneLogin_Saml2_XML.to_etree(xml)
+        nodes = [root] if root.tag.endswith('}LogoutRequest') else OneLogin_Saml2_XML.query(root, '//samlp:LogoutRequest')
+        if not nodes:
+            raise ValueError('No LogoutRequest found')
+        logout_request_xml = OneLogin_Saml2_XML.to_string(nodes[0])
+        
+        idp = idp_registry.get(OneLogin_Saml2_Logout_Request.get_issuer(logout_request_xml) or '')
+        if idp is None:
+            raise ValueError('LogoutRequest was not issued by a trusted IdP')
+        settings = idp.settings
+        idp_data = settings.get_idp_data()
+        if not OneLogin_Saml2_Utils.validate_sign(
+            logout_request_xml,
+            cert=idp_data.get('x509cert'),
+            multicerts=idp_data.get('x509certMulti', {}).get('signing'),
+            xpath='/samlp:LogoutRequest/ds:Signature'
+        ):
+            raise ValueError('LogoutRequest signature is missing or invalid')
+        not_on_or_after = nodes[0].get('NotOnOrAfter')
+        if not_on_or_after and OneLogin_Saml2_Utils.parse_SAML_to_time(not_on_or_after) <= OneLogin_Saml2_Utils.now():
+            raise ValueError('LogoutRequest has expired')
+    except Exception as e:
+        print(f"Back-channel logout rejected: {e}")
+        return jsonify({'error': str(e)}), 400
+    
+    revoked = revoke_saml_sessions(logout_request_xml, idp.entity_id)
+    print(f"Back-channel logout - revoked {revoked} session(s)")
+    
+    if not soap:
+        return jsonify({'revoked': revoked})
+    logout_response = OneLogin_Saml2_Logout_Response(settings)
+    logout_response.build(nodes[0].get('ID'))
+    envelope = (
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+        f'{logout_response.get_xml()}'
+        '</soap:Body></soap:Envelope>'
+    )
+    return app.response_class(envelope, mimetype='text/xml')
+
+
+# Startup warm-up: load settings, keys and templates and take the first-request costs before traffic
+# arrives; wsgi.py runs it in the Gunicorn master and /ready answers 503 until it has succeeded
+# WARMUP_RETRIES / _BACKOFF / _RETRY_INTERVAL tune retries (see warmup.py)
+warmup = create_warmup('SAML backend')
+
+@warmup.stage('saml_settings')
+def warm_saml_settings():
+    """Parse and validate saml/settings.json."""
+    if saml_settings.get() is None:
+        raise RuntimeError('SAML settings are invalid')
+    return f'version {saml_settings.version}'
+
+@warmup.stage('authn_template')
+def warm_authn_template():
+    """Render and verify the AuthnRequest template."""
+    if authn_templates.get() is None:
+        return 'unavailable, AuthnRequests are built per request'
+
+@warmup.stage('idp_registry', retry=True)
+def warm_idp_registry():
+    """Load the federated IdPs from their metadata sources."""
+    failures = idp_registry.stats()['refresh_failures']
+    count = idp_registry.refresh()
+    if idp_registry.stats()['refresh_failures'] > failures:
+        raise RuntimeError('IdP metadata could not be loaded from every source')
+    return f'{count} federated IdP(s)'
+
+@warmup.stage('saml_toolkit')
+def warm_saml_toolkit():
+    """Load the IdP certificates into xmlsec and prime python3-saml's lazy parsers."""
+    idp_data = saml_settings.get().get_idp_data()
+    certs = idp_data.get('x509certMulti', {}).get('signing') or [idp_data.get('x509cert')]
+    certs = [cert for cert in certs if cert]
+    for cert in certs:
+        xmlsec.Key.from_memory(OneLogin_Saml2_Utils.format_cert(cert), xmlsec.constants.KeyDataFormatCertPem, None)
+    # Imports _strptime and compiles its regexes, otherwise done by the first callback
+    OneLogin_Saml2_Utils.parse_SAML_to_time('2000-01-01T00:00:00Z')
+    return f'{len(certs)} IdP certificate(s)'
+
+@warmup.stage('policy')
+def warm_policy():
+    """Compile the authorization policy and its decision table."""
+    return f'{len(role_hierarchy.bits)} roles, {len(policy_engine.table())} policy table entries'
+
+@warmup.stage('requests')
+def warm_requests():
+    """Serve an anonymous request to build the URL map and request-handling paths."""
+    response = app.test_client().get('/api/user')
+    if response.status_code >= 500:
+        raise RuntimeError(f'/api/user answered {response.status_code}')
+
+def warmup_metrics():
+    """Report readiness and warm-up timings on /metrics."""
+    status = warmup.status()
+    samples = [('ready', 'gauge', 'Whether the startup warm-up has completed', int(status['ready']))]
+    if warmup.import_seconds is not None:
+        samples.append(('startup_import_seconds', 'gauge', 'Time taken to import the application',
+                        warmup.import_seconds))
+    for name, stage in status['stages'].items():
+        if 'ms' in stage:
+            samples.append((f'warmup_{name}_seconds', 'gauge', f'Time taken by the {name} warm-up stage',
+                            stage['ms'] / 1000))
+    return samples
+
+metrics.register_collector(warmup_metrics)
+init_readiness(app, warmup)
+
 
 if __name__ == '__main__':
     # Run Flask development server
     # In production, use a proper WSGI server like Gunicorn
+    warmup.run()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
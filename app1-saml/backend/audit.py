@@ -0,0 +1,187 @@
+"""Asynchronous audit/debug sink for the SAML backend
+
+Keeps debugging output (decoded assertions, received attributes) off the
+login hot path. Entries are put on a bounded in-memory queue and written
+by a background thread to rotating, size-capped JSON-lines files. When the
+queue is full, entries are dropped and counted rather than blocking the
+request.
+
+Each process writes its own file (the PID is added to the file name), as
+several Gunicorn workers rotating one shared file would rename it from
+under each other and lose or interleave entries.
+
+The sink is opt-in: with SAML_AUDIT_ENABLED unset nothing is queued.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+
+class AuditSink:
+    """
+    Bounded, sampled, non-blocking writer for audit entries.
+
+    The writer thread is started lazily on the first submitted entry, so it
+    is created in the worker process rather than in a pre-fork parent.
+    """
+
+    def __init__(self, path, sample_rate=1.0, queue_size=1000, max_bytes=10 * 1024 * 1024,
+                 backup_count=5, enabled=True):
+        """
+        Args:
+            path: Base file name; each process writes to it with its PID added,
+                e.g. saml_audit.1234.log (rotated as saml_audit.1234.log.1, ...)
+            sample_rate: Fraction of entries to keep, between 0 and 1
+            queue_size: Maximum number of entries waiting to be written
+            max_bytes: Size at which the file is rotated
+            backup_count: Number of rotated files to keep
+            enabled: When False, submit() is a no-op
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'sampled_out': 0,
+            'dropped': 0,
+            'written': 0,
+            'write_errors': 0
+        }
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _ensure_writer(self):
+        """Start the background writer thread if it is not running yet."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='saml-audit-writer', daemon=True)
+                self._thread.start()
+
+    def process_path(self):
+        """Return the file this process writes to: the configured path with the PID added."""
+        root, ext = os.path.splitext(self.path)
+        return f'{root}.{os.getpid()}{ext}'
+
+    def _open_handler(self):
+        # Opened in the writer thread, i.e. in the worker, so the PID is the worker's
+        path = self.process_path()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
+
+    def _run(self):
+        """Drain the queue and write entries, one JSON document per line."""
+        handler = self._open_handler()
+        while True:
+            entry = self._queue.get()
+            try:
+                # Raw payloads (e.g. decoded assertions) are converted here, off the request path
+                for key, value in entry.items():
+                    if isinstance(value, bytes):
+                        entry[key] = value.decode('utf-8', 'replace')
+                record = logging.LogRecord('saml.audit', logging.INFO, __file__, 0,
+                                           json.dumps(entry, default=str), None, None)
+                handler.emit(record)
+                self._count('written')
+            except Exception as e:
+                self._count('write_errors')
+                print(f"Audit write error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, kind, **fields):
+        """
+        Queue an audit entry without blocking.
+
+        Args:
+            kind: Entry type, e.g. 'saml_login'
+            **fields: JSON-serializable entry fields
+
+        Returns:
+            bool: True if the entry was queued
+        """
+        if not self.enabled:
+            return False
+        self._count('submitted')
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self._count('sampled_out')
+            return False
+
+        entry = {'ts': time.time(), 'kind': kind}
+        entry.update(fields)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._ensure_writer()
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until all queued entries have been written (e.g. on shutdown)."""
+        if self._thread is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(0.01)
+
+    def stats(self):
+        """
+        Return a snapshot of the sink counters.
+
+        Returns:
+            dict: submitted, sampled_out, dropped, written, write_errors and
+                the current queue depth
+        """
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['queue_depth'] = self._queue.qsize()
+        return snapshot
+
+
+def create_audit_sink():
+    """
+    Build the audit sink from the environment.
+
+    SAML_AUDIT_ENABLED         - 'true' to enable the sink (default off)
+    SAML_AUDIT_PATH            - output file, per process with the PID added
+                                 (default /tmp/saml_audit/saml_audit.log -> saml_audit.<pid>.log)
+    SAML_AUDIT_SAMPLE_RATE     - fraction of logins recorded (default 1.0)
+    SAML_AUDIT_QUEUE_SIZE      - bounded queue length (default 1000)
+    SAML_AUDIT_MAX_BYTES       - rotate files at this size (default 10 MB)
+    SAML_AUDIT_BACKUP_COUNT    - rotated files kept (default 5)
+
+    Returns:
+        AuditSink: Configured sink
+    """
+    return AuditSink(
+        os.environ.get('SAML_AUDIT_PATH', '/tmp/saml_audit/saml_audit.log'),
+        sample_rate=float(os.environ.get('SAML_AUDIT_SAMPLE_RATE', 1.0)),
+        queue_size=int(os.environ.get('SAML_AUDIT_QUEUE_SIZE', 1000)),
+        max_bytes=int(os.environ.get('SAML_AUDIT_MAX_BYTES', 10 * 1024 * 1024)),
+        backup_count=int(os.environ.get('SAML_AUDIT_BACKUP_COUNT', 5)),
+        enabled=os.environ.get('SAML_AUDIT_ENABLED', 'false').lower() == 'true'
+    )
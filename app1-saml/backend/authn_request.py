@@ -0,0 +1,208 @@
+"""Precomputed AuthnRequest redirects for /saml/login
+
+python3-saml's auth.login() rebuilds the whole AuthnRequest on every call:
+settings lookups, the XML template, deflate, base64 and URL encoding -
+although only the request ID and IssueInstant change between two logins.
+
+AuthnRequestTemplate renders the request once per settings object with
+python3-saml itself and splits it around those two values, together with
+the URL prefix; a login only joins the pieces, deflates and encodes. The
+static part before the ID is too short (~130 bytes) for a primed deflate
+stream to pay off - copying zlib's compressor state costs more than
+compressing it. Every template is checked at build time to produce exactly
+the redirect URL python3-saml would for the same ID and IssueInstant;
+if it doesn't, or AuthnRequests must be signed (the signature covers each
+request), no template is used and /saml/login falls back to auth.login().
+"""
+
+import base64
+import re
+import secrets
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+from onelogin.saml2.authn_request import OneLogin_Saml2_Authn_Request
+from onelogin.saml2.utils import OneLogin_Saml2_Utils
+
+ISSUE_INSTANT_RE = re.compile(r'IssueInstant="([^"]+)"')
+
+
+def generate_request_id():
+    """Return a request ID in python3-saml's format (ONELOGIN_ + 40 hex digits)."""
+    return 'ONELOGIN_' + secrets.token_hex(20)
+
+
+@lru_cache(maxsize=128)
+def _escaped_relay_state(https, http_host, server_port, script_name):
+    request_data = {'https': https, 'http_host': http_host, 'server_port': server_port, 'script_name': script_name}
+    return OneLogin_Saml2_Utils.escape_url(OneLogin_Saml2_Utils.get_self_url_no_query(request_data))
+
+
+def escaped_relay_state(request_data):
+    """
+    Return the URL-encoded RelayState auth.login() sends by default (the login URL itself).
+
+    Args:
+        request_data: Request dict from prepare_flask_request
+
+    Returns:
+        str: Encoded RelayState value
+    """
+    return _escaped_relay_state(request_data['https'], request_data['http_host'],
+                                request_data.get('server_port'), request_data['script_name'])
+
+
+class AuthnRequestTemplate:
+    """AuthnRequest XML and redirect URL of one settings object, split around the per-request values."""
+
+    def __init__(self, settings):
+        """
+        Args:
+            settings: OneLogin_Saml2_Settings the template is rendered from
+
+        Raises:
+            ValueError: If the rendered request cannot be split into a template
+        """
+        sample = OneLogin_Saml2_Authn_Request(settings)
+        xml = sample.get_xml()
+        id_attr = f'ID="{sample.get_id()}"'
+        instant_match = ISSUE_INSTANT_RE.search(xml)
+        if xml.count(id_attr) != 1 or instant_match is None or instant_match.start() < xml.index(id_attr):
+            raise ValueError('Unexpected AuthnRequest layout')
+        id_start = xml.index(id_attr) + len('ID="')
+        id_end = id_start + len(sample.get_id())
+        self._head = xml[:id_start].encode('utf-8')
+        self._middle = xml[id_end:instant_match.start(1)].encode('utf-8')
+        self._tail = xml[instant_match.end(1):].encode('utf-8')
+
+        sso_url = settings.get_idp_sso_url()
+        self._url_prefix = sso_url + ('&' if '?' in sso_url else '?') + 'SAMLRequest='
+        self._instant = (None, None)  # (second, IssueInstant string)
+
+    def _issue_instant(self):
+        now = int(time.time())
+        second, instant = self._instant
+        if second != now:
+            instant = time.strftime(OneLogin_Saml2_Utils.TIME_FORMAT, time.gmtime(now))
+            self._instant = (now, instant)
+        return instant
+
+    def render(self, request_id, issue_instant):
+        """Return the AuthnRequest XML for an ID and IssueInstant."""
+        return (self._head + request_id.encode('ascii') + self._middle
+                + issue_instant.encode('ascii') + self._tail).decode('utf-8')
+
+    def redirect_url(self, request_id, issue_instant, relay_state):
+        """
+        Build the HTTP-Redirect URL for an ID and IssueInstant.
+
+        Args:
+            request_id: AuthnRequest ID
+            issue_instant: IssueInstant in SAML time format
+            relay_state: URL-encoded RelayState (see escaped_relay_state)
+
+        Returns:
+            str: Redirect URL, identical to what auth.login() returns for these values
+        """
+        xml = self._head + request_id.encode('ascii') + self._middle + issue_instant.encode('ascii') + self._tail
+        # Raw DEFLATE at zlib's default level, as python3-saml does (zlib header and checksum stripped)
+        saml_request = base64.b64encode(zlib.compress(xml)[2:-4]).decode('ascii')
+        # quote_plus() of base64 output only ever escapes these three characters
+        saml_request = saml_request.replace('+', '%2B').replace('/', '%2F').replace('=', '%3D')
+        return f'{self._url_prefix}{saml_request}&RelayState={relay_state}'
+
+    def login(self, request_data):
+        """
+        Build a new AuthnRequest redirect.
+
+        Args:
+            request_data: Request dict from prepare_flask_request
+
+        Returns:
+            tuple: (request ID, redirect URL)
+        """
+        request_id = generate_request_id()
+        return request_id, self.redirect_url(request_id, self._issue_instant(), escaped_relay_state(request_data))
+
+
+def check_equivalence(template, settings, request_data):
+    """
+    Compare a template against python3-saml for one freshly generated request.
+
+    Args:
+        template: AuthnRequestTemplate built from settings
+        settings: OneLogin_Saml2_Settings
+        request_data: Request dict as from prepare_flask_request
+
+    Returns:
+        str: Description of the first difference, or None if equivalent
+    """
+    reference = OneLogin_Saml2_Authn_Request(settings)
+    xml = reference.get_xml()
+    instant = ISSUE_INSTANT_RE.search(xml).group(1)
+    if template.render(reference.get_id(), instant) != xml:
+        return 'AuthnRequest XML differs'
+    expected = OneLogin_Saml2_Utils.redirect(settings.get_idp_sso_url(), {
+        'SAMLRequest': reference.get_request(),
+        'RelayState': OneLogin_Saml2_Utils.get_self_url_no_query(request_data),
+    }, request_data=request_data)
+    if template.redirect_url(reference.get_id(), instant, escaped_relay_state(request_data)) != expected:
+        return 'redirect URL differs'
+    return None
+
+
+def build_authn_template(settings):
+    """
+    Build and verify the AuthnRequest template of a settings object.
+
+    Args:
+        settings: OneLogin_Saml2_Settings
+
+    Returns:
+        AuthnRequestTemplate: Template, or None if logins must go through auth.login()
+    """
+    if settings.get_security_data().get('authnRequestsSigned', False):
+        print("AuthnRequest templates disabled: AuthnRequests are signed per request")
+        return None
+    try:
+        template = AuthnRequestTemplate(settings)
+        sample_request = {'https': 'off', 'http_host': 'localhost', 'script_name': '/saml/login'}
+        difference = check_equivalence(template, settings, sample_request)
+    except Exception as e:
+        difference = str(e)
+    if difference:
+        print(f"AuthnRequest template disabled, using python3-saml: {difference}")
+        return None
+    return template
+
+
+class AuthnRequestTemplates:
+    """Holds the template of the current settings object, rebuilt when the settings are reloaded."""
+
+    def __init__(self, settings_cache):
+        """
+        Args:
+            settings_cache: SAMLSettingsCache the templates are built from
+        """
+        self.settings_cache = settings_cache
+        self._settings = None
+        self._template = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the template for the current settings.
+
+        Returns:
+            AuthnRequestTemplate: Template, or None if logins must go through auth.login()
+        """
+        settings = self.settings_cache.get()
+        if settings is self._settings:
+            return self._template
+        with self._lock:
+            if settings is not self._settings:
+                self._template = build_authn_template(settings)
+                self._settings = settings
+            return self._template
@@ -0,0 +1,401 @@
+"""Compact signed cookie sessions for the SSO backends
+
+With SESSION_BACKEND=cookie the whole session travels in the cookie.
+Flask's default interface signs it with itsdangerous and encodes it as
+tagged JSON, so every request pays for JSON parsing, the tag walk and a
+key derivation plus HMAC, and every response that touches the session
+re-serializes all of it.
+
+CompactCookieSessionInterface replaces that with:
+
+- a versioned binary encoding: each value is a one-byte type tag plus a
+  varint length where needed, and the dict keys the backends use (roles,
+  username, tokens, ...) are single-byte field codes. Bodies that shrink
+  under zlib (e.g. OIDC tokens) are stored compressed.
+- a truncated HMAC-SHA256 over the encoded text, checked before anything
+  is decoded
+- a small LRU of recently verified cookie values, so the API calls of a
+  logged-in user skip verification and decoding entirely
+- writes only when the session was modified
+
+Cookie layout (version 2):
+
+    base64url(version | flags | issued_at uint32 | body) "." base64url(mac)
+
+Field codes are part of the version: adding a key to KEY_CODES means
+adding a new version and keeping the old table for decoding.
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import base64
+import hashlib
+import hmac
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSession, SessionInterface
+
+VERSION = 2
+FLAG_COMPRESSED = 0x01
+MAC_SIZE = 16
+# Bodies shorter than this are never worth compressing
+COMPRESS_MIN_SIZE = 200
+
+# Field codes of known dict keys, per version; the index + 1 is the code (0 marks an inline key)
+KEY_CODES = {
+    1: (
+        # Flask
+        '_permanent', '_flashes', '_fresh',
+        # Both backends
+        'authenticated', 'username', 'email', 'roles', 'role_mask', 'role_version', 'registry_id',
+        'user_view_version',
+        # SAML backend
+        'samlUserdata', 'samlNameId', 'samlNameIdFormat', 'samlNameIdNameQualifier',
+        'samlNameIdSPNameQualifier', 'samlSessionIndex',
+        # OIDC backend (user info, tokens, Authlib authorization state)
+        'user', 'sub', 'name', 'preferred_username', 'tokens', 'access_token', 'id_token', 'refresh_token',
+        'expires_at', 'data', 'exp', 'redirect_uri', 'nonce', 'url', 'code_verifier',
+    ),
+}
+# Version 2 appends the keys added since, so version 1 cookies still decode
+KEY_CODES[2] = KEY_CODES[1] + (
+    # SAML backend: federated IdP of the session
+    'samlIdP',
+    # Both backends: absolute expiry of the login (session_registry.py)
+    'registry_expires_at',
+)
+
+# Type tags
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_BYTES, T_LIST, T_DICT, T_TUPLE = range(10)
+
+
+class BadSessionCookie(ValueError):
+    """A session cookie failed verification or could not be decoded."""
+
+
+def _encode_varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class SessionCodec:
+    """Binary encoding and signing of session dicts."""
+
+    def __init__(self, secret_key, version=VERSION):
+        """
+        Args:
+            secret_key: Application secret key (str or bytes)
+            version: Encoding version written by dumps()
+        """
+        if isinstance(secret_key, str):
+            secret_key = secret_key.encode('utf-8')
+        # A key of its own, so a MAC can't be replayed as another itsdangerous signature of the app
+        self._key = hashlib.sha256(b'compact-session-cookie\x00' + secret_key).digest()
+        self.version = version
+        self._codes = {key: code for code, key in enumerate(KEY_CODES[version], 1)}
+
+    def _mac(self, payload):
+        return hmac.new(self._key, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def _encode(self, value, out):
+        # Exact type checks: bool is an int subclass and must keep its own tag
+        kind = type(value)
+        if kind is str:
+            data = value.encode('utf-8')
+            out.append(T_STR)
+            _encode_varint(len(data), out)
+            out += data
+        elif value is None:
+            out.append(T_NONE)
+        elif kind is bool:
+            out.append(T_TRUE if value else T_FALSE)
+        elif kind is int:
+            out.append(T_INT)
+            _encode_varint(value << 1 if value >= 0 else (-value << 1) - 1, out)
+        elif kind is float:
+            out.append(T_FLOAT)
+            out += struct.pack('>d', value)
+        elif kind is list or kind is tuple:
+            out.append(T_LIST if kind is list else T_TUPLE)
+            _encode_varint(len(value), out)
+            for item in value:
+                self._encode(item, out)
+        elif kind is dict:
+            out.append(T_DICT)
+            _encode_varint(len(value), out)
+            codes = self._codes
+            for key, item in value.items():
+                code = codes.get(key)
+                if code is not None:
+                    out.append(code)
+                elif type(key) is str:
+                    data = key.encode('utf-8')
+                    out.append(0)
+                    _encode_varint(len(data), out)
+                    out += data
+                else:
+                    raise TypeError(f'Session dict keys must be strings, not {type(key).__name__}')
+                self._encode(item, out)
+        elif kind is bytes:
+            out.append(T_BYTES)
+            _encode_varint(len(value), out)
+            out += value
+        else:
+            raise TypeError(f'Cannot store {kind.__name__} in a compact session cookie')
+
+    def _decode(self, buf, pos, keys):
+        tag = buf[pos]
+        pos += 1
+        if tag == T_STR:
+            length = buf[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = _decode_varint(buf, pos)
+            return buf[pos:pos + length].decode('utf-8'), pos + length
+        if tag == T_DICT:
+            count, pos = _decode_varint(buf, pos)
+            result = {}
+            for _ in range(count):
+                code = buf[pos]
+                pos += 1
+                if code:
+                    key = keys[code - 1]
+                else:
+                    length, pos = _decode_varint(buf, pos)
+                    key = buf[pos:pos + length].decode('utf-8')
+                    pos += length
+                result[key], pos = self._decode(buf, pos, keys)
+            return result, pos
+        if tag == T_INT:
+            value, pos = _decode_varint(buf, pos)
+            return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+        if tag == T_NONE:
+            return None, pos
+        if tag == T_TRUE:
+            return True, pos
+        if tag == T_FALSE:
+            return False, pos
+        if tag == T_LIST or tag == T_TUPLE:
+            count, pos = _decode_varint(buf, pos)
+            items = []
+            for _ in range(count):
+                item, pos = self._decode(buf, pos, keys)
+                items.append(item)
+            return (items if tag == T_LIST else tuple(items)), pos
+        if tag == T_FLOAT:
+            return struct.unpack_from('>d', buf, pos)[0], pos + 8
+        if tag == T_BYTES:
+            length, pos = _decode_varint(buf, pos)
+            return bytes(buf[pos:pos + length]), pos + length
+        raise BadSessionCookie(f'Unknown type tag {tag}')
+
+    def dumps(self, data, issued_at=None):
+        """
+        Encode and sign a session dict.
+
+        Args:
+            data: Session data (str keys; None, bool, int, float, str, bytes, list, tuple and dict values)
+            issued_at: Unix time the cookie is issued at (default now)
+
+        Returns:
+            str: Cookie value
+
+        Raises:
+            TypeError: If the data holds a value the encoding doesn't support
+        """
+        body = bytearray()
+        self._encode(data, body)
+        flags = 0
+        if len(body) >= COMPRESS_MIN_SIZE:
+            compressed = zlib.compress(body)
+            if len(compressed) < len(body):
+                body = compressed
+                flags |= FLAG_COMPRESSED
+        header = struct.pack('>BBI', self.version, flags, int(time.time() if issued_at is None else issued_at))
+        payload = base64.urlsafe_b64encode(header + body).rstrip(b'=')
+        return (payload + b'.' + base64.urlsafe_b64encode(self._mac(payload)).rstrip(b'=')).decode('ascii')
+
+    def loads(self, value):
+        """
+        Verify and decode a cookie value.
+
+        Args:
+            value: Cookie value from dumps()
+
+        Returns:
+            tuple: (issued_at, session data)
+
+        Raises:
+            BadSessionCookie: If the signature doesn't match or the value is malformed
+        """
+        payload, _, mac = value.encode('ascii', 'replace').rpartition(b'.')
+        try:
+            expected = base64.urlsafe_b64decode(mac + b'=' * (-len(mac) % 4))
+        except ValueError:
+            raise BadSessionCookie('Malformed signature')
+        if not payload or not hmac.compare_digest(self._mac(payload), expected):
+            raise BadSessionCookie('Signature does not match')
+        try:
+            raw = base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4))
+            version, flags, issued_at = struct.unpack_from('>BBI', raw)
+            keys = KEY_CODES[version]
+            body = raw[6:]
+            if flags & FLAG_COMPRESSED:
+                body = zlib.decompress(body)
+            data, pos = self._decode(body, 0, keys)
+        except BadSessionCookie:
+            raise
+        except Exception as e:
+            raise BadSessionCookie(f'Malformed session cookie: {e}')
+        if pos != len(body) or type(data) is not dict:
+            raise BadSessionCookie('Malformed session cookie')
+        return issued_at, data
+
+
+def _copy(value):
+    """Copy the mutable containers of decoded session data."""
+    kind = type(value)
+    if kind is dict:
+        return {key: _copy(item) for key, item in value.items()}
+    if kind is list:
+        return [_copy(item) for item in value]
+    return value
+
+
+class CompactCookieSessionInterface(SessionInterface):
+    """
+    Flask session interface storing the session in a compact, signed cookie.
+
+    Sessions expire permanent_session_lifetime after they were last
+    written; expired, forged or undecodable cookies start a new, empty
+    session.
+    """
+
+    session_class = SecureCookieSession
+
+    def __init__(self, cache_size=1024):
+        """
+        Args:
+            cache_size: Verified cookie values remembered per process (0 disables the cache)
+        """
+        self.cache_size = cache_size
+        self._codec = None
+        self._codec_secret = None
+        self._cache = OrderedDict()  # cookie value -> (issued_at, decoded data)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'rejected': 0, 'writes': 0}
+
+    def _get_codec(self, app):
+        if app.secret_key != self._codec_secret:
+            with self._lock:
+                self._codec = SessionCodec(app.secret_key)
+                self._codec_secret = app.secret_key
+                self._cache.clear()
+        return self._codec
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _remember(self, value, issued_at, data):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self._cache[value] = (issued_at, data)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        # Also drops the cached cookies if the secret key was changed
+        codec = self._get_codec(app)
+        value = request.cookies.get(self.get_cookie_name(app))
+        if not value:
+            return self.session_class()
+
+        with self._lock:
+            entry = self._cache.get(value)
+            if entry is not None:
+                self._cache.move_to_end(value)
+                self._stats['hits'] += 1
+        if entry is None:
+            self._count('misses')
+            try:
+                entry = codec.loads(value)
+            except BadSessionCookie:
+                self._count('rejected')
+                return self.session_class()
+            self._remember(value, *entry)
+
+        issued_at, data = entry
+        if issued_at + app.permanent_session_lifetime.total_seconds() <= time.time():
+            return self.session_class()
+        # Cached data is shared between requests; hand out copies of its containers
+        return self.session_class(_copy(data))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # A modified session has always been accessed, so this also covers the writes below
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        if not session.modified:
+            return
+
+        data = dict(session)
+        issued_at = int(time.time())
+        value = self._get_codec(app).dumps(data, issued_at)
+        self._count('writes')
+        # The next request with this cookie needs neither verification nor decoding
+        self._remember(value, issued_at, _copy(data))
+        response.set_cookie(
+            name,
+            value,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def stats(self):
+        """
+        Return a snapshot of the interface counters.
+
+        Returns:
+            dict: hits, misses (verified and decoded), rejected, writes and cache size
+        """
+        with self._lock:
+            return dict(self._stats, cache_size=len(self._cache))
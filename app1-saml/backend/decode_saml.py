@@ -1,95 +1,218 @@
 #!/usr/bin/env python3
+"""SAML message decoder for offline analysis
+
+Decodes captured SAMLRequest/SAMLResponse values, e.g. from proxy or
+access logs, and emits one JSON object per message with its IDs, issuer,
+NameID and attributes (see saml_parser.py). The encoding is detected from
+the header bytes instead of trying decompressors one after another:
+
+- HTTP-POST binding: base64 of the XML document
+- HTTP-Redirect binding: base64 of raw DEFLATE data, usually URL-encoded
+- zlib- or gzip-wrapped DEFLATE, as produced by some tools
+
+Usage:
+
+    python decode_saml.py captured.txt > decoded.jsonl
+    grep -o 'SAMLRequest=[^& ]*' access.log | python decode_saml.py -j 4
+    python decode_saml.py --xml 'fVNNj9ow...'
+
+Input lines may be bare values, URL-encoded values or contain a
+SAMLRequest=/SAMLResponse= query parameter. Messages are decoded on a
+process pool; throughput is reported on stderr.
+"""
+
+import argparse
 import base64
+import binascii
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
 import zlib
-import xml.dom.minidom
 from urllib.parse import unquote
 
-def decode_saml_request(encoded_string):
-    """Decode a SAML request that is base64 encoded and compressed"""
-    
-    # First, decode from base64
+from saml_parser import parse_saml_message
+
+# Conventional prefixes for --xml output instead of ns0/ns1
+for _prefix, _uri in (('samlp', 'urn:oasis:names:tc:SAML:2.0:protocol'),
+                      ('saml', 'urn:oasis:names:tc:SAML:2.0:assertion'),
+                      ('ds', 'http://www.w3.org/2000/09/xmldsig#')):
+    ET.register_namespace(_prefix, _uri)
+
+# Extracts the value of a SAMLRequest/SAMLResponse parameter from a log line
+PARAM_RE = re.compile(r'SAML(?:Request|Response)=([^&\s"\']+)')
+
+
+def detect_encoding(data):
+    """
+    Identify how base64-decoded SAML message bytes are wrapped.
+
+    Args:
+        data: Base64-decoded message
+
+    Returns:
+        str: 'xml', 'gzip', 'zlib' or 'deflate'
+    """
+    head = data[:64].lstrip()
+    if head.startswith(b'\xef\xbb\xbf'):
+        head = head[3:]
+    # Compressed data may start with '<' too, but is practically never printable text
+    if head.startswith(b'<') and head.isascii() and all(c >= 0x20 or c in b'\t\r\n' for c in head):
+        return 'xml'
+    if data[:2] == b'\x1f\x8b':
+        return 'gzip'
+    # zlib header: deflate method (CMF low nibble 8) and a valid FCHECK
+    if len(data) >= 2 and data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0:
+        return 'zlib'
+    return 'deflate'
+
+
+def decode_saml_message(encoded):
+    """
+    Decode a SAMLRequest/SAMLResponse value to its XML document.
+
+    Args:
+        encoded: Base64 value, optionally URL-encoded or embedded as a
+            SAMLRequest=/SAMLResponse= parameter
+
+    Returns:
+        tuple: (XML bytes, encoding name from detect_encoding)
+
+    Raises:
+        ValueError: If the value is not a decodable SAML message
+    """
+    value = encoded.strip()
+    match = PARAM_RE.search(value)
+    if match:
+        value = match.group(1)
+    if '%' in value:
+        value = unquote(value)
+    try:
+        data = base64.b64decode(value)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f'invalid base64: {e}')
+
+    encoding = detect_encoding(data)
     try:
-        decoded = base64.b64decode(encoded_string)
-        print("✓ Base64 decoded successfully")
-        print(f"  Decoded length: {len(decoded)} bytes")
-    except Exception as e:
-        print(f"✗ Base64 decode failed: {e}")
-        return None
-    
-    # Try different decompression methods
-    decompression_methods = [
-        ("zlib with -15 wbits (raw deflate)", lambda d: zlib.decompress(d, -15)),
-        ("zlib default", lambda d: zlib.decompress(d)),
-        ("zlib with 16 wbits (gzip)", lambda d: zlib.decompress(d, 16)),
-        ("zlib with -8 wbits", lambda d: zlib.decompress(d, -8)),
-        ("zlib with 32 wbits (auto-detect)", lambda d: zlib.decompress(d, 32)),
-    ]
-    
-    decompressed = None
-    successful_method = None
-    
-    for method_name, decompress_func in decompression_methods:
-        try:
-            decompressed = decompress_func(decoded)
-            print(f"\n✓ Decompression successful with: {method_name}")
-            print(f"  Decompressed length: {len(decompressed)} bytes")
-            successful_method = method_name
-            break
-        except Exception as e:
-            print(f"✗ {method_name} failed: {type(e).__name__}")
-    
-    if decompressed is None:
-        print("\n✗ All decompression methods failed")
-        return None
-    
-    # Try to decode as UTF-8
+        if encoding == 'xml':
+            return data, encoding
+        if encoding == 'gzip':
+            return zlib.decompress(data, 16 + zlib.MAX_WBITS), encoding
+        if encoding == 'zlib':
+            try:
+                return zlib.decompress(data), encoding
+            except zlib.error:
+                # Raw DEFLATE whose first two bytes happen to form a valid zlib header
+                encoding = 'deflate'
+        return zlib.decompress(data, -zlib.MAX_WBITS), encoding
+    except zlib.error as e:
+        raise ValueError(f'{encoding} decompression failed: {e}')
+
+
+def decode_line(line):
+    """
+    Decode and parse one input line.
+
+    Args:
+        line: Line holding one encoded SAML message
+
+    Returns:
+        dict: Parsed fields plus 'encoding' and 'bytes', or {'error': ...}
+    """
     try:
-        xml_string = decompressed.decode('utf-8')
-        print("✓ UTF-8 decode successful")
-    except Exception as e:
-        print(f"✗ UTF-8 decode failed: {e}")
-        return None
-    
-    # Pretty print XML
+        xml_bytes, encoding = decode_saml_message(line)
+        result = parse_saml_message(xml_bytes)
+    except (ValueError, ET.ParseError) as e:
+        return {'error': str(e)}
+    result['encoding'] = encoding
+    result['bytes'] = len(xml_bytes)
+    return result
+
+
+def decode_stream(lines, jobs=None, chunksize=64):
+    """
+    Decode a stream of encoded messages, in input order.
+
+    Lines are consumed lazily, so arbitrarily large inputs are processed in
+    constant memory.
+
+    Args:
+        lines: Iterable of lines, one encoded message per line (blank lines are skipped)
+        jobs: Worker processes (default: CPU count); 1 decodes in this process
+        chunksize: Lines handed to a worker at a time
+
+    Yields:
+        dict: decode_line() result for each non-blank line
+    """
+    lines = (line for line in lines if line.strip())
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        for line in lines:
+            yield decode_line(line)
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap(decode_line, lines, chunksize)
+
+
+def pretty_xml(xml_bytes):
+    """Indent an XML document for reading."""
+    root = ET.fromstring(xml_bytes)
+    ET.indent(root)
+    return ET.tostring(root, encoding='unicode')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Decode captured SAMLRequest/SAMLResponse values to JSON lines.')
+    parser.add_argument('input', nargs='?', default='-', help='file with one message per line (default: stdin)')
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('-o', '--output', default='-', help='JSON lines output file (default: stdout)')
+    parser.add_argument('--xml', metavar='VALUE', help='decode a single value and print its XML instead')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not report throughput')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.xml:
+        xml_bytes, encoding = decode_saml_message(args.xml)
+        print(f'<!-- {encoding}, {len(xml_bytes)} bytes -->')
+        print(pretty_xml(xml_bytes))
+        return 0
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', errors='replace')
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    messages = errors = total_bytes = 0
+    start = time.perf_counter()
     try:
-        dom = xml.dom.minidom.parseString(xml_string)
-        pretty_xml = dom.toprettyxml(indent="  ")
-        
-        # Remove empty lines
-        lines = pretty_xml.split('\n')
-        non_empty_lines = [line for line in lines if line.strip()]
-        pretty_xml = '\n'.join(non_empty_lines)
-        
-        return pretty_xml, successful_method
-    except Exception as e:
-        print(f"✗ XML parsing failed: {e}")
-        print("\nRaw decompressed content:")
-        print(xml_string)
-        return xml_string, successful_method
-
-
-def main():
-    encoded_saml = """fVNNj9owFLzvr4hyZ+2QEIgFkSj0A4lCBOkeeqkc51GsOnZqO13672tnoctKLLlYGs/Me/P8MjW0ES2Zd/Yod/C7A2MfguDUCGlIfzULOy2JooYbImkDhlhG9vOvazJ8xKTVyiqmRPhGdF9DjQFtuZJetFrOwu3m43r7ebX5McFZCng0ytIkPWQRHqcpJFFC4yrOsojBsKrGdZKMvfAJtHEes9BZ9kbGdLCSxlJpHYiHowEeDYZpicckjgmOv3vW0uXjktpeebS2JQgJxag4KmPJBE8w0kBFY5AxatAqhi4JkQ/mLYoz8IHLmsuf97NWLyRDvpRlMSi2+9JbzC8TWChpugb0HvQfzuDbbn2jqxhj3FdHDhEVZb/C3JkEwdSDpA+u85uyKbqmvIpasnGtrpaFEpz97XH/fVK6ofb9RNFj1CO8Hhx6KumkaYHxA4c6/G8zF0I9L9wcLcxCqzsIA/Sm+HnRoO7Xzg3BwskGC9W0VHPjnwZOlNlzzNeo1/SFcHu0g0N+d9UYYZ7n4MIdz0rX/vmAudqlpq55pe15SDfNX7pGd9rOHy7X1/9Q/g8="""
-    
-    print("SAML Request Decoder")
-    print("=" * 60)
-    print(f"\nInput length: {len(encoded_saml)} characters")
-    print("\nDecoding process:")
-    print("-" * 40)
-    
-    result = decode_saml_request(encoded_saml.strip())
-    
-    if result:
-        pretty_xml, method = result
-        print("\n" + "=" * 60)
-        print(f"Successfully decoded using: {method}")
-        print("=" * 60)
-        print("\nDecoded SAML Request (XML):")
-        print("-" * 60)
-        print(pretty_xml)
-    else:
-        print("\n✗ Failed to decode SAML request")
-
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+        for result in decode_stream(source, jobs=args.jobs):
+            messages += 1
+            if 'error' in result:
+                errors += 1
+            else:
+                total_bytes += result['bytes']
+            output.write(json.dumps(result) + '\n')
+    except BrokenPipeError:
+        # Output closed early (e.g. piped into head)
+        sys.stderr.close()
+        return 0
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    if not args.quiet:
+        rate = messages / elapsed if elapsed else 0.0
+        sys.stderr.write(
+            f'{messages} messages ({errors} errors, {total_bytes / 1e6:.1f} MB XML) in {elapsed:.2f}s: '
+            f'{rate:,.0f} messages/s, {total_bytes / 1e6 / elapsed if elapsed else 0.0:.1f} MB/s\n'
+        )
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,398 @@
+"""Registry of federated SAML identity providers
+
+The SAML backend trusts the IdP in saml/settings.json and, in addition,
+every IdP listed in the configured metadata sources: metadata XML files,
+directories of them, or http(s) URLs of single-entity or aggregate
+(EntitiesDescriptor) documents, e.g. Keycloak next to SiteMinder.
+
+Each IdP's metadata is parsed once into an IdPEntry holding a ready
+OneLogin_Saml2_Settings object (SP part from settings.json, IdP part and
+certificates from the metadata) and its AuthnRequest template. Entries
+are indexed by entityID, which is also the Issuer of the IdP's messages,
+so both login (/saml/login?idp=<entityID>) and response routing are a
+single dict lookup. find_issuer() reads the Issuer of an incoming message
+with a regular expression instead of an XML parse; python3-saml then
+validates the message against that IdP's certificates only.
+
+Metadata is refreshed by a background thread with conditional fetches -
+If-None-Match / If-Modified-Since for URLs, mtime and size for files - so
+unchanged sources cost neither a download nor a parse. A refresh builds a
+new index and swaps it in whole, and reuses the entries whose metadata did
+not change; requests never wait for it. When saml/settings.json is
+reloaded, entries rebind to the new SP settings on their next lookup.
+
+The refresh thread is started lazily per process, so with Gunicorn's
+preload_app each worker runs its own after the fork.
+
+Metadata decides which certificates are trusted, so plain http:// sources
+are refused, and running without a metadata signing certificate is
+logged as a warning at startup.
+"""
+
+import os
+import re
+import threading
+import time
+import urllib.request
+from urllib.error import HTTPError
+
+from onelogin.saml2.idp_metadata_parser import OneLogin_Saml2_IdPMetadataParser
+from onelogin.saml2.settings import OneLogin_Saml2_Settings
+from onelogin.saml2.utils import OneLogin_Saml2_Utils
+from onelogin.saml2.xml_utils import OneLogin_Saml2_XML
+
+from authn_request import build_authn_template
+
+# First Issuer element of a SAML message, with or without a namespace prefix. The Response's
+# own Issuer precedes the assertion, and python3-saml rejects responses whose assertion
+# Issuer differs from the IdP the response was validated for.
+ISSUER_RE = re.compile(rb'<(?:[\w.-]+:)?Issuer\b[^>]*>\s*([^<\s][^<]*?)\s*</')
+
+
+def find_issuer(xml_bytes):
+    """
+    Return the Issuer of a SAML message without parsing the XML.
+
+    Args:
+        xml_bytes: Decoded SAML message
+
+    Returns:
+        str: Issuer, or None if the message has none
+    """
+    match = ISSUER_RE.search(xml_bytes)
+    return match.group(1).decode('utf-8', 'replace') if match else None
+
+
+def is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+class IdPEntry:
+    """One trusted IdP: its metadata, settings object and AuthnRequest template."""
+
+    def __init__(self, entity_id, metadata, base, source):
+        """
+        Args:
+            entity_id: The IdP's entityID (and Issuer)
+            metadata: Settings dict parsed from the IdP's metadata, None for the
+                IdP of saml/settings.json
+            base: OneLogin_Saml2_Settings from saml/settings.json the entry is bound to
+            source: Metadata file or URL the entry was loaded from
+
+        Raises:
+            Exception: If the merged settings are invalid
+        """
+        self.entity_id = entity_id
+        self.metadata = metadata
+        self.base = base
+        self.source = source
+        if metadata is None:
+            self.settings = base
+        else:
+            settings_data = OneLogin_Saml2_IdPMetadataParser.merge_settings({
+                'strict': base.is_strict(),
+                'debug': base.is_debug_active(),
+                'sp': base.get_sp_data(),
+                'security': base.get_security_data(),
+            }, metadata)
+            self.settings = OneLogin_Saml2_Settings(settings_data, custom_base_path=base.get_base_path())
+        idp_data = self.settings.get_idp_data()
+        # Formatted PEM certificates, as python3-saml validates signatures with them
+        self.certs = idp_data.get('x509certMulti', {}).get('signing') or [idp_data.get('x509cert')]
+        self.certs = [cert for cert in self.certs if cert]
+        # The default IdP's template comes from AuthnRequestTemplates
+        self.template = build_authn_template(self.settings) if metadata is not None else None
+
+    @property
+    def federated(self):
+        """True for IdPs loaded from metadata, False for the IdP of saml/settings.json."""
+        return self.metadata is not None
+
+    def rebind(self, base):
+        """Return the entry rebuilt on new saml/settings.json settings."""
+        return IdPEntry(self.entity_id, self.metadata, base, self.source)
+
+
+class IdPRegistry:
+    """IdPs indexed by entityID, loaded from metadata and refreshed in the background."""
+
+    def __init__(self, settings_cache, authn_templates, sources=(), refresh_interval=300.0, timeout=10.0,
+                 signing_cert=None):
+        """
+        Args:
+            settings_cache: SAMLSettingsCache of saml/settings.json (SP settings and default IdP)
+            authn_templates: AuthnRequestTemplates of the default IdP
+            sources: Metadata files, directories of *.xml files and http(s) URLs
+            refresh_interval: Seconds between two refreshes of the metadata sources (0 disables)
+            timeout: Timeout in seconds when fetching metadata URLs
+            signing_cert: Certificate metadata documents must be signed with (None accepts unsigned)
+
+        Raises:
+            ValueError: If a source is an http:// URL
+        """
+        for source in sources:
+            if source.startswith('http://'):
+                raise ValueError(f'Metadata source {source} is not HTTPS; its certificates could be replaced in transit')
+        if sources and not signing_cert:
+            print("WARNING: SAML_IDP_METADATA_CERT is not set; IdP metadata is trusted without a signature check")
+        self.settings_cache = settings_cache
+        self.authn_templates = authn_templates
+        self.sources = list(sources)
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.signing_cert = signing_cert
+        self._index = {}           # entityID -> IdPEntry, swapped whole on refresh
+        self._documents = {}       # source -> {'validators', 'entities': {entityID: metadata}}
+        self._default = None
+        self._refresher_pid = None
+        self._last_refresh = None
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'refreshes': 0,
+            'not_modified': 0,
+            'refresh_failures': 0,
+            'entity_errors': 0
+        }
+
+    def _count(self, name, delta=1):
+        with self._stats_lock:
+            self._stats[name] += delta
+
+    def default(self):
+        """
+        Return the IdP configured in saml/settings.json.
+
+        Returns:
+            IdPEntry: Default IdP
+        """
+        base = self.settings_cache.get()
+        entry = self._default
+        if entry is None or entry.base is not base:
+            with self._lock:
+                entry = self._default
+                if entry is None or entry.base is not base:
+                    entry = IdPEntry(base.get_idp_data()['entityId'], None, base, 'settings.json')
+                    entry.template = self.authn_templates.get()
+                    self._default = entry
+        return entry
+
+    def get(self, entity_id=None):
+        """
+        Look up a trusted IdP by entityID or Issuer.
+
+        Args:
+            entity_id: entityID / Issuer, None for the default IdP
+
+        Returns:
+            IdPEntry: Matching IdP, or None if it is not trusted
+        """
+        self._ensure_refresher()
+        default = self.default()
+        if entity_id is None or entity_id == default.entity_id:
+            return default
+        entry = self._index.get(entity_id)
+        if entry is not None and entry.base is not default.base:
+            entry = self._rebind(entry, default.base)
+        return entry
+
+    def _rebind(self, entry, base):
+        with self._lock:
+            current = self._index.get(entry.entity_id)
+            if current is None:
+                return None
+            if current.base is not base:
+                try:
+                    current = current.rebind(base)
+                except Exception as e:
+                    print(f"IdP {entry.entity_id} rejected with the new SAML settings: {e}")
+                    self._count('entity_errors')
+                    return None
+                # Replacing one key is atomic; concurrent lookups see the old or the new entry
+                self._index[entry.entity_id] = current
+            return current
+
+    def entity_ids(self):
+        """Return the entityIDs of all trusted IdPs, the default one first."""
+        return [self.default().entity_id] + sorted(self._index)
+
+    def _expand_sources(self):
+        paths = []
+        for source in self.sources:
+            if not is_url(source) and os.path.isdir(source):
+                paths.extend(os.path.join(source, name) for name in sorted(os.listdir(source))
+                             if name.endswith('.xml'))
+            else:
+                paths.append(source)
+        return paths
+
+    def _fetch(self, source, validators):
+        """
+        Fetch a metadata source unless it is unchanged.
+
+        Returns:
+            tuple: (XML bytes or None if not modified, new validators)
+        """
+        if not is_url(source):
+            stat = os.stat(source)
+            current = (stat.st_mtime_ns, stat.st_size)
+            if current == validators:
+                return None, validators
+            with open(source, 'rb') as f:
+                return f.read(), current
+
+        headers = {'Accept': 'application/samlmetadata+xml, application/xml'}
+        etag, last_modified = validators or (None, None)
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        try:
+            with urllib.request.urlopen(urllib.request.Request(source, headers=headers), timeout=self.timeout) as resp:
+                return resp.read(), (resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        except HTTPError as e:
+            if e.code == 304:
+                return None, validators
+            raise
+
+    def _parse(self, xml):
+        """Split a metadata document into per-IdP settings dicts keyed by entityID."""
+        root = OneLogin_Saml2_XML.to_etree(xml)
+        if self.signing_cert:
+            OneLogin_Saml2_Utils.validate_metadata_sign(root, cert=self.signing_cert)
+        entities = {}
+        descriptors = [root] if root.tag.endswith('}EntityDescriptor') else \
+            OneLogin_Saml2_XML.query(root, '//md:EntityDescriptor')
+        for descriptor in descriptors:
+            # Parse each entity on its own: parse(entity_id=...) would re-read the whole aggregate per entity
+            metadata = OneLogin_Saml2_IdPMetadataParser.parse(OneLogin_Saml2_XML.to_string(descriptor))
+            if 'idp' in metadata:
+                entities[metadata['idp']['entityId']] = metadata
+        return entities
+
+    def refresh(self):
+        """
+        Reload the metadata sources that changed and rebuild the index.
+
+        Sources that cannot be fetched or parsed keep their previous entries.
+
+        Returns:
+            int: Number of trusted IdPs besides the default one
+        """
+        with self._refresh_lock:
+            start = time.perf_counter()
+            changed = False
+            documents = {}
+            for source in self._expand_sources():
+                previous = self._documents.get(source, {'validators': None, 'entities': {}})
+                try:
+                    xml, validators = self._fetch(source, previous['validators'])
+                    if xml is None:
+                        self._count('not_modified')
+                        documents[source] = previous
+                        continue
+                    documents[source] = {'validators': validators, 'entities': self._parse(xml)}
+                    changed = changed or documents[source]['entities'] != previous['entities']
+                except Exception as e:
+                    print(f"IdP metadata refresh error for {source}, keeping previous entries: {e}")
+                    self._count('refresh_failures')
+                    documents[source] = previous
+            changed = changed or documents.keys() != self._documents.keys()
+            self._documents = documents
+            self._last_refresh = time.monotonic()
+            self._count('refreshes')
+            if changed:
+                self._rebuild()
+                print(f"IdP registry loaded {len(self._index)} IdP(s) from {len(documents)} metadata source(s) "
+                      f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return len(self._index)
+
+    def _rebuild(self):
+        base = self.settings_cache.get()
+        default_id = base.get_idp_data()['entityId']
+        index = {}
+        for source, document in self._documents.items():
+            for entity_id, metadata in document['entities'].items():
+                if entity_id == default_id or entity_id in index:
+                    print(f"IdP {entity_id} from {source} ignored: already configured")
+                    continue
+                entry = self._index.get(entity_id)
+                if entry is None or entry.metadata != metadata or entry.base is not base:
+                    try:
+                        entry = IdPEntry(entity_id, metadata, base, source)
+                    except Exception as e:
+                        print(f"IdP {entity_id} from {source} rejected: {e}")
+                        self._count('entity_errors')
+                        continue
+                index[entity_id] = entry
+        self._index = index
+
+    def _ensure_refresher(self):
+        """Start the refresh thread in this process if it is not running yet."""
+        if self._refresher_pid == os.getpid() or not self.sources or self.refresh_interval <= 0:
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            threading.Thread(target=self._refresh_loop, name='idp-metadata-refresh', daemon=True).start()
+            self._refresher_pid = os.getpid()
+
+    def _refresh_loop(self):
+        while True:
+            # Loads right away unless the warm-up (possibly in the pre-fork parent) already did
+            if self._last_refresh is not None:
+                time.sleep(max(0.0, self._last_refresh + self.refresh_interval - time.monotonic()))
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"IdP metadata refresh failed: {e}")
+
+    def stats(self):
+        """
+        Return registry counters.
+
+        Returns:
+            dict: idps (besides the default one), sources, refreshes,
+                not_modified, refresh_failures and entity_errors
+        """
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['idps'] = len(self._index)
+        snapshot['sources'] = len(self._documents)
+        return snapshot
+
+
+def create_idp_registry(settings_cache, authn_templates):
+    """
+    Build the IdP registry from the environment.
+
+    SAML_IDP_METADATA                  - comma-separated metadata files, directories and
+                                         https URLs (default: none, only saml/settings.json)
+    SAML_IDP_METADATA_REFRESH_INTERVAL - seconds between metadata refreshes (default 300, 0 disables)
+    SAML_IDP_METADATA_TIMEOUT          - timeout in seconds for metadata URLs (default 10)
+    SAML_IDP_METADATA_CERT             - file with the certificate metadata must be signed with
+
+    The sources are loaded by the first refresh() (the startup warm-up).
+
+    Args:
+        settings_cache: SAMLSettingsCache of saml/settings.json
+        authn_templates: AuthnRequestTemplates of the default IdP
+
+    Returns:
+        IdPRegistry: Configured registry
+    """
+    sources = [source.strip() for source in os.environ.get('SAML_IDP_METADATA', '').split(',') if source.strip()]
+    signing_cert = None
+    cert_path = os.environ.get('SAML_IDP_METADATA_CERT')
+    if cert_path:
+        with open(cert_path) as f:
+            signing_cert = f.read()
+    return IdPRegistry(
+        settings_cache,
+        authn_templates,
+        sources=sources,
+        refresh_interval=float(os.environ.get('SAML_IDP_METADATA_REFRESH_INTERVAL', 300)),
+        timeout=float(os.environ.get('SAML_IDP_METADATA_TIMEOUT', 10)),
+        signing_cert=signing_cert
+    )
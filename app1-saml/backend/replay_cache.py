@@ -0,0 +1,295 @@
+"""Replay protection for the SAML backend
+
+Keeps two sets of one-time IDs, each entry living until its own expiry:
+
+- consumed assertion IDs, until the assertion's NotOnOrAfter, so a
+  captured SAMLResponse cannot be posted to /saml/callback a second time
+- outstanding AuthnRequest IDs issued by /saml/login, until they are
+  answered (InResponseTo) or time out, so strict mode can reject
+  unsolicited and mismatched responses
+
+Entries are grouped into time buckets by expiry, so expiring them is a
+matter of dropping whole buckets instead of scanning every entry. Two
+stores are provided:
+
+- MemoryReplayCache: in-process, bounded (single process only)
+- SQLiteReplayCache: file-backed, shared by all worker processes on the
+  same host (see sessions.py for the same split)
+"""
+
+import heapq
+import os
+import sqlite3
+import threading
+import time
+
+
+class MemoryReplayCache:
+    """
+    In-process set of one-time IDs with per-entry expiry.
+
+    Each ID is filed under the bucket of its expiry time; once the clock
+    passes a bucket, the whole bucket is dropped. When more than
+    max_entries IDs are held, the IDs closest to expiry are evicted first.
+    """
+
+    def __init__(self, max_entries=100000, bucket_seconds=60):
+        """
+        Args:
+            max_entries: Maximum number of IDs held at once
+            bucket_seconds: Width of the expiry buckets in seconds
+        """
+        self.max_entries = max_entries
+        self.bucket_seconds = bucket_seconds
+        self._expiry = {}    # id -> expires_at
+        self._buckets = {}   # bucket number -> set of ids
+        self._heap = []      # bucket numbers, soonest first
+        self._swept = None   # bucket number of the last sweep
+        self._lock = threading.Lock()
+        self._stats = {'added': 0, 'replayed': 0, 'consumed': 0, 'evicted': 0}
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def _drop_bucket(self, number):
+        for key in self._buckets.pop(number, ()):
+            del self._expiry[key]
+
+    def _sweep(self, now):
+        """Drop every bucket that lies entirely in the past."""
+        current = self._bucket(now)
+        if current == self._swept:
+            return
+        self._swept = current
+        while self._heap and self._heap[0] < current:
+            self._drop_bucket(heapq.heappop(self._heap))
+
+    def _evict(self):
+        """Evict IDs from the soonest-expiring buckets until within max_entries."""
+        while len(self._expiry) > self.max_entries and self._heap:
+            ids = self._buckets.get(self._heap[0])
+            if not ids:
+                self._buckets.pop(heapq.heappop(self._heap), None)
+                continue
+            del self._expiry[ids.pop()]
+            self._stats['evicted'] += 1
+
+    def add(self, key, expires_at):
+        """
+        Record an ID unless it is already held.
+
+        Args:
+            key: Assertion or request ID
+            expires_at: Unix timestamp after which the ID may be forgotten
+
+        Returns:
+            bool: True if the ID was new, False if it is a replay
+        """
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            current = self._expiry.get(key)
+            if current is not None and current > now:
+                self._stats['replayed'] += 1
+                return False
+            if current is not None:
+                self._buckets[self._bucket(current)].discard(key)
+            number = self._bucket(expires_at)
+            ids = self._buckets.get(number)
+            if ids is None:
+                ids = self._buckets[number] = set()
+                heapq.heappush(self._heap, number)
+            ids.add(key)
+            self._expiry[key] = expires_at
+            self._stats['added'] += 1
+            self._evict()
+            return True
+
+    def contains(self, key):
+        """Return True if the ID is held and not expired."""
+        with self._lock:
+            expires_at = self._expiry.get(key)
+            return expires_at is not None and expires_at > time.time()
+
+    def pop(self, key):
+        """
+        Remove an ID, e.g. an AuthnRequest ID once its response arrived.
+
+        Returns:
+            bool: True if the ID was held and not expired
+        """
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            expires_at = self._expiry.pop(key, None)
+            if expires_at is None:
+                return False
+            self._buckets[self._bucket(expires_at)].discard(key)
+            if expires_at <= now:
+                return False
+            self._stats['consumed'] += 1
+            return True
+
+    def stats(self):
+        """
+        Return a snapshot of the cache counters.
+
+        Returns:
+            dict: added, replayed, consumed, evicted and size
+        """
+        with self._lock:
+            return dict(self._stats, size=len(self._expiry))
+
+
+class SQLiteReplayCache:
+    """
+    SQLite-backed set of one-time IDs shared by all processes using the file.
+
+    The check-and-insert runs in one transaction, so two workers receiving
+    the same assertion at once cannot both accept it. Rows carry their
+    expiry bucket (indexed), and past buckets are deleted with one range
+    delete whenever this process sees the bucket change.
+    """
+
+    def __init__(self, path, table, max_entries=100000, bucket_seconds=60):
+        """
+        Args:
+            path: SQLite database file
+            table: Table holding this set of IDs
+            max_entries: Maximum number of rows kept after each purge
+            bucket_seconds: Width of the expiry buckets in seconds
+        """
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.bucket_seconds = bucket_seconds
+        self._local = threading.local()
+        self._swept = None
+        self._lock = threading.Lock()
+        self._stats = {'added': 0, 'replayed': 0, 'consumed': 0, 'evicted': 0}
+        # Use a throwaway connection so none is inherited by forked workers
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} '
+                    '(id TEXT PRIMARY KEY, expires_at REAL NOT NULL, bucket INTEGER NOT NULL)'
+                )
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_bucket ON {table} (bucket)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """Return this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            # WAL keeps the file consistent; losing the last commits on power loss is acceptable here
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _sweep(self, conn, now):
+        """Delete past buckets and trim the table to max_entries, once per bucket."""
+        current = int(now // self.bucket_seconds)
+        with self._lock:
+            if current == self._swept:
+                return
+            self._swept = current
+        conn.execute(f'DELETE FROM {self.table} WHERE bucket < ?', (current,))
+        excess = conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                f'DELETE FROM {self.table} WHERE id IN '
+                f'(SELECT id FROM {self.table} ORDER BY expires_at LIMIT ?)', (excess,)
+            )
+            self._count('evicted', excess)
+
+    def add(self, key, expires_at):
+        """
+        Record an ID unless it is already held.
+
+        Args:
+            key: Assertion or request ID
+            expires_at: Unix timestamp after which the ID may be forgotten
+
+        Returns:
+            bool: True if the ID was new, False if it is a replay
+        """
+        now = time.time()
+        bucket = int(expires_at // self.bucket_seconds)
+        with self._connect() as conn:
+            self._sweep(conn, now)
+            added = conn.execute(
+                f'INSERT OR IGNORE INTO {self.table} (id, expires_at, bucket) VALUES (?, ?, ?)',
+                (key, expires_at, bucket)
+            ).rowcount == 1
+            if not added:
+                # Already present - only reusable if that row has expired
+                added = conn.execute(
+                    f'UPDATE {self.table} SET expires_at = ?, bucket = ? WHERE id = ? AND expires_at <= ?',
+                    (expires_at, bucket, key, now)
+                ).rowcount == 1
+        self._count('added' if added else 'replayed')
+        return added
+
+    def contains(self, key):
+        """Return True if the ID is held and not expired."""
+        return self._connect().execute(
+            f'SELECT 1 FROM {self.table} WHERE id = ? AND expires_at > ?', (key, time.time())
+        ).fetchone() is not None
+
+    def pop(self, key):
+        """
+        Remove an ID, e.g. an AuthnRequest ID once its response arrived.
+
+        Returns:
+            bool: True if the ID was held and not expired
+        """
+        with self._connect() as conn:
+            removed = conn.execute(
+                f'DELETE FROM {self.table} WHERE id = ? AND expires_at > ?', (key, time.time())
+            ).rowcount == 1
+        if removed:
+            self._count('consumed')
+        return removed
+
+    def stats(self):
+        """
+        Return a snapshot of the cache counters (this process only) and the table size.
+
+        Returns:
+            dict: added, replayed, consumed, evicted and size
+        """
+        size = self._connect().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        with self._lock:
+            return dict(self._stats, size=size)
+
+
+def create_replay_caches():
+    """
+    Create the assertion and AuthnRequest ID caches from the environment.
+
+    SAML_REPLAY_BACKEND selects the storage:
+        memory - in-process (default, single process only)
+        sqlite - SQLite file at SAML_REPLAY_SQLITE_PATH, shared across workers
+
+    SAML_REPLAY_MAX_ENTRIES bounds each cache (default 100000).
+
+    Returns:
+        tuple: (assertion ID cache, AuthnRequest ID cache)
+    """
+    backend = os.environ.get('SAML_REPLAY_BACKEND', 'memory')
+    max_entries = int(os.environ.get('SAML_REPLAY_MAX_ENTRIES', 100000))
+    if backend == 'memory':
+        return MemoryReplayCache(max_entries), MemoryReplayCache(max_entries)
+    if backend == 'sqlite':
+        path = os.environ.get('SAML_REPLAY_SQLITE_PATH', '/tmp/saml_replay.db')
+        return (SQLiteReplayCache(path, 'saml_assertions', max_entries),
+                SQLiteReplayCache(path, 'saml_requests', max_entries))
+    raise ValueError(f'Unknown SAML_REPLAY_BACKEND: {backend}')
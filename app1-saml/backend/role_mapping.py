@@ -0,0 +1,135 @@
+"""Role mapping stage for the SSO backends
+
+Turns the role and group values an IdP sends at login into the roles the
+application authorizes on. role_mapping.json lists where each backend
+finds the values and which external names stand for which role:
+
+    {
+        "sources": {
+            "saml": ["userRoles", "Role", "memberOf", "groups"],
+            "oidc": [["realm_access", "roles"], ["resource_access", "{client_id}", "roles"]]
+        },
+        "aliases": {"/admins": "admin", "cn=editors,ou=groups,dc=example,dc=com": "editor"},
+        "idp_roles": {"https://sso.partner.example.com/idp": ["viewer"]}
+    }
+
+A source is an attribute/claim name, or a list of keys for a nested
+claim. Values are normalized (surrounding whitespace, case) and looked up
+in a table compiled once at startup from the role hierarchy's own role
+names and the aliases. Everything else - Keycloak defaults such as
+offline_access and default-roles-*, or hundreds of unrelated groups - is
+dropped, so sessions only carry the handful of roles that matter.
+
+idp_roles limits what a federated SAML IdP (see idp_registry.py) may
+assign: the roles listed for its entityID, and none for IdPs not listed.
+The IdP in saml/settings.json and the OIDC provider are not limited.
+
+Results are cached per set of mapped roles: every user with the same
+roles shares one interned tuple, and the session stores a short sorted
+list next to the role mask (see roles.py).
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import json
+import os
+import sys
+
+
+def normalize(value):
+    """Normalize an external role or group name for lookup."""
+    return value.strip().casefold()
+
+
+class RoleMapper:
+    """Maps IdP role/group values to the application's roles."""
+
+    def __init__(self, document, role_hierarchy, protocol, **placeholders):
+        """
+        Args:
+            document: Parsed role_mapping.json
+            role_hierarchy: RoleHierarchy defining the roles the application authorizes on
+            protocol: 'saml' or 'oidc', selects the sources
+            placeholders: Values substituted into source keys, e.g. client_id
+
+        Raises:
+            ValueError: If an alias maps to a role the hierarchy doesn't define
+        """
+        self.role_hierarchy = role_hierarchy
+        self.sources = []
+        for source in document.get('sources', {}).get(protocol, []):
+            keys = [source] if isinstance(source, str) else source
+            self.sources.append(tuple(key.format(**placeholders) for key in keys))
+
+        # Normalized external name -> bit of the role it maps to
+        self._bits = {normalize(role): bit for role, bit in role_hierarchy.bits.items()}
+        for external, role in document.get('aliases', {}).items():
+            self._bits[normalize(external)] = role_hierarchy.bit(role)
+        # Issuer -> mask of the roles it may assign
+        self._issuer_masks = {
+            issuer: sum(role_hierarchy.bit(role) for role in set(roles))
+            for issuer, roles in document.get('idp_roles', {}).items()
+        }
+        self._keys = frozenset(self._bits)
+        self._names = {}  # mask of mapped roles -> sorted tuple of interned role names
+
+    def _value_lists(self, data):
+        """Yield the list of values found under each configured source."""
+        for keys in self.sources:
+            value = data
+            for key in keys:
+                value = value.get(key) if isinstance(value, dict) else None
+                if value is None:
+                    break
+            if value:
+                yield [value] if isinstance(value, str) else value
+
+    def map(self, data, issuer=None):
+        """
+        Extract and map a user's roles.
+
+        Args:
+            data: SAML attributes (name -> list of values) or OIDC token claims
+            issuer: entityID of a federated IdP, whose roles are limited to its
+                idp_roles entry; None for an IdP that is not limited
+
+        Returns:
+            list: Sorted, de-duplicated application roles
+        """
+        mask = 0
+        for values in self._value_lists(data):
+            try:
+                # Normalized and matched in C - users may carry hundreds of groups
+                matched = self._keys.intersection(map(str.casefold, map(str.strip, values)))
+            except TypeError:
+                matched = self._keys.intersection(normalize(v) for v in values if isinstance(v, str))
+            for key in matched:
+                mask |= self._bits[key]
+        if issuer is not None:
+            mask &= self._issuer_masks.get(issuer, 0)
+
+        names = self._names.get(mask)
+        if names is None:
+            bits = self.role_hierarchy.bits
+            names = self._names[mask] = tuple(sys.intern(role) for role in sorted(bits) if mask & bits[role])
+        return list(names)
+
+
+def load_role_mapper(role_hierarchy, protocol, **placeholders):
+    """
+    Build the role mapper from the environment.
+
+    ROLE_MAPPING_FILE points at the mapping table (default:
+    role_mapping.json next to this module).
+
+    Args:
+        role_hierarchy: Compiled role hierarchy
+        protocol: 'saml' or 'oidc'
+        placeholders: Values substituted into source keys, e.g. client_id
+
+    Returns:
+        RoleMapper: Compiled mapper
+    """
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'role_mapping.json')
+    with open(os.environ.get('ROLE_MAPPING_FILE', default_path)) as f:
+        return RoleMapper(json.load(f), role_hierarchy, protocol, **placeholders)
@@ -0,0 +1,146 @@
+"""Single-pass SAML message parser
+
+Extracts the fields the SAML backend needs from a SAML response (Issuer,
+IDs, NameID, SessionIndex and multi-valued attributes) in one streaming
+pass over the XML. Elements are discarded as soon as they have been
+processed, so memory stays flat even for assertions carrying hundreds of
+group values.
+
+Attributes sent several times under the same Name (which python3-saml
+rejects with "duplicated Name") are merged into a single value list.
+
+Note: this parser does not validate signatures. Use it on responses that
+python3-saml has validated, or for diagnostics.
+"""
+
+import base64
+import io
+import xml.etree.ElementTree as ET
+
+# SAML 2.0 XML namespaces in ElementTree's {uri}local form
+SAML_NS = '{urn:oasis:names:tc:SAML:2.0:assertion}'
+SAMLP_NS = '{urn:oasis:names:tc:SAML:2.0:protocol}'
+
+TAG_RESPONSE = SAMLP_NS + 'Response'
+TAG_LOGOUT_REQUEST = SAMLP_NS + 'LogoutRequest'
+TAG_SESSION_INDEX = SAMLP_NS + 'SessionIndex'
+TAG_ASSERTION = SAML_NS + 'Assertion'
+TAG_ISSUER = SAML_NS + 'Issuer'
+TAG_NAMEID = SAML_NS + 'NameID'
+TAG_SUBJECT_CONFIRMATION_DATA = SAML_NS + 'SubjectConfirmationData'
+TAG_CONDITIONS = SAML_NS + 'Conditions'
+TAG_AUTHN_STATEMENT = SAML_NS + 'AuthnStatement'
+TAG_ATTRIBUTE = SAML_NS + 'Attribute'
+TAG_ATTRIBUTE_VALUE = SAML_NS + 'AttributeValue'
+
+
+def decode_saml_response(encoded):
+    """
+    Base64-decode a SAMLResponse received over the HTTP-POST binding.
+
+    Args:
+        encoded: Base64 string (or bytes) from the SAMLResponse form field
+
+    Returns:
+        bytes: Decoded XML document
+    """
+    return base64.b64decode(encoded)
+
+
+def parse_saml_message(xml_bytes):
+    """
+    Extract identifiers, subject and attributes from a SAML message in one pass.
+
+    Args:
+        xml_bytes: Decoded SAML Response (or LogoutRequest) XML
+
+    Returns:
+        dict: issuer, message_type, message_id, in_response_to, assertion_id,
+            nameid, nameid_format, nameid_nq, nameid_spnq, session_index,
+            session_not_on_or_after, not_on_or_after and attributes
+            (dict of attribute name -> list of values)
+    """
+    result = {
+        'issuer': None,
+        'message_type': None,
+        'message_id': None,
+        'in_response_to': None,
+        'assertion_id': None,
+        'nameid': None,
+        'nameid_format': None,
+        'nameid_nq': None,
+        'nameid_spnq': None,
+        'session_index': None,
+        'session_not_on_or_after': None,
+        'not_on_or_after': None,
+        'attributes': {}
+    }
+    attributes = result['attributes']
+    attr_name = None
+    attr_values = None
+    # Open elements, so finished ones can be detached from their parent
+    stack = []
+
+    for event, elem in ET.iterparse(io.BytesIO(xml_bytes), events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if not stack:
+                # Root element: Response or LogoutRequest
+                result['message_type'] = tag.rsplit('}', 1)[-1]
+                result['message_id'] = elem.get('ID')
+                result['in_response_to'] = elem.get('InResponseTo')
+            elif tag == TAG_ASSERTION and result['assertion_id'] is None:
+                result['assertion_id'] = elem.get('ID')
+            elif tag == TAG_ATTRIBUTE:
+                attr_name = elem.get('Name')
+                attr_values = []
+            elif tag == TAG_AUTHN_STATEMENT and result['session_index'] is None:
+                result['session_index'] = elem.get('SessionIndex')
+                result['session_not_on_or_after'] = elem.get('SessionNotOnOrAfter')
+            elif tag == TAG_SUBJECT_CONFIRMATION_DATA and result['not_on_or_after'] is None:
+                result['not_on_or_after'] = elem.get('NotOnOrAfter')
+            elif tag == TAG_CONDITIONS and result['not_on_or_after'] is None:
+                result['not_on_or_after'] = elem.get('NotOnOrAfter')
+            stack.append(elem)
+            continue
+
+        # 'end' event - the element and its text are complete
+        if tag == TAG_ATTRIBUTE_VALUE:
+            if elem.text and attr_values is not None:
+                attr_values.append(elem.text)
+        elif tag == TAG_ATTRIBUTE:
+            if attr_name and attr_values:
+                # Merge attributes repeated under the same Name (e.g. one per role)
+                attributes.setdefault(attr_name, []).extend(attr_values)
+            attr_name = attr_values = None
+        elif tag == TAG_NAMEID and result['nameid'] is None:
+            result['nameid'] = elem.text or ''
+            result['nameid_format'] = elem.get('Format')
+            result['nameid_nq'] = elem.get('NameQualifier')
+            result['nameid_spnq'] = elem.get('SPNameQualifier')
+        elif tag == TAG_ISSUER and result['issuer'] is None:
+            result['issuer'] = (elem.text or '').strip()
+        elif tag == TAG_SESSION_INDEX and result['session_index'] is None:
+            # LogoutRequest carries SessionIndex as an element
+            result['session_index'] = elem.text
+
+        stack.pop()
+        if stack:
+            # Finished elements are always the parent's last child - drop it
+            del stack[-1][-1]
+
+    return result
+
+
+def parse_saml_response(encoded):
+    """
+    Decode and parse a base64-encoded SAMLResponse.
+
+    Args:
+        encoded: Base64 string from the SAMLResponse form field
+
+    Returns:
+        tuple: (decoded XML bytes, dict from parse_saml_message)
+    """
+    xml_bytes = decode_saml_response(encoded)
+    return xml_bytes, parse_saml_message(xml_bytes)
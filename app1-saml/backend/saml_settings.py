@@ -0,0 +1,90 @@
+"""Cached SAML settings for the SAML backend
+
+Parses and validates saml/settings.json (and advanced_settings.json, if
+present) once into a OneLogin_Saml2_Settings object that is shared by every
+request. The files' modification times are polled so edits are picked up
+without a restart, while per-request setup only has to bind the request data.
+"""
+
+import os
+import threading
+import time
+
+from onelogin.saml2.settings import OneLogin_Saml2_Settings
+
+# Files python3-saml reads from the custom base path
+SETTINGS_FILES = ('settings.json', 'advanced_settings.json')
+
+
+class SAMLSettingsCache:
+    """
+    Holds a prebuilt, validated OneLogin_Saml2_Settings instance.
+
+    The settings object is treated as read-only once built: a reload creates
+    a new instance and swaps it in, so requests already holding the previous
+    one are unaffected.
+    """
+
+    def __init__(self, base_path, check_interval=1.0):
+        """
+        Args:
+            base_path: Directory containing settings.json and the certs folder
+            check_interval: Minimum seconds between two mtime checks
+        """
+        self.base_path = base_path
+        self.check_interval = check_interval
+        self._settings = None
+        self._mtimes = None
+        self._version = 0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _current_mtimes(self):
+        """Return the modification times of the settings files (None if absent)."""
+        mtimes = []
+        for name in SETTINGS_FILES:
+            try:
+                mtimes.append(os.stat(os.path.join(self.base_path, name)).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _reload(self, mtimes):
+        """Parse and validate the settings files, keeping the old settings on error."""
+        try:
+            settings = OneLogin_Saml2_Settings(custom_base_path=self.base_path)
+        except Exception as e:
+            if self._settings is None:
+                raise
+            print(f"SAML settings reload error, keeping previous settings: {e}")
+            # Don't retry until the files change again
+            self._mtimes = mtimes
+            return
+        self._settings = settings
+        self._mtimes = mtimes
+        self._version += 1
+        print(f"SAML settings loaded (version {self._version})")
+
+    def get(self):
+        """
+        Return the shared settings object, reloading it if the files changed.
+
+        Returns:
+            OneLogin_Saml2_Settings: Validated SAML settings
+        """
+        now = time.monotonic()
+        if self._settings is not None and now < self._next_check:
+            return self._settings
+
+        with self._lock:
+            if self._settings is None or now >= self._next_check:
+                mtimes = self._current_mtimes()
+                if mtimes != self._mtimes:
+                    self._reload(mtimes)
+                self._next_check = now + self.check_interval
+            return self._settings
+
+    @property
+    def version(self):
+        """Counter incremented every time a new settings object is loaded."""
+        return self._version
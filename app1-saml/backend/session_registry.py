@@ -0,0 +1,346 @@
+"""Session registry and revocation for back-channel logout
+
+Every login registers the new session under the identity keys the IdP
+uses to address it in a logout (SAML NameID and SessionIndex, OIDC sub
+and sid) and stores the returned registry ID in the session itself. A
+back-channel logout then looks the keys up and adds the matching
+registry IDs to a revocation set; each request checks its session's ID
+against that set and clears the session on a hit. This works the same
+for cookie sessions, which cannot be deleted server-side.
+
+Registry IDs are random 63-bit integers, so the revocation set is a set
+of ints and the per-request check is a single membership test. Entries
+expire with the session lifetime, in time buckets like the SAML replay
+cache. Activity (a server-side store's TTL being reset on every write, an
+OIDC token refresh) must not let a session outlive its registration and
+revocation, so register() also returns the absolute expiry: the backends
+store it in the session and clear the session once it has passed. Two
+registries are provided:
+
+- MemorySessionRegistry: in-process (single process only)
+- SQLiteSessionRegistry: index and revocations in a SQLite file shared by
+  all workers; each process mirrors the revocations in memory and picks
+  up new ones at most sync_interval seconds late
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import heapq
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+
+class RevocationSet:
+    """Set of revoked registry IDs, each forgotten once its session has expired."""
+
+    def __init__(self, bucket_seconds=60):
+        self.bucket_seconds = bucket_seconds
+        self._ids = set()
+        self._buckets = {}  # bucket number -> list of ids
+        self._heap = []     # bucket numbers, soonest first
+        self._swept = None
+        self._lock = threading.Lock()
+
+    def add(self, registry_id, expires_at):
+        """Revoke an ID until expires_at; returns False if it already was."""
+        with self._lock:
+            self._sweep(time.time())
+            if registry_id in self._ids:
+                return False
+            self._ids.add(registry_id)
+            number = int(expires_at // self.bucket_seconds)
+            ids = self._buckets.get(number)
+            if ids is None:
+                ids = self._buckets[number] = []
+                heapq.heappush(self._heap, number)
+            ids.append(registry_id)
+            return True
+
+    def _sweep(self, now):
+        current = int(now // self.bucket_seconds)
+        if current == self._swept:
+            return
+        self._swept = current
+        while self._heap and self._heap[0] < current:
+            for registry_id in self._buckets.pop(heapq.heappop(self._heap)):
+                self._ids.discard(registry_id)
+
+    def __contains__(self, registry_id):
+        return registry_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class MemorySessionRegistry:
+    """In-process index of sessions by identity key, with a revocation set."""
+
+    def __init__(self, ttl, bucket_seconds=60):
+        """
+        Args:
+            ttl: Maximum session lifetime in seconds; registrations expire after it
+            bucket_seconds: Width of the expiry buckets in seconds
+        """
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self._index = {}     # key -> set of registry ids
+        self._sessions = {}  # registry id -> (keys, expires_at)
+        self._buckets = {}   # bucket number -> list of registry ids
+        self._heap = []
+        self._swept = None
+        self._revoked = RevocationSet(bucket_seconds)
+        self._lock = threading.Lock()
+        self._stats = {'registered': 0, 'revoked': 0}
+
+    def _sweep(self, now):
+        """Forget registrations whose sessions have expired."""
+        current = int(now // self.bucket_seconds)
+        if current == self._swept:
+            return
+        self._swept = current
+        while self._heap and self._heap[0] < current:
+            for registry_id in self._buckets.pop(heapq.heappop(self._heap)):
+                keys, _ = self._sessions.pop(registry_id, ((), None))
+                for key in keys:
+                    ids = self._index.get(key)
+                    if ids is not None:
+                        ids.discard(registry_id)
+                        if not ids:
+                            del self._index[key]
+
+    def register(self, keys):
+        """
+        Register a new session under its identity keys.
+
+        Args:
+            keys: Keys the IdP may address the session by, e.g. 'sid:...'
+                (None entries are skipped)
+
+        Returns:
+            tuple: (registry ID, expires_at) to store in the session; the
+                session must end at expires_at, when its entries are forgotten
+        """
+        registry_id = secrets.randbits(63)
+        keys = tuple(key for key in keys if key)
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._sweep(now)
+            self._sessions[registry_id] = (keys, expires_at)
+            for key in keys:
+                self._index.setdefault(key, set()).add(registry_id)
+            number = int(expires_at // self.bucket_seconds)
+            ids = self._buckets.get(number)
+            if ids is None:
+                ids = self._buckets[number] = []
+                heapq.heappush(self._heap, number)
+            ids.append(registry_id)
+            self._stats['registered'] += 1
+        return registry_id, expires_at
+
+    def revoke(self, key):
+        """
+        Revoke every session registered under a key.
+
+        Args:
+            key: Identity key, e.g. 'nameid:alice' or 'sid:...'
+
+        Returns:
+            int: Number of sessions revoked
+        """
+        with self._lock:
+            self._sweep(time.time())
+            revoked = 0
+            for registry_id in self._index.pop(key, ()):
+                _, expires_at = self._sessions[registry_id]
+                if self._revoked.add(registry_id, expires_at):
+                    revoked += 1
+            self._stats['revoked'] += revoked
+            return revoked
+
+    def is_revoked(self, registry_id):
+        """Return True if the session with this registry ID has been revoked."""
+        return registry_id in self._revoked
+
+    def stats(self):
+        """
+        Return a snapshot of the registry counters.
+
+        Returns:
+            dict: registered, revoked, sessions and revoked_sessions
+        """
+        with self._lock:
+            return dict(self._stats, sessions=len(self._sessions), revoked_sessions=len(self._revoked))
+
+
+class SQLiteSessionRegistry:
+    """
+    Session index and revocation log in SQLite, shared by all processes.
+
+    Revocations are appended to a log; each process replays new log rows
+    into its in-memory RevocationSet at most every sync_interval seconds,
+    so the per-request check never touches the database in between.
+    """
+
+    def __init__(self, path, ttl, sync_interval=1.0, purge_every=1000):
+        """
+        Args:
+            path: SQLite database file
+            ttl: Maximum session lifetime in seconds; registrations expire after it
+            sync_interval: Maximum seconds before another worker's revocation applies here
+            purge_every: Delete expired rows every this many registrations
+        """
+        self.path = path
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._revoked = RevocationSet()
+        self._synced_seq = 0
+        self._next_sync = 0.0
+        self._sync_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {'registered': 0, 'revoked': 0}
+        # Use a throwaway connection so none is inherited by forked workers
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS registry_index '
+                    '(key TEXT NOT NULL, registry_id INTEGER NOT NULL, expires_at REAL NOT NULL)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS registry_index_key ON registry_index (key)')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS registry_revoked '
+                    '(seq INTEGER PRIMARY KEY AUTOINCREMENT, registry_id INTEGER NOT NULL, expires_at REAL NOT NULL)'
+                )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """Return this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def register(self, keys):
+        """
+        Register a new session under its identity keys.
+
+        Args:
+            keys: Keys the IdP may address the session by (None entries are skipped)
+
+        Returns:
+            tuple: (registry ID, expires_at) to store in the session; the
+                session must end at expires_at, when its entries are forgotten
+        """
+        registry_id = secrets.randbits(63)
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO registry_index (key, registry_id, expires_at) VALUES (?, ?, ?)',
+                [(key, registry_id, expires_at) for key in keys if key]
+            )
+            with self._lock:
+                self._stats['registered'] += 1
+                purge = self._stats['registered'] % self.purge_every == 0
+            if purge:
+                conn.execute('DELETE FROM registry_index WHERE expires_at <= ?', (now,))
+                conn.execute('DELETE FROM registry_revoked WHERE expires_at <= ?', (now,))
+        return registry_id, expires_at
+
+    def revoke(self, key):
+        """
+        Revoke every session registered under a key.
+
+        Args:
+            key: Identity key, e.g. 'nameid:alice' or 'sid:...'
+
+        Returns:
+            int: Number of sessions revoked
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT registry_id, expires_at FROM registry_index WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchall()
+            conn.executemany('INSERT INTO registry_revoked (registry_id, expires_at) VALUES (?, ?)', rows)
+            conn.execute('DELETE FROM registry_index WHERE key = ?', (key,))
+        # Apply locally right away; other processes pick it up on their next sync
+        revoked = sum(1 for registry_id, expires_at in rows if self._revoked.add(registry_id, expires_at))
+        with self._lock:
+            self._stats['revoked'] += revoked
+        return revoked
+
+    def _sync(self):
+        """Replay revocations logged by other processes since the last sync."""
+        if not self._sync_lock.acquire(blocking=False):
+            return  # Another thread is syncing
+        try:
+            rows = self._connect().execute(
+                'SELECT seq, registry_id, expires_at FROM registry_revoked WHERE seq > ? ORDER BY seq',
+                (self._synced_seq,)
+            ).fetchall()
+            for seq, registry_id, expires_at in rows:
+                self._revoked.add(registry_id, expires_at)
+                self._synced_seq = seq
+        except sqlite3.Error as e:
+            # Keep serving from the local set; retry on the next interval
+            print(f"Session registry sync error: {e}")
+        finally:
+            self._next_sync = time.monotonic() + self.sync_interval
+            self._sync_lock.release()
+
+    def is_revoked(self, registry_id):
+        """Return True if the session with this registry ID has been revoked."""
+        if time.monotonic() >= self._next_sync:
+            self._sync()
+        return registry_id in self._revoked
+
+    def stats(self):
+        """
+        Return a snapshot of the registry counters (this process only).
+
+        Returns:
+            dict: registered, revoked and revoked_sessions
+        """
+        with self._lock:
+            return dict(self._stats, revoked_sessions=len(self._revoked))
+
+
+def create_session_registry(app):
+    """
+    Create the session registry from the environment.
+
+    SESSION_REGISTRY_BACKEND selects the storage:
+        memory - in-process (default, single process only)
+        sqlite - SQLite file at SESSION_REGISTRY_SQLITE_PATH, shared across workers
+
+    Args:
+        app: Flask application (its session lifetime bounds registrations)
+
+    Returns:
+        MemorySessionRegistry or SQLiteSessionRegistry
+    """
+    # Absolute lifetime of a login: sessions end when their registration expires, however
+    # often they are used or refreshed. SESSION_REGISTRY_TTL overrides the session lifetime
+    ttl = int(os.environ.get('SESSION_REGISTRY_TTL', app.permanent_session_lifetime.total_seconds()))
+    backend = os.environ.get('SESSION_REGISTRY_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemorySessionRegistry(ttl)
+    if backend == 'sqlite':
+        default_path = f"/tmp/{app.config['SESSION_COOKIE_NAME']}_registry.db"
+        return SQLiteSessionRegistry(
+            os.environ.get('SESSION_REGISTRY_SQLITE_PATH', default_path),
+            ttl,
+            sync_interval=float(os.environ.get('SESSION_REGISTRY_SYNC_INTERVAL', 1.0))
+        )
+    raise ValueError(f'Unknown SESSION_REGISTRY_BACKEND: {backend}')
@@ -0,0 +1,173 @@
+"""Bounded worker pool for SAML response validation
+
+auth.process_response() canonicalizes the XML and verifies its
+signatures - milliseconds of CPU per login, far more for large
+assertions. Run inline, a burst of logins occupies every request thread
+of a worker and the cheap /api/* calls sharing those threads queue up
+behind them.
+
+ValidationPool runs that work on a small, fixed set of threads fed by a
+bounded queue, so at most `workers` validations compete with the rest of
+the application per process:
+
+- when the queue is full, run() fails immediately (the callback answers
+  503 with Retry-After) instead of piling up more waiting logins
+- a job that is still queued when its deadline passes is dropped without
+  being validated; once a worker has started a job, it is completed
+
+The worker threads are started lazily on the first job, so they are
+created in the worker process rather than in a pre-fork parent.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class ValidationRejected(Exception):
+    """A validation job was not run: the queue was full or its deadline passed."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ValidationPool:
+    """Fixed-size thread pool with a bounded queue and per-job deadlines."""
+
+    def __init__(self, workers=2, queue_size=32, deadline=5.0, retry_after=1, on_wait=None):
+        """
+        Args:
+            workers: Threads running validations
+            queue_size: Maximum number of jobs waiting for a thread
+            deadline: Seconds a job may wait for a thread before it is dropped
+            retry_after: Retry-After value (seconds) reported on rejection
+            on_wait: Optional callable receiving (outcome, seconds queued) per job,
+                with outcome 'run' or 'expired'
+        """
+        self.workers = workers
+        self.deadline = deadline
+        self.retry_after = retry_after
+        self.on_wait = on_wait
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._running = 0
+        self._stats = {
+            'completed': 0,
+            'rejected': 0,
+            'expired': 0
+        }
+
+    def _count(self, name, delta=1):
+        with self._stats_lock:
+            self._stats[name] += delta
+
+    def _ensure_workers(self):
+        """Start the worker threads if they are not running yet."""
+        if len(self._threads) == self.workers:
+            return
+        with self._thread_lock:
+            for index in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f'saml-validation-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            future, fn, args, enqueued = self._queue.get()
+            try:
+                # Cancelled by a caller whose deadline passed while the job was queued
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if self.on_wait is not None:
+                    self.on_wait('run', time.monotonic() - enqueued)
+                with self._stats_lock:
+                    self._running += 1
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+                finally:
+                    with self._stats_lock:
+                        self._running -= 1
+                        self._stats['completed'] += 1
+            finally:
+                self._queue.task_done()
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool and wait for its result.
+
+        Args:
+            fn: Callable to run
+            *args: Arguments passed to fn
+
+        Returns:
+            The return value of fn
+
+        Raises:
+            ValidationRejected: If the queue is full or the job's deadline passed before it started
+            Exception: Whatever fn raised
+        """
+        future = Future()
+        enqueued = time.monotonic()
+        try:
+            self._queue.put_nowait((future, fn, args, enqueued))
+        except queue.Full:
+            self._count('rejected')
+            raise ValidationRejected('Too many logins are being validated, retry shortly', self.retry_after)
+        self._ensure_workers()
+
+        try:
+            return future.result(timeout=self.deadline)
+        except FutureTimeoutError:
+            if future.cancel():
+                self._count('expired')
+                if self.on_wait is not None:
+                    self.on_wait('expired', time.monotonic() - enqueued)
+                raise ValidationRejected('Login validation timed out in the queue, retry shortly',
+                                         self.retry_after)
+            # Already running - finish the work that has been started
+            return future.result()
+
+    def stats(self):
+        """
+        Return a snapshot of the pool counters.
+
+        Returns:
+            dict: completed, rejected and expired job counts, the current
+                queue depth and the number of running validations
+        """
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+            snapshot['running'] = self._running
+        snapshot['queue_depth'] = self._queue.qsize()
+        return snapshot
+
+
+def create_validation_pool(on_wait=None):
+    """
+    Build the validation pool from the environment.
+
+    SAML_VALIDATION_WORKERS      - threads validating responses per process (default 2)
+    SAML_VALIDATION_QUEUE_SIZE   - responses that may wait for a thread (default 32)
+    SAML_VALIDATION_DEADLINE     - seconds a response may wait before it is rejected (default 5)
+    SAML_VALIDATION_RETRY_AFTER  - Retry-After in seconds on rejection (default 1)
+
+    Args:
+        on_wait: Optional callable receiving (outcome, seconds queued) per job
+
+    Returns:
+        ValidationPool: Configured pool
+    """
+    return ValidationPool(
+        workers=int(os.environ.get('SAML_VALIDATION_WORKERS', 2)),
+        queue_size=int(os.environ.get('SAML_VALIDATION_QUEUE_SIZE', 32)),
+        deadline=float(os.environ.get('SAML_VALIDATION_DEADLINE', 5.0)),
+        retry_after=int(os.environ.get('SAML_VALIDATION_RETRY_AFTER', 1)),
+        on_wait=on_wait
+    )
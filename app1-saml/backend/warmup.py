@@ -0,0 +1,212 @@
+"""Startup warm-up and readiness for the SSO backends
+
+Much of what a login needs is set up lazily: settings and keys are
+loaded, clients built and modules imported by the first request that
+uses them, so right after a deploy the first logins of every worker are
+the slowest, and a login during an IdP outage fails in the user's face.
+
+WarmUp runs a backend's warm-up stages once at startup - in wsgi.py,
+i.e. in the Gunicorn master before the workers are forked - and records
+how long each took. Stages that reach the IdP are retried with
+exponential backoff. /ready answers 503 until every required stage has
+succeeded, so a load balancer only sends traffic to warm workers. A
+required stage that still fails after its retries (e.g. Keycloak is not
+up yet) is retried by /ready itself, at most once per retry interval.
+
+Import and stage timings are logged at startup and reported on /metrics,
+so cold-start regressions show up on dashboards.
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import os
+import threading
+import time
+
+from flask import jsonify
+
+
+class WarmUp:
+    """Named startup stages, their timings and the resulting readiness."""
+
+    def __init__(self, name, retries=3, backoff=0.5, retry_interval=10.0):
+        """
+        Args:
+            name: Backend name used in log lines
+            retries: Extra attempts for stages marked retry=True
+            backoff: Delay before the first retry in seconds, doubled per retry
+            retry_interval: Minimum seconds between retries of failed stages from /ready
+        """
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_interval = retry_interval
+        self.import_seconds = None
+        self._stages = []    # (name, fn, required, retry) in registration order
+        self._results = {}   # stage name -> {'ok', 'seconds', 'attempts', 'error'}
+        self._ready = False
+        self._next_retry = 0.0
+        self._lock = threading.Lock()
+
+    def stage(self, name, required=True, retry=False):
+        """
+        Register a warm-up stage (decorator).
+
+        Args:
+            name: Stage name, used in logs and metric names
+            required: Whether /ready waits for the stage to succeed
+            retry: Retry the stage with backoff when it fails (stages that reach the IdP)
+        """
+        def decorator(fn):
+            self._stages.append((name, fn, required, retry))
+            return fn
+        return decorator
+
+    def record_import(self, seconds):
+        """Record how long importing the application took."""
+        self.import_seconds = seconds
+        print(f"{self.name} imported in {seconds * 1000:.1f} ms")
+
+    def _run_stage(self, name, fn, attempts):
+        result = {'ok': False, 'seconds': 0.0, 'attempts': 0, 'error': None}
+        start = time.perf_counter()
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            result['attempts'] += 1
+            try:
+                detail = fn()
+                result['ok'] = True
+                result['error'] = None
+                break
+            except Exception as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+        result['seconds'] = time.perf_counter() - start
+        self._results[name] = result
+
+        if result['ok']:
+            suffix = f' ({detail})' if detail else ''
+            retried = f', {result["attempts"]} attempts' if result['attempts'] > 1 else ''
+            print(f"Warm-up {name}: {result['seconds'] * 1000:.1f} ms{retried}{suffix}")
+        else:
+            print(f"Warm-up {name} failed after {result['attempts']} attempt(s): {result['error']}")
+        return result['ok']
+
+    def _update_ready(self):
+        self._ready = all(self._results.get(name, {}).get('ok') for name, _, required, _ in self._stages if required)
+
+    def run(self):
+        """
+        Run every stage once, retrying the ones marked retry=True.
+
+        Returns:
+            bool: True if all required stages succeeded
+        """
+        start = time.perf_counter()
+        with self._lock:
+            for name, fn, required, retry in self._stages:
+                self._run_stage(name, fn, 1 + self.retries if retry else 1)
+            self._update_ready()
+            self._next_retry = time.monotonic() + self.retry_interval
+        failed = [name for name, result in self._results.items() if not result['ok']]
+        state = 'ready' if self._ready else 'NOT ready'
+        print(f"{self.name} warmed up in {(time.perf_counter() - start) * 1000:.1f} ms, {state}"
+              + (f" (failed: {', '.join(failed)})" if failed else ''))
+        return self._ready
+
+    def retry_failed(self):
+        """
+        Retry failed required stages once, at most once per retry interval.
+
+        Never blocks behind a retry already in progress.
+
+        Returns:
+            bool: Current readiness
+        """
+        if self._ready or time.monotonic() < self._next_retry:
+            return self._ready
+        if not self._lock.acquire(blocking=False):
+            return self._ready
+        try:
+            for name, fn, required, _ in self._stages:
+                if required and not self._results.get(name, {}).get('ok'):
+                    self._run_stage(name, fn, 1)
+            self._update_ready()
+            self._next_retry = time.monotonic() + self.retry_interval
+            if self._ready:
+                print(f"{self.name} ready")
+        finally:
+            self._lock.release()
+        return self._ready
+
+    @property
+    def ready(self):
+        """True once every required stage has succeeded."""
+        return self._ready
+
+    def status(self):
+        """
+        Return readiness and timings.
+
+        Returns:
+            dict: ready, import_ms and per-stage ok, ms, attempts and error
+        """
+        stages = {}
+        for name, _, required, _ in self._stages:
+            result = self._results.get(name)
+            if result is None:
+                stages[name] = {'ok': False, 'required': required, 'error': 'not run'}
+                continue
+            stages[name] = {'ok': result['ok'], 'required': required, 'ms': round(result['seconds'] * 1000, 1),
+                            'attempts': result['attempts']}
+            if result['error']:
+                stages[name]['error'] = result['error']
+        return {
+            'ready': self._ready,
+            'import_ms': None if self.import_seconds is None else round(self.import_seconds * 1000, 1),
+            'stages': stages,
+        }
+
+
+def init_readiness(app, warmup):
+    """
+    Add the /ready endpoint.
+
+    Answers 200 once warm-up has completed and 503 until then, with the
+    stage status as JSON either way.
+
+    Args:
+        app: Flask application
+        warmup: WarmUp whose readiness is reported
+    """
+    def ready_endpoint():
+        if not warmup.ready:
+            warmup.retry_failed()
+        response = jsonify(warmup.status())
+        response.status_code = 200 if warmup.ready else 503
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    app.add_url_rule('/ready', 'ready', ready_endpoint)
+
+
+def create_warmup(name):
+    """
+    Build the warm-up runner from the environment.
+
+    WARMUP_RETRIES         - extra attempts for stages reaching the IdP (default 3)
+    WARMUP_BACKOFF         - seconds before the first retry, doubled per retry (default 0.5)
+    WARMUP_RETRY_INTERVAL  - seconds between retries of failed stages from /ready (default 10)
+
+    Args:
+        name: Backend name used in log lines
+
+    Returns:
+        WarmUp: Runner without stages
+    """
+    return WarmUp(
+        name,
+        retries=int(os.environ.get('WARMUP_RETRIES', 3)),
+        backoff=float(os.environ.get('WARMUP_BACKOFF', 0.5)),
+        retry_interval=float(os.environ.get('WARMUP_RETRY_INTERVAL', 10))
+    )
@@ -0,0 +1,31 @@
+"""WSGI entry point for the SAML backend
+
+Used by Gunicorn in production (see gunicorn.conf.py). create_app() runs
+the startup warm-up (see warmup.py and the stages in app.py) - parsed and
+validated SAML settings, the AuthnRequest template, federated IdP
+metadata (see idp_registry.py), the IdP certificates loaded into xmlsec,
+the compiled role hierarchy and authorization policy and a first
+anonymous request - so that with preload_app it is done once in the
+master process and inherited by every worker instead of being paid for
+by the first logins. /ready reports whether it succeeded.
+"""
+
+import time
+
+
+def create_app():
+    """
+    Import the application and run its warm-up stages.
+
+    Returns:
+        Flask: The SAML backend application
+    """
+    start = time.perf_counter()
+    from app import app, warmup
+
+    warmup.record_import(time.perf_counter() - start)
+    warmup.run()
+    return app
+
+
+app = create_app()
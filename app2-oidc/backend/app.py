@@ -7,12 +7,26 @@ for the OIDC-based application in the SSO proof of concept.
 
 import os
 import json
-from flask import Flask, request, redirect, session, jsonify, url_for
+import time
+from flask import Flask, request, redirect, session, jsonify, url_for, g
 from flask_cors import CORS
 from authlib.integrations.flask_client import OAuth
+from authlib.integrations.base_client import MismatchingStateError
 from functools import wraps
+from sessions import init_session_store, regenerate_session
+from roles import load_role_hierarchy
+from role_mapping import load_role_mapper
+from policy import create_policy_engine, DECISION_BUCKETS, UNCOVERED
+from user_view import UserViewCache, ANONYMOUS_VERSION, view_version, parse_fields, etag_for
+from instrumentation import create_metrics, init_instrumentation
 import jwt
-from jwt import PyJWKClient
+from jwks import JWKSKeyStore
+from bearer import BearerTokenVerifier
+from refresh import TokenRefreshManager, INVALID
+from http_client import IdPHTTPClient
+from session_registry import create_session_registry
+from rate_limit import init_rate_limiting
+from warmup import create_warmup, init_readiness
 
 # Initialize Flask application
 app = Flask(__name__)
@@ -27,10 +41,39 @@ app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HT
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection while allowing IdP redirects
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # Session timeout: 1 hour
 
+# Keep session data server-side - the cookie only carries an opaque session ID
+# SESSION_BACKEND=memory|sqlite|cookie selects the store (see sessions.py)
+init_session_store(app)
+
+# Per-stage timing histograms exposed on /metrics in Prometheus format (see instrumentation.py)
+# SERVER_TIMING_ENABLED=true also reports them in a Server-Timing response header
+metrics = create_metrics('oidc_backend')
+init_instrumentation(app, metrics)
+
 # Enable CORS for frontend application
 # In production, origins should be restricted to actual frontend domains
 CORS(app, supports_credentials=True, origins=['http://localhost:4001'])
 
+# Token buckets per client IP and per session (callbacks per IP only) in front of the endpoints
+# that reach Keycloak; exhausted buckets are answered 429 before the session is loaded (see rate_limit.py)
+# RATE_LIMIT_BACKEND=memory|sqlite, RATE_LIMIT_ENABLED=false turns it off
+rate_limiter = init_rate_limiting(app, ('/oidc/login', '/oidc/callback'), ip_only_paths=('/oidc/callback',))
+
+def rate_limit_metrics():
+    """Report rate limiter counters on /metrics."""
+    if rate_limiter is None:
+        return []
+    stats = rate_limiter.stats()
+    samples = [
+        ('rate_limit_buckets', 'gauge', 'Token buckets held by the rate limiter', stats.pop('size')),
+        ('rate_limit_evicted_total', 'counter', 'Token buckets evicted before they were full', stats.pop('evicted')),
+    ]
+    for name, value in stats.items():
+        samples.append((f'rate_limit_{name}_total', 'counter', f'Login requests {name.replace("_", " by ")}', value))
+    return samples
+
+metrics.register_collector(rate_limit_metrics)
+
 # Initialize OAuth client
 oauth = OAuth(app)
 
@@ -43,6 +86,18 @@ OIDC_ISSUER = os.environ.get('OIDC_ISSUER', 'http://keycloak:8080/realms/sso-poc
 OIDC_ISSUER_PUBLIC = os.environ.get('OIDC_ISSUER_PUBLIC', 'http://localhost:8080/realms/sso-poc')
 OIDC_REDIRECT_URI = os.environ.get('OIDC_REDIRECT_URI', 'http://localhost:4000/oidc/callback')
 
+# Shared keep-alive connection pool for every call to Keycloak (token exchange,
+# JWKS, refresh) with bounded size, timeouts and jittered retries (see http_client.py)
+idp_http = IdPHTTPClient(
+    pool_size=int(os.environ.get('IDP_POOL_SIZE', 10)),
+    connect_timeout=float(os.environ.get('IDP_CONNECT_TIMEOUT', 2)),
+    read_timeout=float(os.environ.get('IDP_READ_TIMEOUT', 5)),
+    retries=int(os.environ.get('IDP_RETRIES', 2)),
+    keep_alive=os.environ.get('IDP_POOL_ENABLED', 'true').lower() == 'true'
+)
+idp_latency = metrics.histogram('idp_request_duration_seconds', 'Duration of calls to the IdP by endpoint', 'endpoint')
+idp_http.on_latency(idp_latency.observe)
+
 # Configure OAuth with explicit endpoints to avoid metadata discovery issues
 # Using explicit endpoints instead of metadata URL for better control and debugging
 oidc = oauth.register(
@@ -54,91 +109,249 @@ oidc = oauth.register(
     jwks_uri=f'{OIDC_ISSUER}/protocol/openid-connect/certs',  # JWKS endpoint for token validation
     client_kwargs={
         'scope': 'openid email profile roles'  # Request user info and role claims
-    }
+    },
+    compliance_fix=idp_http.mount  # Route Authlib's per-call sessions through the shared pool
+)
+
+# Process-wide JWKS cache - keys are fetched once and refreshed on TTL expiry
+# or when a token is signed with an unknown kid (key rotation)
+jwks_store = JWKSKeyStore(
+    f'{OIDC_ISSUER}/protocol/openid-connect/certs',
+    ttl=int(os.environ.get('JWKS_CACHE_TTL', 300)),
+    timeout=idp_http.timeout,
+    http=idp_http.session
+)
+
+def jwks_metrics():
+    """Report JWKS cache counters on /metrics."""
+    stats = jwks_store.stats()
+    samples = [('jwks_keys', 'gauge', 'Signing keys held in the JWKS cache', stats.pop('keys'))]
+    for name, value in stats.items():
+        samples.append((f'jwks_{name}_total', 'counter', f'JWKS cache {name.replace("_", " ")}', value))
+    return samples
+
+metrics.register_collector(jwks_metrics)
+
+# Access tokens are refreshed lazily, shortly before they expire, with the stored
+# refresh token - single-flight per token so parallel SPA calls share one refresh
+# (or, for TOKEN_REFRESH_FAILURE_BACKOFF seconds, one failure)
+token_refresher = TokenRefreshManager(
+    f'{OIDC_ISSUER}/protocol/openid-connect/token',
+    OIDC_CLIENT_ID,
+    OIDC_CLIENT_SECRET,
+    skew=int(os.environ.get('TOKEN_REFRESH_SKEW', 30)),
+    failure_backoff=float(os.environ.get('TOKEN_REFRESH_FAILURE_BACKOFF', 5)),
+    http=idp_http.session,
+    timeout=idp_http.timeout,
+    on_latency=lambda seconds: metrics.observe('token_refresh', seconds)
 )
 
+def refresh_metrics():
+    """Report token refresh counters on /metrics."""
+    return [(f'token_refresh_{name}_total', 'counter', f'Token refresh {name}', value)
+            for name, value in token_refresher.stats().items()]
+
+metrics.register_collector(refresh_metrics)
+
+# Sessions are indexed by OIDC sub and sid so a back-channel logout from Keycloak can revoke
+# them; revoked sessions are cleared on their next request (see session_registry.py)
+# SESSION_REGISTRY_BACKEND=memory|sqlite selects the store
+session_registry = create_session_registry(app)
+
+def session_registry_metrics():
+    """Report session registry counters on /metrics."""
+    stats = session_registry.stats()
+    samples = [('revoked_sessions', 'gauge', 'Revoked sessions not yet expired', stats.pop('revoked_sessions'))]
+    if 'sessions' in stats:
+        samples.append(('registered_sessions', 'gauge', 'Sessions held in the registry', stats.pop('sessions')))
+    for name, value in stats.items():
+        samples.append((f'session_registry_{name}_total', 'counter', f'Sessions {name}', value))
+    return samples
+
+metrics.register_collector(session_registry_metrics)
+
+@app.before_request
+def drop_revoked_session():
+    """
+    Clear the session if it was revoked by a back-channel logout or its login has expired.
+    
+    The expiry is absolute: activity doesn't extend it, so a session never
+    outlives its registration and any revocation of it.
+    """
+    registry_id = session.get('registry_id')
+    if registry_id is None:
+        return
+    if time.time() >= session.get('registry_expires_at', 0) or session_registry.is_revoked(registry_id):
+        session.clear()
+
+@app.before_request
+def refresh_session_tokens():
+    """
+    Refresh the session's access token if it is about to expire.
+    
+    Runs lazily on incoming requests; if Keycloak rejects the refresh token
+    the SSO session is gone and the local session is cleared.
+    """
+    if request.endpoint in ('oidc_login', 'oidc_callback', 'oidc_logout', 'oidc_backchannel_logout', 'metrics'):
+        return
+    if 'tokens' in session and token_refresher.refresh_session(session) == INVALID:
+        session.clear()
+
 def require_auth(f):
     """
     Decorator to enforce authentication on protected endpoints.
     
+    A backstop for enforce_policy: views that need a user keep working
+    safely if a policy edit stops covering them.
+    
+    Accepts either the session cookie or an Authorization: Bearer access token.
     Returns 401 Unauthorized if user is not authenticated.
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user' not in session:
+        if get_current_user() is None:
             return jsonify({'error': 'Authentication required'}), 401
         return f(*args, **kwargs)
     return decorated_function
 
-def check_role_hierarchy(user_roles, required_role):
+# Role hierarchy compiled once at startup into a transitive closure
+# ROLE_HIERARCHY / ROLE_HIERARCHY_FILE override the default admin > editor > viewer (see roles.py)
+role_hierarchy = load_role_hierarchy()
+# Realm and client role claims are mapped to the hierarchy's roles at login; everything else
+# (offline_access, default-roles-*, ...) is dropped (see role_mapping.py, ROLE_MAPPING_FILE)
+role_mapper = load_role_mapper(role_hierarchy, 'oidc', client_id=OIDC_CLIENT_ID)
+
+def get_role_mask():
     """
-    Check if user has required role considering role hierarchy.
+    Get the user's effective-role bitmask cached in the session.
     
-    Implements hierarchical RBAC where higher roles inherit permissions
-    of lower roles (admin > editor > viewer).
+    The mask is resolved at login; it is recomputed here only if it is
+    missing or was built from a different role hierarchy. Bearer-token
+    callers carry their mask in the verified-token cache instead.
+    
+    Returns:
+        int: Bitmask of the user's effective roles (including inherited ones)
+    """
+    bearer_user = g.get('bearer_user')
+    if bearer_user is not None:
+        return bearer_user['role_mask']
+    if session.get('role_version') != role_hierarchy.version:
+        session['role_mask'] = role_hierarchy.effective_mask(session.get('user', {}).get('roles', []))
+        session['role_version'] = role_hierarchy.version
+    return session['role_mask']
+
+def build_user_info(claims):
+    """
+    Extract user information and roles from ID or access token claims.
     
     Args:
-        user_roles: List of roles assigned to the user
-        required_role: The role required to access the resource
+        claims: Verified token claims
         
     Returns:
-        bool: True if user has required role or a higher role
+        dict: User information stored in the session
     """
-    # Define role hierarchy - higher roles inherit permissions of lower roles
-    role_hierarchy = {
-        'admin': ['editor', 'viewer'],  # Admin can do everything editor and viewer can
-        'editor': ['viewer'],            # Editor can do everything viewer can
-        'viewer': []                     # Viewer has no inherited permissions
+    return {
+        'sub': claims.get('sub'),  # Subject identifier
+        'email': claims.get('email'),
+        'preferred_username': claims.get('preferred_username'),
+        'name': claims.get('name'),
+        'roles': role_mapper.map(claims)  # Realm and client roles, mapped and de-duplicated
     }
+
+def build_bearer_user(claims):
+    """Build the cached principal for a verified bearer token, roles resolved up front."""
+    user_info = build_user_info(claims)
+    return {'user': user_info, 'role_mask': role_hierarchy.effective_mask(user_info['roles'])}
+
+# Bearer access tokens are verified locally against the cached JWKS; verified
+# tokens are remembered by hash until exp so repeat calls skip RSA verification
+bearer_verifier = BearerTokenVerifier(
+    jwks_store,
+    issuer=OIDC_ISSUER_PUBLIC,
+    client_id=OIDC_CLIENT_ID,
+    project=build_bearer_user,
+    cache_size=int(os.environ.get('BEARER_CACHE_SIZE', 1024))
+)
+
+def bearer_metrics():
+    """Report verified-token cache counters on /metrics."""
+    stats = bearer_verifier.stats()
+    samples = [('bearer_cache_entries', 'gauge', 'Verified bearer tokens cached', stats.pop('cached'))]
+    for name, value in stats.items():
+        samples.append((f'bearer_{name}_total', 'counter', f'Bearer token cache {name}', value))
+    return samples
+
+metrics.register_collector(bearer_metrics)
+
+def get_current_user():
+    """
+    Get the authenticated user for this request.
     
-    # Direct role check
-    if required_role in user_roles:
-        return True
-    
-    # Check hierarchical roles
-    for user_role in user_roles:
-        if user_role in role_hierarchy and required_role in role_hierarchy[user_role]:
-            return True
+    Uses the session if present, otherwise an Authorization: Bearer access
+    token verified locally (the result is remembered for the request).
     
-    return False
+    Returns:
+        dict: User information, or None if the request is not authenticated
+    """
+    if 'user' in session:
+        return session['user']
+    if 'bearer_user' not in g:
+        g.bearer_user = None
+        auth_header = request.headers.get('Authorization', '')
+        if auth_header.startswith('Bearer '):
+            g.bearer_user = bearer_verifier.verify(auth_header[7:].strip())
+    return g.bearer_user['user'] if g.bearer_user is not None else None
 
-def require_role(role):
+# Route-level authorization from policy.json (roles -> permissions -> route patterns),
+# compiled into a per-endpoint decision table and hot-reloaded on change (see policy.py)
+# POLICY_FILE points at another policy file
+policy_engine = create_policy_engine(app, role_hierarchy)
+policy_decisions = metrics.histogram('policy_decision_seconds', 'Authorization decision latency by outcome',
+                                     'outcome', buckets=DECISION_BUCKETS)
+
+@app.before_request
+def enforce_policy():
     """
-    Decorator factory to enforce role-based access control.
+    Authorize the request against the policy's decision table.
     
-    Creates a decorator that checks if the authenticated user has the
-    required role (or a higher role in the hierarchy) before allowing
-    access to the endpoint.
+    Covered routes require authentication (session cookie or bearer token)
+    and, unless the rule only asks for that, a role that grants the rule's
+    permission - a dict lookup and a bitwise AND. Public routes and routes
+    outside the guarded prefixes pass through; uncovered /api/ routes are
+    denied.
+    """
+    start = time.perf_counter()
+    rule = policy_engine.lookup(request.endpoint, request.method)
+    outcome = 'unguarded'
+    if rule is UNCOVERED:
+        outcome = 'uncovered'
+    elif rule is not None and rule.public:
+        outcome = 'public'
+    elif rule is not None:
+        user = get_current_user()
+        if user is None:
+            outcome = 'unauthenticated'
+        elif rule.mask is not None and not get_role_mask() & rule.mask:
+            outcome = 'deny'
+        else:
+            outcome = 'allow'
+    policy_decisions.observe(outcome, time.perf_counter() - start)
     
-    Args:
-        role: The minimum role required to access the endpoint
-        
-    Returns:
-        decorator: Function decorator that enforces the role requirement
-    """
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            # First check authentication
-            if 'user' not in session:
-                return jsonify({'error': 'Authentication required'}), 401
-            
-            user_roles = session.get('user', {}).get('roles', [])
-            
-            # Check if user has the required role (including hierarchy)
-            if not check_role_hierarchy(user_roles, role):
-                return jsonify({'error': f'Role {role} required. User has roles: {user_roles}'}), 403
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
+    if outcome == 'uncovered':
+        return jsonify({'error': 'Route is not covered by the authorization policy'}), 403
+    if outcome == 'unauthenticated':
+        return jsonify({'error': 'Authentication required'}), 401
+    if outcome == 'deny':
+        user_roles = user.get('roles', [])
+        return jsonify({'error': f'Permission {rule.permission} required. User has roles: {user_roles}'}), 403
 
+@metrics.timed('id_token_decode')
 def decode_token(token):
     """
     Decode and validate JWT token using JWKS from the OIDC provider.
     
-    Fetches the public key from the JWKS endpoint and validates the token
-    signature, expiration, audience, and issuer.
+    Looks up the public key in the process-wide JWKS cache and validates the
+    token signature, expiration, audience, and issuer.
     
     Args:
         token: JWT token string to decode
@@ -147,9 +360,8 @@ def decode_token(token):
         dict: Decoded token claims if valid, None otherwise
     """
     try:
-        # Fetch public keys from JWKS endpoint
-        jwks_client = PyJWKClient(f'{OIDC_ISSUER}/protocol/openid-connect/certs')
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        # Look up the public key in the cached JWKS (no IdP round-trip on a hit)
+        signing_key = jwks_store.get_signing_key_from_jwt(token)
         
         # Validate and decode token
         # Note: The token will have the public issuer URL, so we validate against that
@@ -167,26 +379,80 @@ def decode_token(token):
         return None
 
 
+# /api/user documents are serialized once per session version and cached process-wide;
+# responses carry an ETag so polling frontends get 304 Not Modified (see user_view.py)
+user_views = UserViewCache(max_entries=int(os.environ.get('USER_VIEW_CACHE_SIZE', 4096)))
+
+def user_view_metrics():
+    """Report user view cache counters on /metrics."""
+    stats = user_views.stats()
+    samples = [('user_view_cache_entries', 'gauge', 'Serialized user views cached', stats.pop('entries'))]
+    for name, value in stats.items():
+        samples.append((f'user_view_{name}_total', 'counter', f'User view requests ({name.replace("_", " ")})', value))
+    return samples
+
+metrics.register_collector(user_view_metrics)
+
+def build_user_view():
+    """
+    Assemble the /api/user document from the session.
+    
+    Returns:
+        dict: User information, or authenticated: false
+    """
+    if 'user' not in session:
+        return {'authenticated': False}
+    return {
+        'authenticated': True,
+        'username': session['user'].get('preferred_username', session['user'].get('email', '')),
+        'email': session['user'].get('email', ''),
+        'roles': session['user'].get('roles', []),
+        'attributes': session['user']
+    }
+
+def current_view_version():
+    """
+    Get the version of the session's user view.
+    
+    The version is fingerprinted at login; sessions created before that
+    are fingerprinted lazily on their first /api/user call.
+    
+    Returns:
+        str: View version, also the base of the ETag
+    """
+    if 'user' not in session:
+        return ANONYMOUS_VERSION
+    version = session.get('user_view_version')
+    if version is None:
+        version = session['user_view_version'] = view_version(build_user_view())
+    return version
+
 @app.route('/api/user')
 def get_user():
     """
     Get current user information from session.
     
     Returns user details if authenticated, otherwise returns
-    authenticated: false.
+    authenticated: false. ?fields=username,roles limits the response to
+    the listed fields. Repeat calls with the ETag in If-None-Match get
+    304 Not Modified until the session's user changes.
     
     Returns:
         JSON response with user information or authentication status
     """
-    if 'user' in session:
-        return jsonify({
-            'authenticated': True,
-            'username': session['user'].get('preferred_username', session['user'].get('email', '')),
-            'email': session['user'].get('email', ''),
-            'roles': session['user'].get('roles', []),
-            'attributes': session['user']
-        })
-    return jsonify({'authenticated': False})
+    fields = parse_fields(request.args.get('fields'))
+    version = current_view_version()
+    etag = etag_for(version, fields)
+    if request.if_none_match.contains(etag):
+        user_views.count_not_modified()
+        response = app.response_class(status=304)
+    else:
+        body = user_views.render(version, fields, build_user_view)
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Cached by the browser, but revalidated on every poll
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/protected')
 @require_auth
@@ -195,37 +461,42 @@ def protected_resource():
     Example protected endpoint requiring authentication.
     
     Demonstrates basic authentication requirement without
-    specific role requirements.
+    specific role requirements (see policy.json).
     """
+    user = get_current_user()
     return jsonify({
         'message': 'This is a protected resource',
-        'user': session['user'].get('preferred_username', session['user'].get('email', ''))
+        'user': user.get('preferred_username', user.get('email', ''))
     })
 
 @app.route('/api/admin')
-@require_role('admin')
+@require_auth
 def admin_resource():
     """
     Admin-only endpoint demonstrating role-based access control.
     
-    Only users with 'admin' role can access this endpoint.
+    Requires the admin:access permission, which policy.json grants
+    to the 'admin' role only.
     """
+    user = get_current_user()
     return jsonify({
         'message': 'This is an admin-only resource',
-        'user': session['user'].get('preferred_username', session['user'].get('email', ''))
+        'user': user.get('preferred_username', user.get('email', ''))
     })
 
 @app.route('/api/editor')
-@require_role('editor')
+@require_auth
 def editor_resource():
     """
     Editor endpoint demonstrating hierarchical RBAC.
     
-    Accessible by users with 'editor' role or higher (admin).
+    Requires the content:edit permission (policy.json), granted to the
+    'editor' role and so also to roles above it (admin).
     """
+    user = get_current_user()
     return jsonify({
         'message': 'This is an editor-only resource',
-        'user': session['user'].get('preferred_username', session['user'].get('email', '')),
+        'user': user.get('preferred_username', user.get('email', '')),
         'data': 'You can edit this content'
     })
 
@@ -241,6 +512,39 @@ def oidc_login():
     redirect_uri = OIDC_REDIRECT_URI
     return oidc.authorize_redirect(redirect_uri)
 
+# Under the async front end (asgi.py) the code is redeemed on the event loop; the
+# outcome reaches the callback view in the WSGI environ under these keys
+EXCHANGED_TOKEN_KEY = 'oidc.exchanged_token'
+EXCHANGE_ERROR_KEY = 'oidc.exchange_error'
+
+def exchange_authorization_code():
+    """
+    Exchange the callback's authorization code for tokens.
+    
+    Served by Gunicorn, this is Authlib's blocking exchange. Served by
+    asgi.py, the exchange already happened on the event loop; only the
+    state is consumed and the ID token's nonce checked, as Authlib does
+    after its own exchange.
+    
+    Returns:
+        dict: Token response
+    """
+    if EXCHANGED_TOKEN_KEY not in request.environ and EXCHANGE_ERROR_KEY not in request.environ:
+        with metrics.timer('token_exchange'):
+            return oidc.authorize_access_token()
+    
+    state = request.args.get('state')
+    state_data = oidc.framework.get_state_data(session, state)
+    oidc.framework.clear_state_data(session, state)
+    if EXCHANGE_ERROR_KEY in request.environ:
+        raise request.environ[EXCHANGE_ERROR_KEY]
+    if state_data is None:
+        raise MismatchingStateError()
+    token = request.environ[EXCHANGED_TOKEN_KEY]
+    if 'id_token' in token and 'nonce' in state_data:
+        token['userinfo'] = oidc.parse_id_token(token, nonce=state_data['nonce'])
+    return token
+
 @app.route('/oidc/callback')
 def oidc_callback():
     """
@@ -252,7 +556,7 @@ def oidc_callback():
     """
     try:
         # Exchange authorization code for tokens
-        token = oidc.authorize_access_token()
+        token = exchange_authorization_code()
         
         # Extract and validate ID token
         id_token = token.get('id_token')
@@ -260,28 +564,29 @@ def oidc_callback():
             # Decode and validate token claims
             claims = decode_token(id_token)
             if claims:
-                # Extract user information from token claims
-                user_info = {
-                    'sub': claims.get('sub'),  # Subject identifier
-                    'email': claims.get('email'),
-                    'preferred_username': claims.get('preferred_username'),
-                    'name': claims.get('name'),
-                    'roles': claims.get('realm_access', {}).get('roles', [])  # Realm-level roles
-                }
-                
-                # Also check for client-specific roles
-                if 'resource_access' in claims and OIDC_CLIENT_ID in claims['resource_access']:
-                    client_roles = claims['resource_access'][OIDC_CLIENT_ID].get('roles', [])
-                    user_info['roles'].extend(client_roles)
+                # Extract user information and roles from token claims
+                user_info = build_user_info(claims)
                 
+                # New session ID at login, so an ID planted before authentication is never authenticated
+                regenerate_session(session)
                 # Establish authenticated session
                 session['user'] = user_info
+                # Resolve effective permissions once at login so each policy decision is a single bitwise check
+                session['role_mask'] = role_hierarchy.effective_mask(user_info['roles'])
+                session['role_version'] = role_hierarchy.version
+                # Index the session by subject and Keycloak session ID for back-channel logout
+                session['registry_id'], session['registry_expires_at'] = session_registry.register(
+                    (f"sub:{claims.get('sub')}", f"sid:{claims['sid']}" if claims.get('sid') else None)
+                )
                 # Store tokens for logout and token refresh
                 session['tokens'] = {
                     'access_token': token.get('access_token'),
                     'id_token': id_token,
-                    'refresh_token': token.get('refresh_token')
+                    'refresh_token': token.get('refresh_token'),
+                    'expires_at': token.get('expires_at')  # Used to refresh before expiry
                 }
+                # Fingerprint the /api/user view once; polls are answered from the cache or with 304
+                session['user_view_version'] = view_version(build_user_view())
         
         return redirect('http://localhost:4001/')
     except Exception as e:
@@ -315,8 +620,117 @@ def oidc_logout():
     # Fallback: redirect to frontend if no ID token
     return redirect('http://localhost:4001/')
 
+# Event a logout token must carry (OpenID Connect Back-Channel Logout 1.0)
+BACKCHANNEL_LOGOUT_EVENT = 'http://schemas.openid.net/event/backchannel-logout'
+
+def verify_logout_token(token):
+    """
+    Validate a back-channel logout token.
+    
+    Checks the signature against the cached JWKS, issuer, audience and
+    the logout event, and that it identifies a session or a subject.
+    
+    Args:
+        token: logout_token JWT posted by the IdP
+        
+    Returns:
+        dict: Verified claims
+        
+    Raises:
+        jwt.InvalidTokenError: If the token is not a valid logout token
+    """
+    signing_key = jwks_store.get_signing_key_from_jwt(token)
+    claims = jwt.decode(
+        token,
+        signing_key.key,
+        algorithms=['RS256'],
+        audience=OIDC_CLIENT_ID,
+        issuer=OIDC_ISSUER_PUBLIC,
+        options={'require': ['iat']}
+    )
+    if BACKCHANNEL_LOGOUT_EVENT not in (claims.get('events') or {}):
+        raise jwt.InvalidTokenError('Missing back-channel logout event')
+    if 'nonce' in claims:
+        raise jwt.InvalidTokenError('Logout tokens must not contain a nonce')
+    if not claims.get('sid') and not claims.get('sub'):
+        raise jwt.InvalidTokenError('Logout token identifies no session or subject')
+    return claims
+
+@app.route('/oidc/backchannel-logout', methods=['POST'])
+def oidc_backchannel_logout():
+    """
+    Handle an OIDC back-channel logout from the IdP.
+    
+    Keycloak posts a signed logout_token when a user's SSO session ends.
+    The local sessions it names are revoked through the session registry:
+    the one Keycloak session (sid) if given, otherwise all of the user's.
+    """
+    try:
+        claims = verify_logout_token(request.form.get('logout_token', ''))
+    except Exception as e:
+        print(f"Back-channel logout rejected: {e}")
+        response = jsonify({'error': 'invalid_request', 'error_description': str(e)})
+        response.status_code = 400
+    else:
+        key = f"sid:{claims['sid']}" if claims.get('sid') else f"sub:{claims['sub']}"
+        revoked = session_registry.revoke(key)
+        print(f"Back-channel logout - revoked {revoked} session(s)")
+        response = app.response_class(status=200)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+# Startup warm-up: fetch the IdP's keys, build the OAuth client and take the first-request costs
+# before traffic arrives; wsgi.py runs it in the Gunicorn master and /ready answers 503 until it
+# has succeeded. WARMUP_RETRIES / _BACKOFF / _RETRY_INTERVAL tune retries (see warmup.py)
+warmup = create_warmup('OIDC backend')
+
+@warmup.stage('jwks', retry=True)
+def warm_jwks():
+    """Fetch the IdP's signing keys for both the JWKS cache and Authlib's ID token validation."""
+    if not jwks_store.refresh(force=True):
+        raise RuntimeError('JWKS could not be fetched')
+    # parse_id_token() keeps its own copy of the key set, fetched on the first callback otherwise
+    oidc.fetch_jwk_set(force=True)
+    return f"{jwks_store.stats()['keys']} signing keys"
+
+@warmup.stage('oauth_client')
+def warm_oauth_client():
+    """Build Authlib's OAuth client and an authorization URL without storing any state."""
+    with app.test_request_context('/oidc/login'):
+        oidc.create_authorization_url(OIDC_REDIRECT_URI)
+
+@warmup.stage('policy')
+def warm_policy():
+    """Compile the authorization policy and its decision table."""
+    return f'{len(role_hierarchy.bits)} roles, {len(policy_engine.table())} policy table entries'
+
+@warmup.stage('requests')
+def warm_requests():
+    """Serve an anonymous request to build the URL map and request-handling paths."""
+    response = app.test_client().get('/api/user')
+    if response.status_code >= 500:
+        raise RuntimeError(f'/api/user answered {response.status_code}')
+
+def warmup_metrics():
+    """Report readiness and warm-up timings on /metrics."""
+    status = warmup.status()
+    samples = [('ready', 'gauge', 'Whether the startup warm-up has completed', int(status['ready']))]
+    if warmup.import_seconds is not None:
+        samples.append(('startup_import_seconds', 'gauge', 'Time taken to import the application',
+                        warmup.import_seconds))
+    for name, stage in status['stages'].items():
+        if 'ms' in stage:
+            samples.append((f'warmup_{name}_seconds', 'gauge', f'Time taken by the {name} warm-up stage',
+                            stage['ms'] / 1000))
+    return samples
+
+metrics.register_collector(warmup_metrics)
+init_readiness(app, warmup)
+
 
 if __name__ == '__main__':
     # Run Flask development server
     # In production, use a proper WSGI server like Gunicorn
+    warmup.run()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
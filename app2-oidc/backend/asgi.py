@@ -0,0 +1,283 @@
+"""ASGI entry point for the OIDC backend (asynchronous mode)
+
+Under Gunicorn every /oidc/callback holds a worker thread for the whole
+authorization code exchange with Keycloak, so a login burst against a
+slow IdP exhausts the thread pool while the CPU sits idle. In this mode
+an ASGI server runs the backend on an event loop instead:
+
+- /oidc/callback exchanges the code for tokens on the event loop through
+  a shared httpx.AsyncClient, so one process keeps hundreds of exchanges
+  in flight; only the state lookup before and the session work after the
+  exchange run on a thread
+- every request, including the rest of the callback, is served by the
+  unchanged Flask application on a bounded thread pool, so all routes,
+  hooks, sessions and /metrics behave exactly as under Gunicorn
+
+Run with an ASGI server, e.g.:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+Requires httpx and an ASGI server (uvicorn), installed from
+requirements-asgi.txt. ASGI_THREADS sets the Flask thread pool size (default
+16) and ASYNC_IDP_POOL_SIZE the connections to Keycloak (default 100);
+IDP_POOL_ENABLED=false disables keep-alive here as well.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from authlib.integrations.base_client import MismatchingStateError, OAuthError
+from flask import request, session
+
+from wsgi import app as flask_app
+from app import (
+    oidc, metrics, idp_latency, idp_http, rate_limiter, OIDC_ISSUER, OIDC_CLIENT_ID, OIDC_CLIENT_SECRET,
+    EXCHANGED_TOKEN_KEY, EXCHANGE_ERROR_KEY
+)
+
+
+class AsyncTokenClient:
+    """Authorization code exchange over a shared, pooled httpx.AsyncClient."""
+
+    def __init__(self, token_url, client_id, client_secret, pool_size=100, timeout=(2.0, 5.0), on_latency=None,
+                 keep_alive=True):
+        """
+        Args:
+            token_url: IdP token endpoint
+            client_id: OAuth client ID
+            client_secret: OAuth client secret
+            pool_size: Maximum concurrent connections to the IdP
+            timeout: (connect, read) timeout in seconds
+            on_latency: Optional callable receiving (endpoint path, seconds) for every call
+            keep_alive: Reuse idle connections; False opens a new connection per exchange
+        """
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.pool_size = pool_size
+        self.timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.on_latency = on_latency
+        self.keep_alive = keep_alive
+        self._client = None
+
+    def _http(self):
+        # Created lazily so it binds to the server's event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size if self.keep_alive else 0)
+            )
+        return self._client
+
+    async def exchange(self, code, redirect_uri):
+        """
+        Exchange an authorization code for tokens.
+
+        Never retried - a code can only be redeemed once.
+
+        Args:
+            code: Authorization code from the callback
+            redirect_uri: Redirect URI sent with the authorization request
+
+        Returns:
+            dict: Token response, with expires_at added
+
+        Raises:
+            OAuthError: If the IdP rejects the code
+            httpx.HTTPError: On connection errors, timeouts and other HTTP failures
+        """
+        start = time.perf_counter()
+        try:
+            response = await self._http().post(
+                self.token_url,
+                data={'grant_type': 'authorization_code', 'code': code, 'redirect_uri': redirect_uri},
+                auth=(self.client_id, self.client_secret)
+            )
+        finally:
+            if self.on_latency is not None:
+                self.on_latency(urlsplit(self.token_url).path, time.perf_counter() - start)
+
+        if response.status_code in (400, 401) and 'json' in response.headers.get('content-type', ''):
+            error = response.json()
+            raise OAuthError(error=error.get('error'), description=error.get('error_description'))
+        response.raise_for_status()
+        token = response.json()
+        if 'expires_in' in token and 'expires_at' not in token:
+            token['expires_at'] = int(time.time()) + int(token['expires_in'])
+        return token
+
+    async def aclose(self):
+        """Close the pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def build_environ(scope, body):
+    """
+    Build a WSGI environ for an ASGI HTTP request.
+
+    Args:
+        scope: ASGI HTTP connection scope
+        body: Complete request body
+
+    Returns:
+        dict: PEP 3333 environ
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+            continue
+        key = 'HTTP_' + name
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+class AsyncOIDCApp:
+    """ASGI application serving the Flask backend with asynchronous code exchanges."""
+
+    def __init__(self, wsgi_app, token_client, threads=16):
+        """
+        Args:
+            wsgi_app: The Flask application
+            token_client: AsyncTokenClient used by /oidc/callback
+            threads: Threads running Flask request handling
+        """
+        self.wsgi_app = wsgi_app
+        self.token_client = token_client
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='flask')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = build_environ(scope, bytes(body))
+
+        if scope['path'] == '/oidc/callback' and scope['method'] == 'GET':
+            # A throttled callback must not reach Keycloak; Flask answers it with the same 429
+            if rate_limiter is None or rate_limiter.check(environ) is None:
+                await self._exchange_code(environ)
+
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(self.executor, self._call_wsgi, environ)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': chunks})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.token_client.aclose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _exchange_code(self, environ):
+        """
+        Redeem the callback's authorization code on the event loop.
+
+        The outcome is handed to the Flask callback in the environ (see
+        exchange_authorization_code in app.py), which then consumes the
+        state and checks the ID token's nonce itself.
+        """
+        query = parse_qs(environ['QUERY_STRING'])
+        if 'error' in query:
+            environ[EXCHANGE_ERROR_KEY] = OAuthError(
+                error=query['error'][0], description=query.get('error_description', [None])[0]
+            )
+            return
+
+        # Only redeem codes for a state this browser's session is waiting for
+        loop = asyncio.get_running_loop()
+        state_data = await loop.run_in_executor(self.executor, self._state_data, environ)
+        if state_data is None:
+            environ[EXCHANGE_ERROR_KEY] = MismatchingStateError()
+            return
+
+        start = time.perf_counter()
+        try:
+            environ[EXCHANGED_TOKEN_KEY] = await self.token_client.exchange(
+                query.get('code', [''])[0], state_data.get('redirect_uri')
+            )
+        except Exception as e:
+            environ[EXCHANGE_ERROR_KEY] = e
+        finally:
+            metrics.observe('token_exchange', time.perf_counter() - start)
+
+    def _state_data(self, environ):
+        """Look up the authorization request's state data in the session (read-only)."""
+        with self.wsgi_app.request_context(dict(environ)):
+            return oidc.framework.get_state_data(session, request.args.get('state'))
+
+    def _call_wsgi(self, environ):
+        """Run one request through the Flask application; returns (status, headers, body)."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            body = b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return response['status'], response['headers'], body
+
+
+token_client = AsyncTokenClient(
+    f'{OIDC_ISSUER}/protocol/openid-connect/token',
+    OIDC_CLIENT_ID,
+    OIDC_CLIENT_SECRET,
+    pool_size=int(os.environ.get('ASYNC_IDP_POOL_SIZE', 100)),
+    timeout=idp_http.timeout,
+    on_latency=idp_latency.observe,
+    keep_alive=idp_http.keep_alive
+)
+
+app = AsyncOIDCApp(flask_app, token_client, threads=int(os.environ.get('ASGI_THREADS', 16)))
@@ -0,0 +1,130 @@
+"""Local verification of bearer access tokens for the OIDC backend
+
+Lets API clients call the backend with an ``Authorization: Bearer``
+access token instead of the session cookie. Tokens are verified locally
+against the cached JWKS, with no round-trip to Keycloak. Only access
+tokens (typ "Bearer") are accepted, never ID tokens. Successfully
+verified tokens are kept in a small LRU keyed by the token's SHA-256 hash
+until their ``exp``, so repeat calls with the same token skip the RSA
+signature check entirely.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+
+class BearerTokenVerifier:
+    """
+    Verifies RS256 access tokens and caches the result per token.
+
+    The cached value is whatever the project callable builds from the
+    claims (e.g. a user dict with a precomputed role mask), so repeat
+    calls skip both signature verification and claim processing.
+    """
+
+    def __init__(self, key_store, issuer, client_id, project=None, cache_size=1024, leeway=0):
+        """
+        Args:
+            key_store: JWKSKeyStore providing the signing keys
+            issuer: Expected iss claim
+            client_id: This client's ID; must be the token's azp or in its aud
+            project: Optional callable turning verified claims into the cached value
+            cache_size: Maximum number of verified tokens kept
+            leeway: Clock skew tolerance in seconds for exp/nbf/iat
+        """
+        self.key_store = key_store
+        self.issuer = issuer
+        self.client_id = client_id
+        self.project = project or (lambda claims: claims)
+        self.cache_size = cache_size
+        self.leeway = leeway
+        self._cache = OrderedDict()  # sha256(token) -> (exp, value)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'rejected': 0}
+
+    def _cache_get(self, digest):
+        with self._lock:
+            entry = self._cache.get(digest)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            exp, value = entry
+            if exp <= time.time():
+                del self._cache[digest]
+                self._stats['misses'] += 1
+                return None
+            self._cache.move_to_end(digest)
+            self._stats['hits'] += 1
+            return value
+
+    def _cache_put(self, digest, exp, value):
+        with self._lock:
+            self._cache[digest] = (exp, value)
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _reject(self, reason):
+        with self._lock:
+            self._stats['rejected'] += 1
+        print(f"Bearer token rejected: {reason}")
+        return None
+
+    def verify(self, token):
+        """
+        Verify an access token, using the cache for tokens seen before.
+
+        Args:
+            token: Encoded JWT access token
+
+        Returns:
+            The projected value for a valid token, None otherwise
+        """
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        value = self._cache_get(digest)
+        if value is not None:
+            return value
+
+        try:
+            signing_key = self.key_store.get_signing_key_from_jwt(token)
+            # Keycloak access tokens carry aud=account; the client is checked via azp/aud below
+            claims = jwt.decode(
+                token,
+                signing_key.key,
+                algorithms=['RS256'],
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={'verify_aud': False, 'require': ['exp', 'iss']}
+            )
+        except Exception as e:
+            return self._reject(e)
+
+        # ID tokens are signed by the same keys and carry aud=client_id; only access tokens are accepted
+        if claims.get('typ') != 'Bearer':
+            return self._reject(f"token type {claims.get('typ')!r} is not an access token")
+
+        audience = claims.get('aud', [])
+        if isinstance(audience, str):
+            audience = [audience]
+        if claims.get('azp') != self.client_id and self.client_id not in audience:
+            return self._reject(f"token was not issued for {self.client_id}")
+
+        value = self.project(claims)
+        self._cache_put(digest, claims['exp'], value)
+        return value
+
+    def stats(self):
+        """
+        Return a snapshot of the cache counters.
+
+        Returns:
+            dict: hits, misses, rejected and the number of cached tokens
+        """
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['cached'] = len(self._cache)
+        return snapshot
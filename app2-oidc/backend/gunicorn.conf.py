@@ -0,0 +1,53 @@
+"""Gunicorn configuration for the OIDC backend
+
+Production serving mode: several worker processes, each with a pool of
+threads, instead of Flask's single-process development server. All
+settings can be overridden through environment variables:
+
+    GUNICORN_BIND          - listen address (default 0.0.0.0:5000)
+    GUNICORN_WORKERS       - worker processes (default 2 x CPUs + 1)
+    GUNICORN_THREADS       - threads per worker (default 4)
+    GUNICORN_WORKER_CLASS  - gthread (default), sync, or gevent (requires
+                             the gevent package) for IdP-bound workloads
+    GUNICORN_TIMEOUT       - worker timeout in seconds (default 30)
+    GUNICORN_RELOAD        - 'true' to reload on code changes (development)
+
+With several workers, sessions, the session registry and the login rate
+limits must live in a store all workers share: use SESSION_BACKEND=sqlite
+(or cookie), SESSION_REGISTRY_BACKEND=sqlite and RATE_LIMIT_BACKEND=sqlite.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))  # gevent only
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+reload = os.environ.get('GUNICORN_RELOAD', 'false').lower() == 'true'
+
+# Fetch the JWKS and build the role closure once in the master, then fork
+# (not combinable with code reloading)
+preload_app = not reload
+
+
+def on_starting(server):
+    if workers > 1 and os.environ.get('SESSION_BACKEND', 'memory') == 'memory':
+        print("WARNING: SESSION_BACKEND=memory is per process; "
+              "use SESSION_BACKEND=sqlite with more than one worker")
+    if workers > 1 and os.environ.get('SESSION_REGISTRY_BACKEND', 'memory') == 'memory':
+        print("WARNING: SESSION_REGISTRY_BACKEND=memory is per process; a back-channel logout "
+              "only revokes sessions in the worker receiving it - use SESSION_REGISTRY_BACKEND=sqlite")
+    if (workers > 1 and os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+            and os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'memory'):
+        print("WARNING: RATE_LIMIT_BACKEND=memory is per process; each worker grants the full "
+              "login rate - use RATE_LIMIT_BACKEND=sqlite with more than one worker")
+
+
+def post_fork(server, worker):
+    # Pooled IdP connections opened during preload must not be shared across processes
+    from wsgi import reset_after_fork
+    reset_after_fork()
@@ -0,0 +1,141 @@
+"""Pooled HTTP client for backend-to-IdP traffic
+
+All calls from the OIDC backend to Keycloak (token exchange, JWKS fetch,
+token refresh) share one keep-alive connection pool with bounded size,
+connect/read timeouts, retries with jittered exponential backoff and
+per-endpoint latency reporting.
+
+Authlib creates a new requests session for every token exchange; mounting
+the shared adapter on those sessions (through the ``compliance_fix`` hook)
+makes them reuse the pooled connections as well.
+
+With keep_alive=False every call opens a new connection (``Connection:
+close``) while timeouts, retries and latency reporting stay the same, so
+the effect of the pool can be measured (loadtest/callback_bench.py --pool).
+"""
+
+import random
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class JitterRetry(Retry):
+    """urllib3 Retry whose exponential backoff is spread with random jitter."""
+
+    def __init__(self, *args, jitter=0.1, **kwargs):
+        self.jitter = jitter
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, self.jitter)
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with a default timeout, latency reporting and a shared pool.
+
+    close() is a no-op because Authlib closes its per-call sessions, which
+    would otherwise tear down the shared pool; use shutdown() instead.
+    """
+
+    def __init__(self, timeout, on_latency=None, keep_alive=True, **kwargs):
+        self.timeout = timeout
+        self.on_latency = on_latency
+        self.keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        if not self.keep_alive:
+            request.headers['Connection'] = 'close'
+        start = time.perf_counter()
+        try:
+            return super().send(request, timeout=timeout, **kwargs)
+        finally:
+            if self.on_latency is not None:
+                self.on_latency(urlsplit(request.url).path, time.perf_counter() - start)
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        """Close all pooled connections."""
+        super().close()
+
+
+class IdPHTTPClient:
+    """Shared connection pool and session for all calls to the IdP."""
+
+    def __init__(self, pool_size=10, connect_timeout=2.0, read_timeout=5.0, retries=2,
+                 backoff_factor=0.2, jitter=0.1, keep_alive=True):
+        """
+        Args:
+            pool_size: Maximum pooled connections per IdP host
+            connect_timeout: Seconds to wait for a TCP connection
+            read_timeout: Seconds to wait for the IdP's response
+            retries: Retries for connection errors (any method) and for
+                read errors / 502-504 responses on idempotent requests
+            backoff_factor: Base of the exponential backoff between retries
+            jitter: Maximum random seconds added to each backoff
+            keep_alive: Reuse pooled connections; False opens a new connection per call
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self._latency_callbacks = []
+        retry = JitterRetry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'HEAD'}),  # Never replay token exchanges
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+            jitter=jitter
+        )
+        self.adapter = PooledAdapter(
+            self.timeout,
+            on_latency=self._record,
+            keep_alive=keep_alive,
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=retry
+        )
+        self.session = self.mount(requests.Session())
+
+    def _record(self, endpoint, seconds):
+        for callback in self._latency_callbacks:
+            callback(endpoint, seconds)
+
+    def on_latency(self, callback):
+        """Register a callable receiving (endpoint path, seconds) for every IdP call."""
+        self._latency_callbacks.append(callback)
+
+    def mount(self, session):
+        """
+        Route a requests session through the shared pool.
+
+        Also usable as Authlib's compliance_fix hook.
+
+        Args:
+            session: requests.Session (or Authlib OAuth2Session)
+
+        Returns:
+            The same session
+        """
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
@@ -0,0 +1,244 @@
+"""Hot-path instrumentation for the SSO backends
+
+Low-overhead timers around the expensive stages of a login (IdP token
+exchange, ID token validation, SAML response/SLO processing, session
+save). Durations are aggregated in-process into fixed-bucket histograms
+and exposed on /metrics in the Prometheus text format. Optionally, the
+stages timed during a request are reported back in a Server-Timing
+header.
+
+Metrics are per process: with several workers, each one reports its own
+values and Prometheus aggregates them.
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, g, has_request_context, request
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed durations."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+
+class HistogramFamily:
+    """Set of histograms sharing a metric name, one per label value."""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        histogram = self._histograms.get(label_value)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(label_value, Histogram(self.buckets))
+        histogram.observe(seconds)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_value, histogram in sorted(self._histograms.items()):
+            counts, total, count = histogram.snapshot()
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+class Metrics:
+    """
+    In-process metrics registry.
+
+    Histograms are recorded through timer()/timed()/observe(); other
+    components (caches, queues) report their counters through collectors
+    that are only called when /metrics is scraped.
+    """
+
+    def __init__(self, prefix, server_timing=False):
+        """
+        Args:
+            prefix: Prefix for all metric names, e.g. 'saml_backend'
+            server_timing: Report stage timings in a Server-Timing header
+        """
+        self.prefix = prefix
+        self.server_timing = server_timing
+        self._families = {}
+        self._collectors = []
+        self.stages = self.histogram('stage_duration_seconds',
+                                     'Duration of instrumented hot-path stages', 'stage')
+        self.requests = self.histogram('request_duration_seconds',
+                                       'Duration of HTTP requests by endpoint', 'endpoint')
+
+    def histogram(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        """
+        Return the histogram family with this name, creating it if needed.
+
+        Args:
+            name: Metric name without prefix
+            help_text: HELP text for the metric
+            label: Name of the label distinguishing the histograms
+
+        Returns:
+            HistogramFamily: The histogram family
+        """
+        full_name = f'{self.prefix}_{name}'
+        family = self._families.get(full_name)
+        if family is None:
+            family = self._families.setdefault(full_name, HistogramFamily(full_name, help_text, label, buckets))
+        return family
+
+    def register_collector(self, collector):
+        """
+        Register a callable reporting extra samples at scrape time.
+
+        Args:
+            collector: Callable returning an iterable of
+                (name, type, help, value) tuples; names are prefixed
+                automatically and type is 'counter' or 'gauge'
+        """
+        self._collectors.append(collector)
+
+    def observe(self, stage, seconds):
+        """Record the duration of a stage (and add it to Server-Timing if enabled)."""
+        self.stages.observe(stage, seconds)
+        if self.server_timing and has_request_context():
+            g.setdefault('_server_timings', []).append((stage, seconds))
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager timing the enclosed block as the given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """Decorator timing every call of the decorated function as the given stage."""
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(stage, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: Metrics document
+        """
+        lines = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, metric_type, help_text, value in samples:
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# HELP {full_name} {help_text}')
+                lines.append(f'# TYPE {full_name} {metric_type}')
+                lines.append(f'{full_name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def init_instrumentation(app, metrics):
+    """
+    Attach request timing, session-save timing and the /metrics endpoint.
+
+    Must be called after the session interface has been configured, since
+    the interface's save_session is wrapped with a timer.
+
+    Args:
+        app: Flask application
+        metrics: Metrics registry to record into
+    """
+    interface = app.session_interface
+    save_session = interface.save_session
+
+    def timed_save_session(app, session, response):
+        with metrics.timer('session_save'):
+            return save_session(app, session, response)
+
+    interface.save_session = timed_save_session
+
+    @app.before_request
+    def start_request_timer():
+        g._request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_timing(response):
+        start = g.pop('_request_start', None)
+        if start is not None:
+            metrics.requests.observe(request.endpoint or 'unmatched', time.perf_counter() - start)
+        timings = g.pop('_server_timings', None)
+        if timings:
+            # Session save runs after this hook, so it only shows up in /metrics
+            response.headers['Server-Timing'] = ', '.join(
+                f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in timings
+            )
+        return response
+
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+
+
+def create_metrics(prefix):
+    """
+    Build the metrics registry from the environment.
+
+    SERVER_TIMING_ENABLED=true adds a Server-Timing header to responses.
+
+    Args:
+        prefix: Prefix for all metric names
+
+    Returns:
+        Metrics: Metrics registry
+    """
+    return Metrics(prefix, server_timing=os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true')
@@ -0,0 +1,170 @@
+"""Process-wide JWKS key store for the OIDC backend
+
+Caches the signing keys published on the IdP's JWKS endpoint so ID token
+validation does not need an HTTP round-trip to Keycloak on every call.
+Keys are indexed by ``kid`` and refreshed when the TTL expires or when a
+token arrives signed with a key we have not seen yet (key rotation).
+"""
+
+import threading
+import time
+
+import jwt
+import requests
+from jwt import PyJWKSet
+from jwt.exceptions import PyJWKClientError
+
+
+class JWKSKeyStore:
+    """
+    Thread-safe, TTL-based cache of the IdP's JSON Web Key Set.
+
+    Refreshes are single-flight: when several threads miss at the same time
+    only one of them fetches the key set while the others wait and reuse the
+    result. If the IdP is unreachable the last known keys keep being served
+    until a refresh succeeds.
+    """
+
+    def __init__(self, jwks_uri, ttl=300, min_refresh_interval=10, timeout=5, fetch=None, http=None):
+        """
+        Args:
+            jwks_uri: URL of the IdP's JWKS endpoint
+            ttl: Seconds before the cached key set is considered stale
+            min_refresh_interval: Minimum seconds between two fetches, so
+                tokens with unknown or bogus kids cannot hammer the IdP
+            timeout: Timeout in seconds for the JWKS HTTP request
+            fetch: Optional callable returning the JWKS document as a dict
+                (defaults to an HTTP GET on jwks_uri)
+            http: requests.Session used for the default fetch (connection pooling)
+        """
+        self.jwks_uri = jwks_uri
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._fetch = fetch or self._http_fetch
+        self.http = http or requests.Session()
+
+        self._keys = {}  # kid -> PyJWK
+        self._expires_at = 0.0
+        self._last_attempt = 0.0
+        self._generation = 0
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_failures': 0,
+            'stale_served': 0
+        }
+
+    def _http_fetch(self):
+        """Fetch the JWKS document from the IdP."""
+        response = self.http.get(self.jwks_uri, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def refresh(self, force=False, blocking=True):
+        """
+        Refresh the cached key set from the IdP.
+
+        Only one thread performs the fetch; concurrent callers block until
+        it finishes and then return without fetching again.
+
+        Args:
+            force: Ignore min_refresh_interval (used on startup)
+            blocking: Wait for an in-flight refresh instead of returning
+                immediately (non-blocking callers keep using the cached keys)
+
+        Returns:
+            bool: True if the key set was (re)loaded by this or a concurrent call
+        """
+        seen_generation = self._generation
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return False
+        try:
+            if self._generation != seen_generation:
+                # Another thread refreshed while we were waiting for the lock
+                return True
+
+            now = time.monotonic()
+            if not force and now - self._last_attempt < self.min_refresh_interval:
+                return False
+            self._last_attempt = now
+
+            try:
+                jwk_set = PyJWKSet.from_dict(self._fetch())
+            except Exception as e:
+                # Keep serving the last known keys while the IdP is unreachable
+                self._count('refresh_failures')
+                print(f"JWKS refresh error: {e}")
+                return False
+
+            self._keys = {key.key_id: key for key in jwk_set.keys}
+            self._expires_at = now + self.ttl
+            self._generation += 1
+            self._count('refreshes')
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def get_signing_key(self, kid):
+        """
+        Return the signing key for the given key ID.
+
+        Args:
+            kid: Key ID from the JWT header
+
+        Returns:
+            PyJWK: Signing key matching the kid
+
+        Raises:
+            PyJWKClientError: If no key with this kid is known to the IdP
+        """
+        if time.monotonic() >= self._expires_at:
+            # With keys in hand, don't queue behind a slow refresh - serve stale
+            if not self.refresh(blocking=not self._keys) and self._keys:
+                self._count('stale_served')
+
+        key = self._keys.get(kid)
+        if key is not None:
+            self._count('hits')
+            return key
+
+        # Unknown kid - the IdP may have rotated its keys
+        self._count('misses')
+        self.refresh()
+        key = self._keys.get(kid)
+        if key is None:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+    def get_signing_key_from_jwt(self, token):
+        """
+        Return the signing key for a JWT, based on the kid in its header.
+
+        Args:
+            token: Encoded JWT string
+
+        Returns:
+            PyJWK: Signing key for the token
+        """
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get('kid'))
+
+    def stats(self):
+        """
+        Return a snapshot of the cache counters.
+
+        Returns:
+            dict: hits, misses, refreshes, refresh_failures, stale_served and
+                the number of cached keys
+        """
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['keys'] = len(self._keys)
+        return snapshot
@@ -0,0 +1,246 @@
+"""Declarative authorization policy for the SSO backends
+
+policy.json maps roles to permissions and route patterns to the
+permission they require:
+
+    {
+        "permissions": {"editor": ["content:edit"], ...},
+        "routes": [
+            {"pattern": "/api/editor", "permission": "content:edit"},
+            {"pattern": "/api/reports/*", "methods": ["POST"], "permission": "reports:write"},
+            {"pattern": "/api/protected", "permission": null},
+            {"pattern": "/api/user", "public": true}
+        ]
+    }
+
+Permissions are inherited along the role hierarchy (see roles.py): a role
+granting a permission also grants it to every role above it. A null
+permission only requires authentication and "public": true not even
+that. Routes under a guarded prefix (/api/ by default) that match no
+pattern are denied, so a new endpoint, or a policy edit that drops a
+route, fails closed; other routes are left to the endpoint itself.
+
+The policy is compiled into a decision table indexed by Flask endpoint
+and method, each entry holding the bitmask of roles that grant the
+required permission, so a decision is one dict lookup and one bitwise AND
+against the user's cached role mask - independent of the number of
+routes, patterns and roles. The file is polled for changes and hot-reloaded.
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from fnmatch import fnmatchcase
+
+# Histogram buckets for decision latency - decisions take microseconds
+DECISION_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+
+# Requirement of one route: permission None means authentication only, public no authentication
+PolicyRule = namedtuple('PolicyRule', ['permission', 'mask', 'public'], defaults=(False,))
+
+# Requirement of guarded routes the policy doesn't cover: no role grants it
+UNCOVERED = PolicyRule(None, 0)
+
+
+class CompiledPolicy:
+    """A parsed and validated policy document."""
+
+    def __init__(self, document, role_hierarchy):
+        """
+        Args:
+            document: Parsed policy.json
+            role_hierarchy: RoleHierarchy whose bits the masks are built from
+
+        Raises:
+            ValueError: If the policy names undefined roles or permissions
+        """
+        self.permission_masks = {}
+        for role, permissions in document.get('permissions', {}).items():
+            bit = role_hierarchy.bit(role)
+            for permission in permissions:
+                self.permission_masks[permission] = self.permission_masks.get(permission, 0) | bit
+
+        self.routes = []  # (pattern, methods or None, PolicyRule), first match wins
+        for entry in document.get('routes', []):
+            permission = entry.get('permission')
+            public = bool(entry.get('public', False))
+            if public and permission is not None:
+                raise ValueError(f"Route {entry['pattern']} cannot be public and require {permission}")
+            if permission is not None and permission not in self.permission_masks:
+                raise ValueError(f'Permission {permission} is not granted to any role')
+            methods = entry.get('methods')
+            self.routes.append((
+                entry['pattern'],
+                frozenset(m.upper() for m in methods) if methods else None,
+                PolicyRule(permission, self.permission_masks.get(permission), public)
+            ))
+
+    def rule_for(self, route, method):
+        """
+        Find the requirement for a route.
+
+        Args:
+            route: Flask URL rule string, e.g. '/api/admin'
+            method: HTTP method
+
+        Returns:
+            PolicyRule: First matching rule, or None if the route is not covered
+        """
+        for pattern, methods, rule in self.routes:
+            if (methods is None or method in methods) and fnmatchcase(route, pattern):
+                return rule
+        return None
+
+    def decision_table(self, url_map, guarded_prefixes=()):
+        """
+        Resolve the policy against every registered route.
+
+        Args:
+            url_map: Flask application's url_map
+            guarded_prefixes: Route prefixes whose uncovered routes get UNCOVERED
+
+        Returns:
+            dict: (endpoint, method) -> PolicyRule for every covered or guarded route
+        """
+        table = {}
+        for url_rule in url_map.iter_rules():
+            methods = url_rule.methods
+            if url_rule.provide_automatic_options:
+                # Flask answers CORS preflights itself - they carry no credentials
+                methods = methods - {'OPTIONS'}
+            for method in methods:
+                rule = self.rule_for(url_rule.rule, method)
+                if rule is None and url_rule.rule.startswith(guarded_prefixes):
+                    rule = UNCOVERED
+                if rule is not None:
+                    table[(url_rule.endpoint, method)] = rule
+        return table
+
+
+class PolicyEngine:
+    """
+    Holds the compiled policy and its decision table, reloading on change.
+
+    Like the SAML settings cache, a reload builds a new table and swaps it
+    in; a policy file that fails to parse or validate keeps the previous one.
+    """
+
+    def __init__(self, path, role_hierarchy, url_map, check_interval=1.0, guarded_prefixes=('/api/',)):
+        """
+        Args:
+            path: Policy JSON file
+            role_hierarchy: RoleHierarchy used to build permission masks
+            url_map: Flask url_map the decision table is indexed by
+            check_interval: Minimum seconds between two mtime checks
+            guarded_prefixes: Route prefixes denied unless the policy covers them
+        """
+        self.path = path
+        self.role_hierarchy = role_hierarchy
+        self.url_map = url_map
+        self.guarded_prefixes = tuple(guarded_prefixes)
+        self.check_interval = check_interval
+        self._policy = None
+        self._table = None
+        self._table_rules = None  # route count the table was built for
+        self._mtime = None
+        self._version = 0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _reload(self, mtime):
+        """Parse and compile the policy file, keeping the old policy on error."""
+        try:
+            with open(self.path) as f:
+                policy = CompiledPolicy(json.load(f), self.role_hierarchy)
+        except Exception as e:
+            if self._policy is None:
+                raise
+            print(f"Policy reload error, keeping previous policy: {e}")
+            self._mtime = mtime
+            return
+        self._policy = policy
+        self._table = None
+        self._mtime = mtime
+        self._version += 1
+        print(f"Authorization policy loaded (version {self._version}, {len(policy.routes)} routes)")
+
+    def table(self):
+        """
+        Return the decision table, reloading the policy and rebuilding the table if needed.
+
+        Returns:
+            dict: (endpoint, method) -> PolicyRule
+        """
+        now = time.monotonic()
+        table = self._table
+        if table is not None and now < self._next_check:
+            return table
+
+        with self._lock:
+            if self._policy is None or now >= self._next_check:
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                except OSError:
+                    if self._policy is None:
+                        raise
+                    mtime = self._mtime  # File briefly missing (e.g. being replaced)
+                if mtime != self._mtime:
+                    self._reload(mtime)
+                self._next_check = now + self.check_interval
+                # Routes registered after the last build (e.g. /metrics) need a rebuild too
+                rule_count = sum(1 for _ in self.url_map.iter_rules())
+                if rule_count != self._table_rules:
+                    self._table = None
+                    self._table_rules = rule_count
+            if self._table is None:
+                self._table = self._policy.decision_table(self.url_map, self.guarded_prefixes)
+            return self._table
+
+    def lookup(self, endpoint, method):
+        """
+        Return the requirement for a request.
+
+        Args:
+            endpoint: Flask endpoint name of the matched route
+            method: HTTP method
+
+        Returns:
+            PolicyRule: The route's requirement, UNCOVERED for uncovered guarded
+                routes, or None for other routes the policy doesn't cover
+        """
+        return self.table().get((endpoint, method))
+
+    @property
+    def version(self):
+        """Counter incremented every time a new policy is loaded."""
+        return self._version
+
+
+def create_policy_engine(app, role_hierarchy):
+    """
+    Create the policy engine from the environment.
+
+    POLICY_FILE points at the policy (default: policy.json next to this
+    module); POLICY_CHECK_INTERVAL sets the reload poll interval and
+    POLICY_GUARDED_PREFIXES the comma-separated route prefixes that are
+    denied unless covered (default /api/).
+
+    Args:
+        app: Flask application whose routes the policy covers
+        role_hierarchy: Compiled role hierarchy
+
+    Returns:
+        PolicyEngine: Engine (the policy is loaded on first use)
+    """
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'policy.json')
+    return PolicyEngine(
+        os.environ.get('POLICY_FILE', default_path),
+        role_hierarchy,
+        app.url_map,
+        check_interval=float(os.environ.get('POLICY_CHECK_INTERVAL', 1.0)),
+        guarded_prefixes=[p.strip() for p in os.environ.get('POLICY_GUARDED_PREFIXES', '/api/').split(',') if p.strip()]
+    )
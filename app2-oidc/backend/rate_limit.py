@@ -0,0 +1,420 @@
+"""Rate limiting for the login endpoints of the SSO backends
+
+Every request to /saml/login, /oidc/login or a callback turns into work
+for Keycloak (and its database), so a retry loop in a browser or a bot
+is throttled before it reaches the application. Requests to those paths
+take a token from two token buckets:
+
+- one per client IP: the peer address, or, when the peer is one of the
+  configured trusted reverse proxies (nginx), the X-Forwarded-For entry
+  that proxy appended. X-Forwarded-For is ignored by default, since the
+  backends are also reachable directly and clients can send any value
+- one per session, keyed by a hash of the session cookie, so a single
+  browser stuck in a loop is stopped well before its whole network is.
+  Callbacks take the IP bucket only: they come from a browser that is not
+  logged in yet, and a client could send a new cookie with each one to
+  get a fresh bucket
+
+A bucket holds up to `burst` tokens and refills at `rate` tokens per
+second. A request finding an empty bucket is answered 429 with
+Retry-After directly in the WSGI layer, before Flask opens the session.
+
+A bucket that has refilled completely behaves exactly like one that was
+never created, so it can be forgotten. Two stores are provided:
+
+- MemoryRateLimitStore: in-process; buckets are filed on a time wheel by
+  the time they will be full again and dropped slot by slot, and at most
+  max_entries are held (single process only)
+- SQLiteRateLimitStore: file-backed, shared by all worker processes on
+  the same host (see replay_cache.py for the same split)
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import hashlib
+import ipaddress
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from werkzeug.http import parse_cookie
+
+# Environ key holding a request's check() result, so a request only takes its tokens once
+RESULT_KEY = 'rate_limit.result'
+
+
+class MemoryRateLimitStore:
+    """
+    In-process token buckets with time-wheel eviction.
+
+    The wheel has one slot per `tick` seconds, enough to cover the longest
+    refill time. Each bucket sits in the slot of the tick it will be full
+    again in; once the clock has passed a slot, every bucket in it is
+    full and the slot is cleared.
+    """
+
+    def __init__(self, horizon, max_entries=100000, tick=1.0):
+        """
+        Args:
+            horizon: Longest time in seconds a bucket needs to refill (burst / rate)
+            max_entries: Maximum number of buckets held at once
+            tick: Width of a wheel slot in seconds
+        """
+        self.max_entries = max_entries
+        self.tick = tick
+        self._wheel = [set() for _ in range(int(math.ceil(horizon / tick)) + 2)]
+        self._buckets = {}   # key -> [tokens, updated, tick it is full again]
+        self._cursor = None  # tick of the last sweep
+        self._lock = threading.Lock()
+        self._stats = {'evicted': 0}
+
+    def _sweep(self, current):
+        """Clear the slots of every tick before the current one."""
+        if self._cursor is None or current - self._cursor >= len(self._wheel):
+            if self._cursor is not None:
+                for slot in self._wheel:
+                    slot.clear()
+                self._buckets.clear()
+            self._cursor = current
+            return
+        while self._cursor < current:
+            slot = self._wheel[self._cursor % len(self._wheel)]
+            for key in slot:
+                del self._buckets[key]
+            slot.clear()
+            self._cursor += 1
+
+    def _evict(self):
+        """Drop the buckets closest to full until within max_entries."""
+        for offset in range(len(self._wheel)):
+            slot = self._wheel[(self._cursor + offset) % len(self._wheel)]
+            while slot and len(self._buckets) > self.max_entries:
+                del self._buckets[slot.pop()]
+                self._stats['evicted'] += 1
+            if len(self._buckets) <= self.max_entries:
+                return
+
+    def take(self, key, rate, burst):
+        """
+        Take one token from a bucket.
+
+        Args:
+            key: Bucket key
+            rate: Refill rate in tokens per second
+            burst: Bucket capacity
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        now = time.time()
+        current = int(now // self.tick)
+        with self._lock:
+            self._sweep(current)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+
+            tokens -= 1
+            full_at = min(int((now + (burst - tokens) / rate) // self.tick), current + len(self._wheel) - 1)
+            if bucket is None:
+                bucket = self._buckets[key] = [tokens, now, full_at]
+                self._wheel[full_at % len(self._wheel)].add(key)
+                if len(self._buckets) > self.max_entries:
+                    self._evict()
+            else:
+                if bucket[2] != full_at:
+                    self._wheel[bucket[2] % len(self._wheel)].discard(key)
+                    self._wheel[full_at % len(self._wheel)].add(key)
+                bucket[:] = tokens, now, full_at
+            return 0
+
+    def stats(self):
+        """
+        Return a snapshot of the store counters.
+
+        Returns:
+            dict: evicted and size
+        """
+        with self._lock:
+            return dict(self._stats, size=len(self._buckets))
+
+
+class SQLiteRateLimitStore:
+    """
+    SQLite-backed token buckets shared by all processes using the file.
+
+    A token is taken with a single upsert that only changes the row if the
+    refilled bucket holds a token, so concurrent workers cannot overdraw a
+    bucket. Rows carry the time they are full again (indexed), and full
+    buckets are deleted with one range delete whenever this process sees
+    the tick change.
+    """
+
+    def __init__(self, path, max_entries=100000, tick=1.0):
+        """
+        Args:
+            path: SQLite database file
+            max_entries: Maximum number of rows kept after each purge
+            tick: Seconds between purges
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.tick = tick
+        self._local = threading.local()
+        self._swept = None
+        self._lock = threading.Lock()
+        self._stats = {'evicted': 0}
+        # Use a throwaway connection so none is inherited by forked workers
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS rate_buckets '
+                    '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS rate_buckets_full_at ON rate_buckets (full_at)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """Return this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, conn, now):
+        """Delete full buckets and trim the table to max_entries, once per tick."""
+        current = int(now // self.tick)
+        with self._lock:
+            if current == self._swept:
+                return
+            self._swept = current
+        conn.execute('DELETE FROM rate_buckets WHERE full_at <= ?', (now,))
+        excess = conn.execute('SELECT COUNT(*) FROM rate_buckets').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM rate_buckets WHERE key IN '
+                '(SELECT key FROM rate_buckets ORDER BY full_at LIMIT ?)', (excess,)
+            )
+            with self._lock:
+                self._stats['evicted'] += excess
+
+    def take(self, key, rate, burst):
+        """
+        Take one token from a bucket.
+
+        Args:
+            key: Bucket key
+            rate: Refill rate in tokens per second
+            burst: Bucket capacity
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        now = time.time()
+        with self._connect() as conn:
+            self._sweep(conn, now)
+            # Refilled level of the stored bucket; the row is only updated if it holds a token
+            level = 'MIN(:burst, tokens + (:now - updated) * :rate)'
+            taken = conn.execute(
+                'INSERT INTO rate_buckets (key, tokens, updated, full_at) '
+                'VALUES (:key, :burst - 1, :now, :now + 1.0 / :rate) '
+                f'ON CONFLICT (key) DO UPDATE SET tokens = {level} - 1, updated = :now, '
+                f'full_at = :now + (:burst - ({level} - 1)) / :rate '
+                f'WHERE {level} >= 1',
+                {'key': key, 'burst': burst, 'rate': rate, 'now': now}
+            ).rowcount == 1
+            if taken:
+                return 0
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+        tokens = min(burst, row[0] + (now - row[1]) * rate) if row else burst
+        return max((1 - tokens) / rate, 0.001)
+
+    def stats(self):
+        """
+        Return a snapshot of the store counters (this process only) and the table size.
+
+        Returns:
+            dict: evicted and size
+        """
+        size = self._connect().execute('SELECT COUNT(*) FROM rate_buckets').fetchone()[0]
+        with self._lock:
+            return dict(self._stats, size=size)
+
+
+class RateLimiter:
+    """WSGI middleware throttling a set of paths per client IP and per session."""
+
+    def __init__(self, wsgi_app, store, paths, limits, cookie_name, trusted_proxies=(), ip_only_paths=()):
+        """
+        Args:
+            wsgi_app: Application to protect
+            store: MemoryRateLimitStore or SQLiteRateLimitStore
+            paths: Request paths that are rate limited
+            limits: {'ip': (rate, burst), 'session': (rate, burst)}; a missing entry disables that limit
+            cookie_name: Session cookie identifying a browser
+            trusted_proxies: Addresses or networks of the reverse proxies whose
+                X-Forwarded-For entries are trusted, e.g. ['172.28.0.31']
+            ip_only_paths: Paths limited per client IP only (unauthenticated callbacks)
+        """
+        self.wsgi_app = wsgi_app
+        self.store = store
+        self.paths = frozenset(paths)
+        self.limits = limits
+        self.cookie_name = cookie_name
+        self.trusted_proxies = tuple(ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies)
+        self.ip_only_paths = frozenset(ip_only_paths)
+        self._lock = threading.Lock()
+        self._stats = {'allowed': 0, 'rejected_ip': 0, 'rejected_session': 0}
+
+    def _trusted(self, address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def client_ip(self, environ):
+        """
+        Return the client address.
+
+        X-Forwarded-For is only consulted when the peer is a trusted proxy,
+        and then read from the right for as long as the hops are trusted
+        proxies too; the first other address is the client. Entries left
+        of it are ignored, since clients can send any X-Forwarded-For they
+        like.
+        """
+        address = environ.get('REMOTE_ADDR', '')
+        if not self.trusted_proxies or not self._trusted(address):
+            return address
+        hops = [hop.strip() for hop in environ.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        while hops and self._trusted(address):
+            address = hops.pop()
+        return address
+
+    def check(self, environ):
+        """
+        Take a token from the request's buckets.
+
+        The result is remembered in the environ; checking the same request
+        again (e.g. from the ASGI front end and then the middleware) does
+        not take more tokens.
+
+        Returns:
+            tuple: (limit name, seconds until a retry can succeed), or None if the request may proceed
+        """
+        if RESULT_KEY not in environ:
+            environ[RESULT_KEY] = self._take(environ)
+        return environ[RESULT_KEY]
+
+    def _take(self, environ):
+        if 'ip' in self.limits:
+            retry_after = self.store.take('ip:' + self.client_ip(environ), *self.limits['ip'])
+            if retry_after:
+                return 'ip', retry_after
+        if 'session' in self.limits and environ.get('PATH_INFO') not in self.ip_only_paths:
+            sid = parse_cookie(environ.get('HTTP_COOKIE', '')).get(self.cookie_name)
+            if sid:
+                key = 'session:' + hashlib.blake2b(sid.encode('utf-8'), digest_size=16).hexdigest()
+                retry_after = self.store.take(key, *self.limits['session'])
+                if retry_after:
+                    return 'session', retry_after
+        return None
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') not in self.paths:
+            return self.wsgi_app(environ, start_response)
+        rejection = self.check(environ)
+        if rejection is None:
+            with self._lock:
+                self._stats['allowed'] += 1
+            return self.wsgi_app(environ, start_response)
+
+        limit, retry_after = rejection
+        with self._lock:
+            self._stats['rejected_' + limit] += 1
+        body = json.dumps({'error': 'Too many requests, retry later'}).encode('utf-8')
+        start_response('429 Too Many Requests', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(math.ceil(retry_after))),
+            ('Cache-Control', 'no-store'),
+        ])
+        return [body]
+
+    def stats(self):
+        """
+        Return a snapshot of the limiter and store counters.
+
+        Returns:
+            dict: allowed, rejected_ip, rejected_session, evicted and size (buckets held)
+        """
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot.update(self.store.stats())
+        return snapshot
+
+
+def init_rate_limiting(app, paths, ip_only_paths=()):
+    """
+    Wrap the application's WSGI callable in a RateLimiter configured from the environment.
+
+    RATE_LIMIT_ENABLED selects whether login endpoints are throttled
+    (default true). RATE_LIMIT_BACKEND selects the bucket storage:
+        memory - in-process (default, single process only)
+        sqlite - SQLite file at RATE_LIMIT_SQLITE_PATH, shared across workers
+
+    RATE_LIMIT_IP_RATE / RATE_LIMIT_IP_BURST           - per client IP (default 10/s, burst 50)
+    RATE_LIMIT_SESSION_RATE / RATE_LIMIT_SESSION_BURST - per session (default 1/s, burst 10)
+    RATE_LIMIT_TRUSTED_PROXIES                         - comma-separated proxy addresses/networks whose
+                                                         X-Forwarded-For is trusted (default none)
+    RATE_LIMIT_MAX_ENTRIES                             - buckets held at most (default 100000)
+
+    A rate of 0 disables that limit.
+
+    Args:
+        app: Flask application
+        paths: Request paths to throttle
+        ip_only_paths: Paths among them limited per client IP only
+
+    Returns:
+        RateLimiter: The installed limiter, or None if rate limiting is disabled
+    """
+    if os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'true':
+        return None
+    limits = {}
+    for name, default_rate, default_burst in (('ip', 10, 50), ('session', 1, 10)):
+        rate = float(os.environ.get(f'RATE_LIMIT_{name.upper()}_RATE', default_rate))
+        if rate > 0:
+            limits[name] = (rate, float(os.environ.get(f'RATE_LIMIT_{name.upper()}_BURST', default_burst)))
+    if not limits:
+        return None
+
+    backend = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    max_entries = int(os.environ.get('RATE_LIMIT_MAX_ENTRIES', 100000))
+    if backend == 'memory':
+        horizon = max(burst / rate for rate, burst in limits.values())
+        store = MemoryRateLimitStore(horizon, max_entries)
+    elif backend == 'sqlite':
+        default_path = f"/tmp/{app.config['SESSION_COOKIE_NAME']}_rate_limit.db"
+        store = SQLiteRateLimitStore(os.environ.get('RATE_LIMIT_SQLITE_PATH', default_path), max_entries)
+    else:
+        raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {backend}')
+
+    trusted_proxies = [proxy.strip() for proxy in os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '').split(',')
+                       if proxy.strip()]
+    limiter = RateLimiter(app.wsgi_app, store, paths, limits, app.config['SESSION_COOKIE_NAME'],
+                          trusted_proxies=trusted_proxies, ip_only_paths=ip_only_paths)
+    app.wsgi_app = limiter
+    return limiter
@@ -0,0 +1,216 @@
+"""Proactive access token refresh for the OIDC backend
+
+Uses the refresh token stored at login to renew the access token shortly
+before it expires, so users are not sent through a full browser redirect
+to Keycloak when it does. Refreshes happen lazily on incoming requests
+and are single-flight per refresh token: when an SPA fires several API
+calls at once, only one of them calls the token endpoint and the others
+reuse its result. A failed refresh is reused for a short backoff as well,
+so while Keycloak is down each session keeps its current tokens instead
+of holding a request thread on another token request with every call.
+"""
+
+import hashlib
+import threading
+import time
+
+import requests
+
+# Outcomes of refresh_session()
+FRESH = 'fresh'          # Access token still valid, nothing to do
+REFRESHED = 'refreshed'  # New tokens stored in the session
+FAILED = 'failed'        # Transient error, current tokens kept
+INVALID = 'invalid'      # Refresh token rejected, the session must be re-established
+
+
+class _Flight:
+    """A refresh in progress (or recently finished) for one refresh token."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.finished_at = None
+        self.ttl = None  # Seconds the finished result is reused
+        self.status = None
+        self.tokens = None
+
+
+class TokenRefreshManager:
+    """
+    Refreshes access tokens with the refresh_token grant, single-flight per token.
+
+    Results are kept for result_ttl seconds so requests that arrive with the
+    old refresh token right after a rotation still get the new tokens;
+    failures are kept for failure_backoff seconds before the next attempt.
+    """
+
+    def __init__(self, token_url, client_id, client_secret, http=None, skew=30,
+                 timeout=5, result_ttl=30, failure_backoff=5, on_latency=None):
+        """
+        Args:
+            token_url: IdP token endpoint
+            client_id: OAuth client ID
+            client_secret: OAuth client secret
+            http: requests.Session used for the calls (connection pooling)
+            skew: Refresh this many seconds before the access token expires
+            timeout: Timeout in seconds (or a (connect, read) tuple) for the token request
+            result_ttl: Seconds a refresh result is reused for the same token
+            failure_backoff: Seconds a failed refresh is reused before the token endpoint is tried again
+            on_latency: Optional callable receiving each refresh's duration
+        """
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.http = http or requests.Session()
+        self.skew = skew
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self.failure_backoff = failure_backoff
+        self.on_latency = on_latency
+        self._flights = {}  # sha256(refresh_token) -> _Flight
+        self._lock = threading.Lock()
+        self._stats = {'refreshes': 0, 'failures': 0, 'invalid': 0, 'coalesced': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def needs_refresh(self, tokens):
+        """
+        Check whether the stored access token is about to expire.
+
+        Args:
+            tokens: Token dict stored in the session
+
+        Returns:
+            bool: True if a refresh should be attempted
+        """
+        expires_at = tokens.get('expires_at')
+        return bool(expires_at and tokens.get('refresh_token') and time.time() >= expires_at - self.skew)
+
+    def _request(self, refresh_token):
+        """Call the token endpoint; returns (status, tokens)."""
+        start = time.perf_counter()
+        try:
+            response = self.http.post(
+                self.token_url,
+                data={'grant_type': 'refresh_token', 'refresh_token': refresh_token},
+                auth=(self.client_id, self.client_secret),
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            self._count('failures')
+            print(f"Token refresh error: {e}")
+            return FAILED, None
+        finally:
+            if self.on_latency is not None:
+                self.on_latency(time.perf_counter() - start)
+
+        if response.status_code in (400, 401):
+            try:
+                error = response.json().get('error')
+            except (AttributeError, ValueError):
+                error = None
+            if error == 'invalid_grant':
+                # Refresh token expired or the SSO session ended
+                self._count('invalid')
+                return INVALID, None
+            # e.g. invalid_client after a secret rotation - not the user's fault, keep the session
+            self._count('failures')
+            print(f"Token refresh error: HTTP {response.status_code} {error or 'without an OAuth error'}")
+            return FAILED, None
+        if response.status_code != 200:
+            self._count('failures')
+            print(f"Token refresh error: HTTP {response.status_code}")
+            return FAILED, None
+
+        try:
+            data = response.json()
+            if not isinstance(data, dict) or 'access_token' not in data:
+                raise ValueError('no access_token in the token response')
+            if 'expires_in' in data and 'expires_at' not in data:
+                data['expires_at'] = int(time.time()) + int(data['expires_in'])
+        except (TypeError, ValueError) as e:
+            # e.g. an HTML error page from a proxy served with status 200
+            self._count('failures')
+            print(f"Token refresh error: invalid token response: {e}")
+            return FAILED, None
+        self._count('refreshes')
+        return REFRESHED, data
+
+    def refresh(self, refresh_token):
+        """
+        Exchange a refresh token for new tokens, coalescing concurrent calls.
+
+        Args:
+            refresh_token: Refresh token from the session
+
+        Returns:
+            tuple: (status, token dict or None)
+        """
+        key = hashlib.sha256(refresh_token.encode('utf-8')).digest()
+        now = time.monotonic()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.finished_at is not None \
+                    and now - flight.finished_at >= flight.ttl:
+                flight = None
+            leader = flight is None
+            if leader:
+                # Forget finished refreshes that are too old to be reused
+                for old_key in [k for k, f in self._flights.items()
+                                if f.finished_at is not None and now - f.finished_at >= f.ttl]:
+                    del self._flights[old_key]
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            budget = sum(self.timeout) if isinstance(self.timeout, tuple) else self.timeout
+            flight.event.wait(budget + 1)
+            return (flight.status or FAILED), flight.tokens
+
+        try:
+            flight.status, flight.tokens = self._request(refresh_token)
+        finally:
+            if flight.status is None:
+                # _request raised; waiters see FAILED rather than a missing status
+                flight.status = FAILED
+            # Failures are retried sooner, but not by every request in the meantime
+            flight.ttl = self.failure_backoff if flight.status == FAILED else self.result_ttl
+            flight.finished_at = time.monotonic()
+            flight.event.set()
+        return flight.status, flight.tokens
+
+    def refresh_session(self, session):
+        """
+        Refresh the session's tokens if the access token is about to expire.
+
+        Args:
+            session: Flask session holding a 'tokens' dict
+
+        Returns:
+            str: FRESH, REFRESHED, FAILED or INVALID
+        """
+        tokens = session.get('tokens')
+        if not tokens or not self.needs_refresh(tokens):
+            return FRESH
+
+        status, new_tokens = self.refresh(tokens['refresh_token'])
+        if status == REFRESHED:
+            session['tokens'] = {
+                'access_token': new_tokens.get('access_token'),
+                'id_token': new_tokens.get('id_token') or tokens.get('id_token'),
+                'refresh_token': new_tokens.get('refresh_token') or tokens['refresh_token'],
+                'expires_at': new_tokens.get('expires_at')
+            }
+        return status
+
+    def stats(self):
+        """
+        Return a snapshot of the refresh counters.
+
+        Returns:
+            dict: refreshes, failures, invalid and coalesced counts
+        """
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,123 @@
+"""Compiled role hierarchy for role-based access control
+
+The role hierarchy is a DAG where each role lists the roles it directly
+inherits (admin > editor > viewer by default). It is compiled once at
+startup into a transitive closure, and every role gets one bit, so a
+user's effective permissions can be resolved into a single integer at
+login and each authorization check is a bitwise AND.
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import hashlib
+import json
+import os
+
+# Default hierarchy - higher roles inherit permissions of lower roles
+DEFAULT_ROLE_HIERARCHY = {
+    'admin': ['editor', 'viewer'],  # Admin can do everything editor and viewer can
+    'editor': ['viewer'],            # Editor can do everything viewer can
+    'viewer': []                     # Viewer has no inherited permissions
+}
+
+
+class RoleHierarchy:
+    """
+    Transitive closure of a role DAG, encoded as bitmasks.
+
+    Each role is assigned a bit; closure_masks[role] has the bits of the
+    role itself and of every role it inherits, directly or indirectly.
+    """
+
+    def __init__(self, hierarchy):
+        """
+        Args:
+            hierarchy: Dict mapping each role to the list of roles it inherits
+        """
+        roles = set(hierarchy)
+        for inherited in hierarchy.values():
+            roles.update(inherited)
+
+        # Sorted so bit assignments are stable across processes
+        self.bits = {role: 1 << i for i, role in enumerate(sorted(roles))}
+        self.closure_masks = {role: self._closure(role, hierarchy) for role in self.bits}
+        # Fingerprint of the compiled hierarchy, stored next to cached masks
+        canonical = json.dumps({r: sorted(hierarchy.get(r, [])) for r in sorted(roles)})
+        self.version = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:12]
+
+    def _closure(self, role, hierarchy):
+        """Return the bitmask of a role and everything reachable from it."""
+        mask = 0
+        stack = [role]
+        seen = set()
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            mask |= self.bits[current]
+            stack.extend(hierarchy.get(current, []))
+        return mask
+
+    def effective_mask(self, user_roles):
+        """
+        Resolve a user's roles into the bitmask of all effective roles.
+
+        Roles not present in the hierarchy (e.g. Keycloak defaults such as
+        offline_access) grant nothing and are ignored.
+
+        Args:
+            user_roles: Iterable of role names assigned to the user
+
+        Returns:
+            int: Bitmask of effective roles
+        """
+        mask = 0
+        closure_masks = self.closure_masks
+        for role in user_roles:
+            mask |= closure_masks.get(role, 0)
+        return mask
+
+    def effective_roles(self, user_roles):
+        """
+        Resolve a user's roles into the set of all effective roles.
+
+        Args:
+            user_roles: Iterable of role names assigned to the user
+
+        Returns:
+            frozenset: Names of the effective roles
+        """
+        mask = self.effective_mask(user_roles)
+        return frozenset(role for role, bit in self.bits.items() if mask & bit)
+
+    def bit(self, role):
+        """
+        Return the bit for a role, failing fast on roles the hierarchy doesn't define.
+
+        Raises:
+            ValueError: If the role is not part of the hierarchy
+        """
+        if role not in self.bits:
+            raise ValueError(f'Role {role} is not defined in the role hierarchy')
+        return self.bits[role]
+
+
+def load_role_hierarchy():
+    """
+    Build the role hierarchy from the environment.
+
+    ROLE_HIERARCHY_FILE (path to a JSON file) or ROLE_HIERARCHY (inline
+    JSON) override the default admin > editor > viewer hierarchy.
+
+    Returns:
+        RoleHierarchy: Compiled hierarchy
+    """
+    path = os.environ.get('ROLE_HIERARCHY_FILE')
+    if path:
+        with open(path) as f:
+            return RoleHierarchy(json.load(f))
+    inline = os.environ.get('ROLE_HIERARCHY')
+    if inline:
+        return RoleHierarchy(json.loads(inline))
+    return RoleHierarchy(DEFAULT_ROLE_HIERARCHY)
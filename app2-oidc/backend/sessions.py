@@ -0,0 +1,241 @@
+"""Server-side session storage for the SSO backends
+
+Replaces Flask's signed cookie session with a server-side store: the
+cookie only carries an opaque, random session ID while the session data
+(user attributes, roles, tokens) stays on the server. Two stores are
+provided:
+
+- MemorySessionStore: in-process LRU with TTL (single process only)
+- SQLiteSessionStore: file-backed store that several worker processes on
+  the same host can share (a local stand-in for Redis/Memcached)
+
+Client-side sessions (SESSION_BACKEND=cookie) use the compact signed
+cookie format in cookie_session.py instead.
+
+The same module is used by both the SAML and the OIDC backend.
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cookie_session import CompactCookieSessionInterface
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict whose contents live in a server-side store."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Set by regenerate_session(); the old ID is deleted when the session is saved
+        self.replaced_sid = None
+
+
+def regenerate_session(session):
+    """
+    Move the session to a new random ID, keeping its data.
+
+    Called at login so that a session ID planted before authentication
+    (session fixation) never becomes an authenticated session. The old ID
+    is deleted from the store when the session is saved. Cookie sessions
+    carry no ID and are left unchanged.
+
+    Args:
+        session: The current request's session
+    """
+    if not isinstance(session, ServerSideSession):
+        return
+    if not session.new:
+        session.replaced_sid = session.sid
+    session.sid = secrets.token_urlsafe(32)
+    session.new = True
+    session.modified = True
+
+
+class MemorySessionStore:
+    """
+    In-process LRU session store with per-entry expiry.
+
+    Sessions are evicted when they expire or when the store grows beyond
+    max_entries (least recently used first).
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # sid -> (expires_at, data)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return data
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._entries[sid] = (time.time() + ttl, data)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class SQLiteSessionStore:
+    """
+    SQLite-backed session store shared by all processes using the same file.
+
+    Expired rows are ignored on read and purged every purge_every writes.
+    """
+
+    def __init__(self, path, purge_every=1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._serializer = TaggedJSONSerializer()
+        self._local = threading.local()
+        self._writes = 0
+        # Use a throwaway connection so none is inherited by forked workers
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS sessions '
+                    '(sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+                )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """Return this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self._connect().execute(
+            'SELECT data FROM sessions WHERE sid = ? AND expires_at > ?', (sid, time.time())
+        ).fetchone()
+        return self._serializer.loads(row[0]) if row else None
+
+    def set(self, sid, data, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                (sid, self._serializer.dumps(data), now + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface that keeps session data in a server-side store.
+
+    The cookie value is a random 256-bit session ID, so it does not need to
+    be signed; unknown or expired IDs simply start a new, empty session.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def _ttl(self, app):
+        return int(app.permanent_session_lifetime.total_seconds())
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(dict(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid is not None:
+            self.store.delete(session.replaced_sid)
+
+        if not session:
+            # Session was cleared (e.g. logout) - drop it server-side as well
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified and not session.new:
+            return
+
+        self.store.set(session.sid, dict(session), self._ttl(app))
+        if session.new:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+
+def init_session_store(app):
+    """
+    Configure the application's session backend from the environment.
+
+    SESSION_BACKEND selects the storage:
+        cookie       - compact signed cookie session (see cookie_session.py)
+        flask-cookie - Flask's default signed cookie session
+        memory - in-process LRU store (default, single process only)
+        sqlite - SQLite file at SESSION_SQLITE_PATH, shared across workers
+
+    Args:
+        app: Flask application to configure
+    """
+    backend = os.environ.get('SESSION_BACKEND', 'memory')
+    if backend == 'flask-cookie':
+        return
+    if backend == 'cookie':
+        app.session_interface = CompactCookieSessionInterface(
+            cache_size=int(os.environ.get('SESSION_COOKIE_CACHE_SIZE', 1024))
+        )
+        return
+    if backend == 'memory':
+        store = MemorySessionStore(max_entries=int(os.environ.get('SESSION_MAX_ENTRIES', 10000)))
+    elif backend == 'sqlite':
+        default_path = f"/tmp/{app.config['SESSION_COOKIE_NAME']}.db"
+        store = SQLiteSessionStore(os.environ.get('SESSION_SQLITE_PATH', default_path))
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND: {backend}')
+    app.session_interface = ServerSideSessionInterface(store)
@@ -0,0 +1,36 @@
+"""WSGI entry point for the OIDC backend
+
+Used by Gunicorn in production (see gunicorn.conf.py). create_app() runs
+the startup warm-up (see warmup.py and the stages in app.py) - the IdP's
+signing keys, the OAuth client, the compiled role hierarchy and
+authorization policy and a first anonymous request - so that with
+preload_app it is done once in the master process and inherited by every
+worker instead of being paid for by the first logins. /ready reports
+whether it succeeded; key fetches are retried while Keycloak starts up.
+"""
+
+import time
+
+
+def create_app():
+    """
+    Import the application and run its warm-up stages.
+
+    Returns:
+        Flask: The OIDC backend application
+    """
+    start = time.perf_counter()
+    from app import app, warmup
+
+    warmup.record_import(time.perf_counter() - start)
+    warmup.run()
+    return app
+
+
+def reset_after_fork():
+    """Drop connections inherited from the master so workers never share sockets."""
+    from app import idp_http
+    idp_http.adapter.shutdown()
+
+
+app = create_app()
@@ -0,0 +1 @@
+"""Self-contained load tests for the SAML and OIDC backends (see loadtest/__main__.py)."""
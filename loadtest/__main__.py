@@ -0,0 +1,87 @@
+"""Command-line entry point for the load-test harness
+
+Usage (from the repository root):
+
+    python -m loadtest                          # both backends
+    python -m loadtest --backend oidc -c 16 -n 50
+    python -m loadtest --json results.json --max-p95-ms 250
+
+Each backend runs in its own subprocess. The exit status is non-zero if
+any request failed or a p95 exceeds --max-p95-ms, so the harness can gate
+CI without network access.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+from loadtest import driver
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description=__doc__.split('\n')[0])
+    parser.add_argument('--backend', choices=['saml', 'oidc', 'all'], default='all')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='simulated users (default 8)')
+    parser.add_argument('-n', '--cycles', type=int, default=25, help='login cycles per user (default 25)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed cycles per user (default 1)')
+    parser.add_argument('--token-latency', type=float, default=0.0,
+                        help='seconds the stub IdP token endpoint sleeps (default 0)')
+    parser.add_argument('--extra-groups', type=int, default=0,
+                        help='extra group values per SAML assertion and OIDC token (default 0)')
+    parser.add_argument('--json', metavar='PATH', help='also write results as JSON')
+    parser.add_argument('--max-p95-ms', type=float, help='fail if any endpoint p95 exceeds this')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_child(args):
+    """Run one backend in this process and print its results as JSON."""
+    result = driver.run(args.backend, concurrency=args.concurrency, cycles=args.cycles,
+                        token_latency=args.token_latency, extra_groups=args.extra_groups,
+                        warmup=args.warmup)
+    print('LOADTEST_RESULT ' + json.dumps(result))
+
+
+def run_backend(backend, args):
+    """Run one backend in a subprocess and return its parsed results."""
+    command = [sys.executable, '-m', 'loadtest', '--child', '--backend', backend,
+               '-c', str(args.concurrency), '-n', str(args.cycles), '--warmup', str(args.warmup),
+               '--token-latency', str(args.token_latency), '--extra-groups', str(args.extra_groups)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith('LOADTEST_RESULT '):
+            return json.loads(line[len('LOADTEST_RESULT '):])
+    sys.stderr.write(completed.stdout[-2000:] + completed.stderr[-4000:])
+    raise SystemExit(f'{backend} load test failed (exit status {completed.returncode})')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        run_child(args)
+        return 0
+
+    backends = ['saml', 'oidc'] if args.backend == 'all' else [args.backend]
+    results = [run_backend(backend, args) for backend in backends]
+    print('\n\n'.join(driver.format_report(result) for result in results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    for result in results:
+        for row in result['endpoints']:
+            if row['errors']:
+                print(f"FAIL {result['backend']} {row['endpoint']}: {row['errors']} unexpected responses")
+                failed = True
+            if args.max_p95_ms is not None and row['p95_ms'] > args.max_p95_ms:
+                print(f"FAIL {result['backend']} {row['endpoint']}: p95 {row['p95_ms']:.1f} ms "
+                      f"> {args.max_p95_ms} ms")
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
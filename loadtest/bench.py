@@ -0,0 +1,400 @@
+"""Micro-benchmarks for the backends' hot-path helpers
+
+Times individual components in isolation, without Flask or the stub IdP.
+
+Usage (from the repository root):
+
+    python -m loadtest.bench                 # all benchmarks
+    python -m loadtest.bench replay -n 200000
+
+Each benchmark imports its backend's helper modules from the backend
+directory, so run one benchmark per backend per process (the default
+does so by re-invoking itself).
+"""
+
+import argparse
+import base64
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest.driver import BACKEND_DIRS
+
+
+def use_backend(backend):
+    """Make a backend's helper modules importable."""
+    sys.path.insert(0, BACKEND_DIRS[backend])
+
+
+def timed(operations, fn):
+    """Run fn() and return operations per second."""
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return operations / elapsed if elapsed else float('inf')
+
+
+def bench_replay(count):
+    """Insert and lookup throughput of the SAML replay caches."""
+    use_backend('saml')
+    from replay_cache import MemoryReplayCache, SQLiteReplayCache
+
+    ids = [f'_assertion-{i:012d}' for i in range(count)]
+    now = time.time()
+    # Spread expiries over ten minutes, as with assertions valid for a few minutes
+    expiries = [now + 60 + (i % 600) for i in range(count)]
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        caches = [
+            ('memory', MemoryReplayCache(max_entries=count)),
+            ('sqlite', SQLiteReplayCache(os.path.join(workdir, 'replay.db'), 'bench', max_entries=count)),
+        ]
+        for name, cache in caches:
+            n = count if name == 'memory' else max(1, count // 20)
+            rows.append((f'{name} add (new)', timed(n, lambda: [cache.add(ids[i], expiries[i]) for i in range(n)])))
+            rows.append((f'{name} add (replay)', timed(n, lambda: [cache.add(ids[i], expiries[i]) for i in range(n)])))
+            rows.append((f'{name} contains', timed(n, lambda: [cache.contains(ids[i]) for i in range(n)])))
+            rows.append((f'{name} pop', timed(n, lambda: [cache.pop(ids[i]) for i in range(n)])))
+    return rows
+
+
+def bench_roles(count):
+    """Role extraction at login and session decoding for a user with 500 groups."""
+    use_backend('saml')
+    from flask.json.tag import TaggedJSONSerializer
+    from role_mapping import load_role_mapper
+    from roles import load_role_hierarchy
+
+    attributes = {
+        'Role': ['editor', 'offline_access', 'uma_authorization', 'default-roles-sso-poc'],
+        'groups': [f'/group-{i}' for i in range(500)],
+        'username': ['loadtest-editor'],
+    }
+
+    def legacy_roles():
+        # Extraction as done in saml_callback before the role mapping stage
+        roles = []
+        for name in ['userRoles', 'Role', 'roles', 'memberOf', 'groups', 'role']:
+            if name in attributes:
+                value = attributes[name]
+                if isinstance(value, list):
+                    roles.extend(value)
+                else:
+                    roles.append(value)
+        return list(set(roles))
+
+    mapper = load_role_mapper(load_role_hierarchy(), 'saml')
+    serializer = TaggedJSONSerializer()
+    sessions = []
+    for label, roles in (('unmapped', legacy_roles()), ('mapped', mapper.map(attributes))):
+        data = {'authenticated': True, 'username': 'loadtest-editor', 'roles': roles,
+                'samlUserdata': {'username': 'loadtest-editor', 'roles': roles}}
+        sessions.append((f'{label}, {len(serializer.dumps(data))} B', serializer.dumps(data)))
+
+    n = max(1, count // 10)
+    rows = [
+        ('legacy extraction', timed(n, lambda: [legacy_roles() for _ in range(n)])),
+        ('role mapper', timed(n, lambda: [mapper.map(attributes) for _ in range(n)])),
+    ]
+    for label, document in sessions:
+        rows.append((f'session decode ({label})', timed(n, lambda: [serializer.loads(document) for _ in range(n)])))
+    return rows
+
+
+def legacy_check_role_hierarchy(user_roles, required_role):
+    """Authorization check as done on every protected request before roles.py."""
+    role_hierarchy = {
+        'admin': ['editor', 'viewer'],
+        'editor': ['viewer'],
+        'viewer': []
+    }
+    if required_role in user_roles:
+        return True
+    for user_role in user_roles:
+        if user_role in role_hierarchy and required_role in role_hierarchy[user_role]:
+            return True
+    return False
+
+
+def bench_closure(count):
+    """Role checks per request: per-request hierarchy expansion vs. the compiled closure bitmask."""
+    use_backend('saml')
+    from roles import RoleHierarchy, load_role_hierarchy
+
+    n = max(1, count // 10)
+    default = load_role_hierarchy()
+    viewer_bit = default.bit('viewer')
+    mask = default.effective_mask(['editor'])
+    rows = [
+        ('default: check_role_hierarchy', timed(n, lambda: [legacy_check_role_hierarchy(['editor'], 'viewer')
+                                                           for _ in range(n)])),
+        ('default: mask & bit', timed(n, lambda: [mask & viewer_bit for _ in range(n)])),
+    ]
+
+    # A 64-role DAG where every role inherits the next two; users hold one top-level role
+    # plus unrelated IdP groups, and the check asks for the deepest role
+    hierarchy = {f'role-{i}': [f'role-{j}' for j in (i + 1, i + 2) if j < 64] for i in range(64)}
+    compiled = RoleHierarchy(hierarchy)
+    required = 'role-63'
+    required_bit = compiled.bit(required)
+
+    def expand(user_roles):
+        # Transitive expansion per request, as a dict-based hierarchy needs without a closure
+        stack = list(user_roles)
+        seen = set()
+        while stack:
+            role = stack.pop()
+            if role == required:
+                return True
+            if role in seen:
+                continue
+            seen.add(role)
+            stack.extend(hierarchy.get(role, ()))
+        return False
+
+    for size in (1, 10, 100, 1000):
+        user_roles = ['role-0'] + [f'/group-{i}' for i in range(size - 1)]
+        user_mask = compiled.effective_mask(user_roles)
+        m = max(1, n // size)
+        rows.append((f'{size} roles: per-request expansion', timed(m, lambda: [expand(user_roles) for _ in range(m)])))
+        rows.append((f'{size} roles: effective_mask (login)',
+                     timed(m, lambda: [compiled.effective_mask(user_roles) for _ in range(m)])))
+        rows.append((f'{size} roles: mask & bit (request)', timed(n, lambda: [user_mask & required_bit
+                                                                             for _ in range(n)])))
+    return rows
+
+
+def legacy_dom_attributes(decoded):
+    """Duplicated-Name fallback as done in saml_callback before saml_parser.py."""
+    import xml.etree.ElementTree as ET
+    namespaces = {
+        'saml': 'urn:oasis:names:tc:SAML:2.0:assertion',
+        'samlp': 'urn:oasis:names:tc:SAML:2.0:protocol'
+    }
+    root = ET.fromstring(decoded)
+    attributes = {}
+    for attr in root.findall('.//saml:Attribute', namespaces):
+        name = attr.get('Name')
+        values = [value.text for value in attr.findall('saml:AttributeValue', namespaces) if value.text]
+        if name and values:
+            attributes.setdefault(name, []).extend(values)
+    nameid_elem = root.find('.//saml:NameID', namespaces)
+    return attributes, nameid_elem.text if nameid_elem is not None else ''
+
+
+def group_heavy_response(groups):
+    """Unsigned SAML response with one Role attribute per group, as Keycloak sends them."""
+    values = ''.join(
+        '<saml:Attribute Name="Role" NameFormat="urn:oasis:names:tc:SAML:2.0:attrname-format:basic">'
+        f'<saml:AttributeValue>/department-{i // 50}/group-{i}</saml:AttributeValue></saml:Attribute>'
+        for i in range(groups)
+    )
+    return (
+        '<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" '
+        'xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="_r1" InResponseTo="ONELOGIN_1" Version="2.0">'
+        '<saml:Issuer>http://localhost:8080/realms/sso-poc</saml:Issuer>'
+        '<saml:Assertion ID="_a1" Version="2.0"><saml:Issuer>http://localhost:8080/realms/sso-poc</saml:Issuer>'
+        '<saml:Subject><saml:NameID>loadtest-editor</saml:NameID></saml:Subject>'
+        '<saml:AuthnStatement SessionIndex="_s1"/>'
+        f'<saml:AttributeStatement>{values}</saml:AttributeStatement></saml:Assertion></samlp:Response>'
+    ).encode('utf-8')
+
+
+def bench_parser(count):
+    """Attribute extraction from group-heavy SAML responses: DOM fallback vs. the streaming parser."""
+    use_backend('saml')
+    import tracemalloc
+    from saml_parser import parse_saml_message
+
+    def peak_kib(fn, document):
+        tracemalloc.start()
+        fn(document)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak // 1024
+
+    rows = []
+    for groups in (10, 100, 1000, 10000):
+        document = group_heavy_response(groups)
+        legacy, parsed = legacy_dom_attributes(document)[0], parse_saml_message(document)['attributes']
+        if legacy != parsed:
+            raise SystemExit(f'Parser attributes differ from the DOM fallback for {groups} groups')
+        m = max(1, count // (10 * groups))
+        for name, fn in (('DOM', legacy_dom_attributes), ('streaming', parse_saml_message)):
+            label = f'{groups} groups {name}, {peak_kib(fn, document)} KiB peak'
+            rows.append((label, timed(m, lambda: [fn(document) for _ in range(m)])))
+    return rows
+
+
+def authn_settings_variants():
+    """SAML settings variants covering every optional part of the AuthnRequest template."""
+    with open(os.path.join(BACKEND_DIRS['saml'], 'saml', 'settings.json')) as f:
+        base = json.load(f)
+
+    def variant(**changes):
+        settings = json.loads(json.dumps(base))
+        for path, value in changes.items():
+            section, key = path.split('__')
+            settings.setdefault(section, {})[key] = value
+        return settings
+
+    return {
+        'settings.json': base,
+        'authn context': variant(security__requestedAuthnContext=True),
+        'authn context list': variant(security__requestedAuthnContext=[
+            'urn:oasis:names:tc:SAML:2.0:ac:classes:Password', 'urn:oasis:names:tc:SAML:2.0:ac:classes:X509'],
+            security__requestedAuthnContextComparison='minimum'),
+        'email NameID': variant(sp__NameIDFormat='urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress'),
+        'attribute service': variant(sp__attributeConsumingService={
+            'serviceName': 'SSO POC', 'requestedAttributes': [{'name': 'Role'}]}),
+        'organization': dict(base, organization={'en-US': {
+            'name': 'sso', 'displayname': 'SSO POC', 'url': 'http://localhost:3000'}}),
+        'SSO URL with query': variant(idp__singleSignOnService={
+            'url': base['idp']['singleSignOnService']['url'] + '?kc_idp_hint=corp',
+            'binding': 'urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect'}),
+    }
+
+
+def bench_authn(count):
+    """AuthnRequest redirect generation: python3-saml auth.login() vs. the precomputed template."""
+    use_backend('saml')
+    import warnings
+    from onelogin.saml2.auth import OneLogin_Saml2_Auth
+    from onelogin.saml2.settings import OneLogin_Saml2_Settings
+    from authn_request import AuthnRequestTemplate, check_equivalence
+
+    warnings.simplefilter('ignore', DeprecationWarning)  # python3-saml warns about server_port
+    request_data = {'https': 'off', 'http_host': 'localhost:3000', 'server_port': '3000',
+                    'script_name': '/saml/login', 'get_data': {}, 'post_data': {}}
+    # Equivalence first: every variant must produce python3-saml's exact redirect URL
+    for name, document in authn_settings_variants().items():
+        settings = OneLogin_Saml2_Settings(document, sp_validation_only=True)
+        template = AuthnRequestTemplate(settings)
+        for _ in range(100):
+            difference = check_equivalence(template, settings, request_data)
+            if difference:
+                raise SystemExit(f'AuthnRequest template not equivalent for {name}: {difference}')
+    print('  equivalent to python3-saml for all settings variants')
+
+    settings = OneLogin_Saml2_Settings(authn_settings_variants()['settings.json'], sp_validation_only=True)
+    template = AuthnRequestTemplate(settings)
+    n = max(1, count // 10)
+    return [
+        ('auth.login()', timed(n, lambda: [OneLogin_Saml2_Auth(request_data, old_settings=settings).login()
+                                           for _ in range(n)])),
+        ('template', timed(n, lambda: [template.login(request_data) for _ in range(n)])),
+    ]
+
+
+def bench_sessions(count):
+    """Per-request session overhead of every backend: server-side stores vs. signed cookies."""
+    use_backend('oidc')
+    from flask import Flask
+    from flask.json.tag import TaggedJSONSerializer
+    from flask.sessions import SecureCookieSessionInterface
+    from werkzeug.test import EnvironBuilder
+    from cookie_session import CompactCookieSessionInterface
+    from sessions import MemorySessionStore, SQLiteSessionStore, ServerSideSession, ServerSideSessionInterface
+
+    app = Flask('bench')
+    app.secret_key = 'bench-secret-key'
+    roles = ['editor', 'viewer']
+    user = {'sub': '4f1c2a5e-9b7d-4c3e-8a61-2d5f0e7b9c13', 'email': 'loadtest-editor@example.com',
+            'preferred_username': 'loadtest-editor', 'name': 'Load Test Editor', 'roles': roles}
+    sessions = {
+        'saml': {'authenticated': True, 'username': 'loadtest-editor', 'email': 'loadtest-editor@example.com',
+                 'roles': roles, 'role_mask': 6, 'role_version': 1, 'samlNameId': 'loadtest-editor',
+                 'samlSessionIndex': '_7c1f0e2d-2f1b-4b8e-9a43-1e5c6d7f8a90', 'registry_id': 42,
+                 'samlUserdata': {'username': 'loadtest-editor', 'email': 'loadtest-editor@example.com',
+                                  'roles': roles},
+                 'user_view_version': 'a1b2c3d4e5f60718'},
+        # Token sizes as issued by Keycloak for this realm
+        'oidc': {'user': user, 'role_mask': 6, 'role_version': 1, 'registry_id': 42,
+                 'tokens': {'access_token': base64.urlsafe_b64encode(os.urandom(900)).decode(),
+                            'id_token': base64.urlsafe_b64encode(os.urandom(700)).decode(),
+                            'refresh_token': base64.urlsafe_b64encode(os.urandom(500)).decode(),
+                            'expires_at': 1767225600},
+                 'user_view_version': 'a1b2c3d4e5f60718'},
+    }
+    workdir = tempfile.TemporaryDirectory()
+    interfaces = [
+        ('memory', ServerSideSessionInterface(MemorySessionStore())),
+        ('sqlite', ServerSideSessionInterface(SQLiteSessionStore(os.path.join(workdir.name, 'sessions.db')))),
+        ('flask', SecureCookieSessionInterface()),
+        ('compact', CompactCookieSessionInterface(cache_size=0)),
+        ('compact cached', CompactCookieSessionInterface(cache_size=1024)),
+    ]
+    serializer = TaggedJSONSerializer()
+    n = max(1, count // 10)
+    with workdir, app.app_context():
+        # Request and response objects alone, included in every row below
+        environ = EnvironBuilder(path='/api/user', headers={'Cookie': 'session=x'}).get_environ()
+        rows = [('baseline (no session)', timed(n, lambda: [(app.request_class(environ).cookies, app.response_class())
+                                                            for _ in range(n)]))]
+        for kind, data in sessions.items():
+            for name, interface in interfaces:
+                # Cookie as issued at login (this also warms the cache of the cached variant)
+                if isinstance(interface, ServerSideSessionInterface):
+                    session = ServerSideSession(data, sid=secrets.token_urlsafe(32), new=True)
+                else:
+                    session = interface.session_class(data)
+                session.modified = True
+                response = app.response_class()
+                interface.save_session(app, session, response)
+                cookie = response.headers['Set-Cookie'].split(';', 1)[0]
+                environ = EnvironBuilder(path='/api/user', headers={'Cookie': cookie}).get_environ()
+
+                def read_request():
+                    # An API call: open the session, read it, nothing to write back
+                    request = app.request_class(environ)
+                    session = interface.open_session(app, request)
+                    session.get('role_mask')
+                    interface.save_session(app, session, app.response_class())
+
+                def write_request():
+                    # A request that changes one value, e.g. the refreshed view version
+                    request = app.request_class(environ)
+                    session = interface.open_session(app, request)
+                    session['user_view_version'] = 'b2c3d4e5f6071829'
+                    interface.save_session(app, session, app.response_class())
+
+                size = f'{len(cookie.split("=", 1)[1])} B'
+                if isinstance(interface, ServerSideSessionInterface):
+                    # The cookie only carries the ID; the data is kept on the server
+                    size += f' + {len(serializer.dumps(data))} B stored'
+                rows.append((f'{kind} {name} read ({size})', timed(n, lambda: [read_request() for _ in range(n)])))
+                rows.append((f'{kind} {name} write', timed(n, lambda: [write_request() for _ in range(n)])))
+    return rows
+
+
+BENCHMARKS = {'authn': bench_authn, 'closure': bench_closure, 'parser': bench_parser,
+              'replay': bench_replay, 'roles': bench_roles, 'sessions': bench_sessions}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest.bench', description=__doc__.split('\n')[0])
+    parser.add_argument('benchmark', nargs='?', choices=sorted(BENCHMARKS), help='benchmark to run (default all)')
+    parser.add_argument('-n', '--operations', type=int, default=100000, help='operations per measurement')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.benchmark is None:
+        status = 0
+        for name in sorted(BENCHMARKS):
+            status |= subprocess.call([sys.executable, '-m', 'loadtest.bench', name, '-n', str(args.operations)])
+        return status
+
+    print(f'{args.benchmark}: {BENCHMARKS[args.benchmark].__doc__}')
+    for label, rate in BENCHMARKS[args.benchmark](args.operations):
+        print(f'  {label:<40}{rate:>14,.0f} ops/s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
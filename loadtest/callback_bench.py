@@ -0,0 +1,157 @@
+"""Login burst benchmark: OIDC backend under Gunicorn vs. the ASGI front end
+
+Starts the OIDC backend twice on loopback, both with one process and the
+same number of request threads, in front of the stub IdP with an
+artificial token endpoint latency:
+
+- sync: gunicorn -c gunicorn.conf.py wsgi:app (gthread worker)
+- async: uvicorn asgi:app (code exchanges on the event loop)
+
+and fires a burst of concurrent logins (GET /oidc/login, then
+GET /oidc/callback) at each. Under Gunicorn every callback holds a
+thread for the whole exchange, so throughput is capped at roughly
+threads / latency; the ASGI front end keeps all exchanges in flight.
+
+--pool off runs the same burst with IDP_POOL_ENABLED=false, i.e. a new
+connection to the IdP for every call instead of the shared keep-alive
+pool (http_client.py); --pool both runs each mode with and without it.
+
+Usage (from the repository root; needs app2-oidc/backend/requirements-asgi.txt):
+
+    python -m loadtest.callback_bench
+    python -m loadtest.callback_bench --idp-latency 0.5 -c 400 -n 2000 --threads 8
+    python -m loadtest.callback_bench --mode sync --pool both
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from loadtest.driver import BACKEND_DIRS, percentile
+from loadtest.stub_idp import StubIdP
+
+SERVERS = {
+    'sync': lambda port, threads: (
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        {'GUNICORN_BIND': f'127.0.0.1:{port}', 'GUNICORN_WORKERS': '1', 'GUNICORN_THREADS': str(threads),
+         'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_KEEPALIVE': '30'},
+    ),
+    'async': lambda port, threads: (
+        [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--no-access-log'],
+        {'ASGI_THREADS': str(threads)},
+    ),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, idp, threads, pooled=True):
+    """Start the OIDC backend in a subprocess and wait until it answers; returns (process, base URL)."""
+    port = free_port()
+    command, extra_env = SERVERS[mode](port, threads)
+    env = dict(os.environ, OIDC_ISSUER=idp.issuer, OIDC_ISSUER_PUBLIC=idp.issuer, OIDC_CLIENT_ID=idp.client_id,
+               SESSION_BACKEND='memory', SESSION_REGISTRY_BACKEND='memory', RATE_LIMIT_ENABLED='false',
+               IDP_POOL_ENABLED='true' if pooled else 'false', **extra_env)
+    process = subprocess.Popen(command, cwd=BACKEND_DIRS['oidc'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{mode} server exited:\n{process.stderr.read()[-4000:]}')
+        try:
+            if httpx.get(base_url + '/api/user', timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f'{mode} server did not start within 30s')
+
+
+async def login_burst(base_url, idp, concurrency, logins):
+    """Run logins through concurrency simulated browsers; returns (elapsed, callback latencies, errors)."""
+    usernames = sorted(idp.users)
+    latencies = []
+    errors = 0
+    remaining = iter(range(logins))
+
+    async def browser(index):
+        nonlocal errors
+        limits = httpx.Limits(max_connections=1)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+            for _ in remaining:
+                try:
+                    response = await client.get('/oidc/login')
+                    query = parse_qs(urlsplit(response.headers['Location']).query)
+                    code = idp.issue_code(usernames[index % len(usernames)], nonce=query.get('nonce', [None])[0])
+                    start = time.perf_counter()
+                    response = await client.get(f"/oidc/callback?code={code}&state={query['state'][0]}")
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 302:
+                        errors += 1
+                    client.cookies.clear()
+                except (httpx.HTTPError, KeyError):
+                    errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(browser(i) for i in range(concurrency)))
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest.callback_bench', description=__doc__.split('\n')[0])
+    parser.add_argument('--mode', choices=['sync', 'async', 'all'], default='all')
+    parser.add_argument('--idp-latency', type=float, default=0.2, help='token endpoint latency in seconds (default 0.2)')
+    parser.add_argument('-c', '--concurrency', type=int, default=200, help='concurrent logins (default 200)')
+    parser.add_argument('-n', '--logins', type=int, default=1000, help='logins per mode (default 1000)')
+    parser.add_argument('--threads', type=int, default=8, help='request threads per server (default 8)')
+    parser.add_argument('--pool', choices=['on', 'off', 'both'], default='on',
+                        help='keep-alive pool to the IdP (default on)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    idp = StubIdP(token_latency=args.idp_latency).start()
+    modes = ['sync', 'async'] if args.mode == 'all' else [args.mode]
+    pools = [True, False] if args.pool == 'both' else [args.pool == 'on']
+    print(f'{args.logins} logins, {args.concurrency} concurrent, IdP token latency {args.idp_latency * 1000:.0f} ms, '
+          f'{args.threads} threads, 1 process')
+    print(f"{'mode':<8}{'pool':<6}{'logins/s':>10}{'errs':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    status = 0
+    try:
+        for mode in modes:
+            for pooled in pools:
+                process, base_url = start_server(mode, idp, args.threads, pooled)
+                try:
+                    # Untimed warm-up: connections, JWKS and first-login imports
+                    asyncio.run(login_burst(base_url, idp, min(args.concurrency, 8), 16))
+                    elapsed, latencies, errors = asyncio.run(
+                        login_burst(base_url, idp, args.concurrency, args.logins)
+                    )
+                finally:
+                    process.terminate()
+                    process.wait(timeout=30)
+                status |= bool(errors)
+                print(f"{mode:<8}{'on' if pooled else 'off':<6}{args.logins / elapsed:>10.1f}{errors:>6}"
+                      f'{percentile(latencies, 0.50) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}'
+                      f'{percentile(latencies, 0.99) * 1000:>9.1f}')
+    finally:
+        idp.stop()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""Load-test driver for the SSO backends
+
+Runs N concurrent login -> API -> logout cycles against one backend,
+in-process through Flask's test client, with the stub IdP standing in
+for Keycloak. Every request is timed and the results are aggregated per
+endpoint into p50/p95/p99 latency and requests per second.
+
+Each backend is loaded in its own process (both are named ``app`` and
+share helper module names), see ``python -m loadtest --help``.
+"""
+
+import base64
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import parse_qs, urlsplit
+
+from loadtest.stub_idp import StubIdP
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIRS = {
+    'saml': os.path.join(REPO_ROOT, 'app1-saml', 'backend'),
+    'oidc': os.path.join(REPO_ROOT, 'app2-oidc', 'backend'),
+}
+
+# Host the SAML SP believes it is served on (matches saml/settings.json)
+SAML_FORWARDED_HOST = 'localhost:3000'
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class LatencyRecorder:
+    """Thread-safe collection of per-endpoint request timings."""
+
+    def __init__(self):
+        self._samples = {}  # endpoint -> list of seconds
+        self._errors = {}
+        self._cookie_bytes = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok, cookie_bytes=0):
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append(seconds)
+            self._cookie_bytes[endpoint] = self._cookie_bytes.get(endpoint, 0) + cookie_bytes
+            if not ok:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def report(self, elapsed):
+        """
+        Summarize the recorded timings.
+
+        Args:
+            elapsed: Wall-clock duration of the run in seconds
+
+        Returns:
+            list: One dict per endpoint with requests, errors, rps, p50/p95/p99
+                (milliseconds) and mean request cookie size in bytes
+        """
+        rows = []
+        with self._lock:
+            for endpoint, samples in self._samples.items():
+                ordered = sorted(samples)
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': len(ordered),
+                    'errors': self._errors.get(endpoint, 0),
+                    'rps': len(ordered) / elapsed if elapsed else 0.0,
+                    'p50_ms': percentile(ordered, 0.50) * 1000,
+                    'p95_ms': percentile(ordered, 0.95) * 1000,
+                    'p99_ms': percentile(ordered, 0.99) * 1000,
+                    'cookie_bytes': self._cookie_bytes.get(endpoint, 0) / len(ordered),
+                })
+        return rows
+
+
+class TimedClient:
+    """Wraps a Flask test client and records the latency of every request."""
+
+    def __init__(self, client, recorder, headers=None):
+        self.client = client
+        self.recorder = recorder
+        self.headers = headers or {}
+
+    def _cookie_bytes(self):
+        cookies = getattr(self.client, '_cookies', None)
+        if cookies is None:
+            return 0
+        return sum(len(cookie.key) + len(cookie.value) + 1 for cookie in cookies.values())
+
+    def request(self, method, path, expect, label=None, **kwargs):
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', {}))
+        cookie_bytes = self._cookie_bytes()
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - start
+        endpoint = label or f'{method} {urlsplit(path).path}'
+        self.recorder.record(endpoint, elapsed, response.status_code in expect, cookie_bytes)
+        return response
+
+
+def _authn_request_id(location):
+    """Extract the AuthnRequest ID from a SAML HTTP-Redirect URL."""
+    query = parse_qs(urlsplit(location).query)
+    xml = zlib.decompress(base64.b64decode(query['SAMLRequest'][0]), -15).decode('utf-8')
+    match = re.search(r'\sID="([^"]+)"', xml)
+    return match.group(1) if match else None
+
+
+class SAMLScenario:
+    """Login/API/logout cycle against the SAML backend."""
+
+    headers = {'X-Forwarded-Host': SAML_FORWARDED_HOST}
+
+    def __init__(self, idp, workdir):
+        with open(os.path.join(BACKEND_DIRS['saml'], 'saml', 'settings.json')) as f:
+            self.settings = idp.saml_settings(json.load(f))
+        settings_dir = os.path.join(workdir, 'saml')
+        os.makedirs(settings_dir, exist_ok=True)
+        with open(os.path.join(settings_dir, 'settings.json'), 'w') as f:
+            json.dump(self.settings, f)
+        os.environ['SAML_SETTINGS_PATH'] = settings_dir
+        self.idp = idp
+
+    def cycle(self, client, username):
+        response = client.request('GET', '/saml/login', expect=(302,))
+        request_id = _authn_request_id(response.headers['Location'])
+        saml_response = self.idp.saml_response(self.settings, username, in_response_to=request_id)
+        client.request('POST', '/saml/callback', expect=(302,), data={'SAMLResponse': saml_response})
+        client.request('GET', '/api/user', expect=(200,))
+        client.request('GET', '/api/protected', expect=(200,))
+        client.request('GET', '/api/editor', expect=(200, 403))
+        client.request('GET', '/api/admin', expect=(200, 403))
+        client.request('GET', '/saml/logout', expect=(302,))
+        client.request('GET', '/saml/sls', expect=(302,))
+
+
+class OIDCScenario:
+    """Login/API/logout cycle against the OIDC backend."""
+
+    headers = {}
+
+    def __init__(self, idp, workdir):
+        os.environ['OIDC_ISSUER'] = idp.issuer
+        os.environ['OIDC_ISSUER_PUBLIC'] = idp.issuer
+        os.environ.setdefault('OIDC_CLIENT_ID', idp.client_id)
+        self.idp = idp
+
+    def cycle(self, client, username):
+        response = client.request('GET', '/oidc/login', expect=(302,))
+        query = parse_qs(urlsplit(response.headers['Location']).query)
+        code = self.idp.issue_code(username, nonce=query.get('nonce', [None])[0])
+        client.request('GET', f"/oidc/callback?code={code}&state={query['state'][0]}", expect=(302,),
+                       label='GET /oidc/callback')
+        client.request('GET', '/api/user', expect=(200,))
+        client.request('GET', '/api/protected', expect=(200,))
+        client.request('GET', '/api/editor', expect=(200, 403))
+        client.request('GET', '/api/admin', expect=(200, 403))
+        client.request('GET', '/oidc/logout', expect=(302,))
+
+
+SCENARIOS = {'saml': SAMLScenario, 'oidc': OIDCScenario}
+
+
+def load_backend(backend):
+    """Import a backend's app module from its directory and return the Flask app."""
+    sys.path.insert(0, BACKEND_DIRS[backend])
+    os.chdir(BACKEND_DIRS[backend])
+    # Every simulated user shares one client IP; measure the backend, not the login rate limit
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    import app as backend_module
+    return backend_module.app
+
+
+def run(backend, concurrency=8, cycles=25, token_latency=0.0, extra_groups=0, warmup=1):
+    """
+    Run concurrent login cycles against one backend.
+
+    Must be called in a fresh process (see module docstring).
+
+    Args:
+        backend: 'saml' or 'oidc'
+        concurrency: Number of simulated users running cycles in parallel
+        cycles: Cycles per simulated user
+        token_latency: Artificial latency of the stub IdP's token endpoint
+        extra_groups: Extra group values in every SAML assertion
+        warmup: Untimed cycles per user before measuring
+
+    Returns:
+        dict: backend, settings, elapsed seconds and per-endpoint rows
+    """
+    idp = StubIdP(token_latency=token_latency, extra_groups=extra_groups).start()
+    workdir = tempfile.mkdtemp(prefix=f'loadtest-{backend}-')
+    scenario = SCENARIOS[backend](idp, workdir)
+    app = load_backend(backend)
+    usernames = sorted(idp.users)
+
+    def worker(index, recorder, count, barrier):
+        client = TimedClient(app.test_client(), recorder, scenario.headers)
+        username = usernames[index % len(usernames)]
+        barrier.wait()
+        for _ in range(count):
+            scenario.cycle(client, username)
+
+    def run_phase(count):
+        recorder = LatencyRecorder()
+        barrier = threading.Barrier(concurrency + 1)
+        threads = [threading.Thread(target=worker, args=(i, recorder, count, barrier))
+                   for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return recorder, time.perf_counter() - start
+
+    try:
+        if warmup:
+            run_phase(warmup)
+        recorder, elapsed = run_phase(cycles)
+    finally:
+        idp.stop()
+
+    return {
+        'backend': backend,
+        'concurrency': concurrency,
+        'cycles': cycles,
+        'token_latency': token_latency,
+        'session_backend': os.environ.get('SESSION_BACKEND', 'memory'),
+        'elapsed': elapsed,
+        'endpoints': recorder.report(elapsed),
+    }
+
+
+def format_report(result):
+    """Render one run's results as a text table."""
+    lines = [
+        f"{result['backend'].upper()} backend - {result['concurrency']} users x {result['cycles']} cycles, "
+        f"sessions={result['session_backend']}, {result['elapsed']:.2f}s",
+        f"{'endpoint':<22}{'reqs':>7}{'errs':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'cookie B':>10}",
+    ]
+    for row in result['endpoints']:
+        lines.append(
+            f"{row['endpoint']:<22}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9.1f}"
+            f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['cookie_bytes']:>10.0f}"
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,313 @@
+"""In-process stub Identity Provider for load tests
+
+Stands in for Keycloak so the SAML and OIDC login flows can be exercised
+without docker-compose, Keycloak or Postgres:
+
+- OIDC: JWKS and token endpoints served over loopback HTTP; ID and access
+  tokens are RS256-signed with a key generated at startup. The token
+  endpoint supports the authorization_code and refresh_token grants.
+- SAML: signed SAML responses minted for the entity IDs and URLs in the
+  SAML backend's saml/settings.json, signed with a generated certificate
+  that replaces the IdP certificate in a copy of those settings.
+
+An optional artificial latency on the token endpoint simulates a remote IdP.
+"""
+
+import base64
+import datetime
+import json
+import secrets
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from jwt.algorithms import RSAAlgorithm
+
+SAML_NS = 'urn:oasis:names:tc:SAML:2.0:assertion'
+SAMLP_NS = 'urn:oasis:names:tc:SAML:2.0:protocol'
+
+# Users the stub IdP can log in; roles end up in realm_access / SAML Role attributes
+DEFAULT_USERS = {
+    'loadtest-admin': {'email': 'admin@example.com', 'roles': ['admin', 'offline_access']},
+    'loadtest-editor': {'email': 'editor@example.com', 'roles': ['editor']},
+    'loadtest-viewer': {'email': 'viewer@example.com', 'roles': ['viewer']},
+}
+
+
+def _saml_instant(when):
+    return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512  # Bursts of concurrent token exchanges (async backend)
+
+
+class StubIdP:
+    """Stub OIDC/SAML identity provider running on a loopback port."""
+
+    def __init__(self, realm_path='/realms/sso-poc', client_id='app2-oidc', users=None,
+                 token_latency=0.0, extra_groups=0):
+        """
+        Args:
+            realm_path: Path prefix of the realm, mirrors Keycloak's URL layout
+            client_id: OIDC client ID the tokens are issued for
+            users: Dict of username -> {'email', 'roles'} (defaults to DEFAULT_USERS)
+            token_latency: Seconds the token endpoint sleeps, to simulate a remote IdP
+            extra_groups: Extra group values added to every SAML assertion and
+                to the realm roles of every OIDC token
+        """
+        self.realm_path = realm_path
+        self.client_id = client_id
+        self.users = users or DEFAULT_USERS
+        self.token_latency = token_latency
+        self.extra_groups = extra_groups
+        self.kid = secrets.token_hex(8)
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.key_pem = self.key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode('ascii')
+        self.cert_pem = self._self_signed_cert()
+        self._codes = {}  # authorization code -> (username, nonce)
+        self._refresh_tokens = {}  # refresh token -> username
+        self._lock = threading.Lock()
+        self._server = None
+        self.counts = {'token': 0, 'refresh': 0, 'jwks': 0}
+
+    def _self_signed_cert(self):
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'stub-idp')])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (x509.CertificateBuilder()
+                .subject_name(name)
+                .issuer_name(name)
+                .public_key(self.key.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now - datetime.timedelta(days=1))
+                .not_valid_after(now + datetime.timedelta(days=365))
+                .sign(self.key, hashes.SHA256()))
+        return cert.public_bytes(serialization.Encoding.PEM).decode('ascii')
+
+    # ------------------------------------------------------------------
+    # Server lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Start serving on 127.0.0.1 on a free port; returns self."""
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if self.close_connection:
+                    # Echo it like Keycloak does, so clients don't pool a socket we are about to close
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if urlsplit(self.path).path == f'{idp.realm_path}/protocol/openid-connect/certs':
+                    idp.counts['jwks'] += 1
+                    self._send_json(200, idp.jwks())
+                else:
+                    self._send_json(404, {'error': 'not_found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                if urlsplit(self.path).path != f'{idp.realm_path}/protocol/openid-connect/token':
+                    self._send_json(404, {'error': 'not_found'})
+                    return
+                if idp.token_latency:
+                    time.sleep(idp.token_latency)
+                status, payload = idp.token_response(form)
+                self._send_json(status, payload)
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, name='stub-idp', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    @property
+    def issuer(self):
+        return self.base_url + self.realm_path
+
+    # ------------------------------------------------------------------
+    # OIDC
+    # ------------------------------------------------------------------
+
+    def jwks(self):
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.key.public_key()))
+        jwk.update({'kid': self.kid, 'alg': 'RS256', 'use': 'sig'})
+        return {'keys': [jwk]}
+
+    def issue_code(self, username, nonce=None):
+        """Return an authorization code for the user, as the authorize endpoint would."""
+        code = secrets.token_urlsafe(24)
+        with self._lock:
+            self._codes[code] = (username, nonce)
+        return code
+
+    def _sign(self, claims):
+        return jwt.encode(claims, self.key, algorithm='RS256', headers={'kid': self.kid})
+
+    def mint_tokens(self, username, nonce=None, lifetime=300):
+        """Build a Keycloak-shaped token response for the user."""
+        user = self.users[username]
+        now = int(time.time())
+        common = {
+            'iss': self.issuer,
+            'sub': f'user-{username}',
+            'iat': now,
+            'exp': now + lifetime,
+            'azp': self.client_id,
+            'sid': f'sid-{username}',
+            'email': user['email'],
+            'preferred_username': username,
+            'name': username,
+            'realm_access': {'roles': list(user['roles']) + [f'group-{i}' for i in range(self.extra_groups)]},
+        }
+        id_claims = dict(common, aud=self.client_id, typ='ID')
+        if nonce:
+            id_claims['nonce'] = nonce
+        access_claims = dict(common, aud='account', typ='Bearer', jti=str(uuid.uuid4()))
+        refresh_token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._refresh_tokens[refresh_token] = username
+        return {
+            'access_token': self._sign(access_claims),
+            'id_token': self._sign(id_claims),
+            'refresh_token': refresh_token,
+            'token_type': 'Bearer',
+            'expires_in': lifetime,
+            'scope': 'openid email profile roles',
+        }
+
+    def token_response(self, form):
+        """Handle a token endpoint request; returns (HTTP status, JSON payload)."""
+        grant_type = form.get('grant_type')
+        with self._lock:
+            if grant_type == 'authorization_code':
+                entry = self._codes.pop(form.get('code'), None)
+            elif grant_type == 'refresh_token':
+                username = self._refresh_tokens.pop(form.get('refresh_token'), None)
+                entry = (username, None) if username else None
+            else:
+                entry = None
+        if entry is None:
+            return 400, {'error': 'invalid_grant'}
+        self.counts['token' if grant_type == 'authorization_code' else 'refresh'] += 1
+        return 200, self.mint_tokens(entry[0], nonce=entry[1])
+
+    # ------------------------------------------------------------------
+    # SAML
+    # ------------------------------------------------------------------
+
+    def saml_settings(self, settings):
+        """Copy of the SP's settings.json with the IdP certificate replaced by the stub's."""
+        settings = json.loads(json.dumps(settings))
+        cert_body = ''.join(line for line in self.cert_pem.splitlines() if '-----' not in line)
+        settings['idp']['x509cert'] = cert_body
+        return settings
+
+    def saml_response(self, settings, username, in_response_to=None, lifetime=300):
+        """
+        Mint a signed, base64-encoded SAMLResponse for the SP described by settings.
+
+        Args:
+            settings: SP settings dict (entity IDs and ACS URL are taken from it)
+            username: User to log in
+            in_response_to: ID of the AuthnRequest being answered
+            lifetime: Seconds the assertion stays valid
+
+        Returns:
+            str: Value for the SAMLResponse form field
+        """
+        from onelogin.saml2.constants import OneLogin_Saml2_Constants
+        from onelogin.saml2.utils import OneLogin_Saml2_Utils
+
+        user = self.users[username]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        issue_instant = _saml_instant(now)
+        not_before = _saml_instant(now - datetime.timedelta(seconds=30))
+        not_on_or_after = _saml_instant(now + datetime.timedelta(seconds=lifetime))
+        idp_entity = settings['idp']['entityId']
+        sp_entity = settings['sp']['entityId']
+        acs_url = settings['sp']['assertionConsumerService']['url']
+        response_id = '_' + uuid.uuid4().hex
+        assertion_id = '_' + uuid.uuid4().hex
+        irt = f' InResponseTo="{in_response_to}"' if in_response_to else ''
+
+        groups = ''.join(
+            f'<saml:AttributeValue>/group-{i}</saml:AttributeValue>' for i in range(self.extra_groups)
+        )
+        roles = ''.join(f'<saml:AttributeValue>{role}</saml:AttributeValue>' for role in user['roles'])
+        attributes = (
+            f'<saml:Attribute Name="username"><saml:AttributeValue>{username}</saml:AttributeValue></saml:Attribute>'
+            f'<saml:Attribute Name="email"><saml:AttributeValue>{user["email"]}</saml:AttributeValue></saml:Attribute>'
+            f'<saml:Attribute Name="Role">{roles}</saml:Attribute>'
+        )
+        if groups:
+            attributes += f'<saml:Attribute Name="groups">{groups}</saml:Attribute>'
+
+        assertion = (
+            f'<saml:Assertion xmlns:saml="{SAML_NS}" ID="{assertion_id}" Version="2.0" IssueInstant="{issue_instant}">'
+            f'<saml:Issuer>{idp_entity}</saml:Issuer>'
+            f'<saml:Subject>'
+            f'<saml:NameID Format="urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified">{username}</saml:NameID>'
+            f'<saml:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:bearer">'
+            f'<saml:SubjectConfirmationData{irt} NotOnOrAfter="{not_on_or_after}" Recipient="{acs_url}"/>'
+            f'</saml:SubjectConfirmation>'
+            f'</saml:Subject>'
+            f'<saml:Conditions NotBefore="{not_before}" NotOnOrAfter="{not_on_or_after}">'
+            f'<saml:AudienceRestriction><saml:Audience>{sp_entity}</saml:Audience></saml:AudienceRestriction>'
+            f'</saml:Conditions>'
+            f'<saml:AuthnStatement AuthnInstant="{issue_instant}" SessionIndex="{uuid.uuid4()}::{username}">'
+            f'<saml:AuthnContext><saml:AuthnContextClassRef>urn:oasis:names:tc:SAML:2.0:ac:classes:unspecified'
+            f'</saml:AuthnContextClassRef></saml:AuthnContext>'
+            f'</saml:AuthnStatement>'
+            f'<saml:AttributeStatement>{attributes}</saml:AttributeStatement>'
+            f'</saml:Assertion>'
+        )
+        signed_assertion = OneLogin_Saml2_Utils.add_sign(
+            assertion, self.key_pem, self.cert_pem,
+            sign_algorithm=OneLogin_Saml2_Constants.RSA_SHA256,
+            digest_algorithm=OneLogin_Saml2_Constants.SHA256
+        )
+        if isinstance(signed_assertion, bytes):
+            signed_assertion = signed_assertion.decode('utf-8')
+        if signed_assertion.startswith('<?xml'):
+            signed_assertion = signed_assertion.split('?>', 1)[1]
+
+        response = (
+            f'<samlp:Response xmlns:samlp="{SAMLP_NS}" xmlns:saml="{SAML_NS}" ID="{response_id}" Version="2.0" '
+            f'IssueInstant="{issue_instant}" Destination="{acs_url}"{irt}>'
+            f'<saml:Issuer>{idp_entity}</saml:Issuer>'
+            f'<samlp:Status><samlp:StatusCode Value="urn:oasis:names:tc:SAML:2.0:status:Success"/></samlp:Status>'
+            f'{signed_assertion}'
+            f'</samlp:Response>'
+        )
+        return base64.b64encode(response.encode('utf-8')).decode('ascii')